@@ -17,22 +17,40 @@ You should have received a copy of the GNU General Public License
 along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
 
-import test_parser
-import test_regexps
 import inspect
+import sys
+import unittest
+
+
+def run_tests():
+    import test_parser
+    import test_regexps
+    import test_engines
+    import test_grep
+    import test_parallel
+    import test_bench
+    import test_vector
+    import test_store
+
+    for test_module in [test_parser, test_regexps, test_engines, test_grep, test_parallel, test_bench, test_vector,
+                        test_store]:
+        tests = inspect.getmembers(test_module, inspect.isfunction)
+        for key, value in tests:
+            if key.startswith("test_"):
+                print("Running: " + key)
+                try:
+                    value()
+                except unittest.SkipTest as skipped:
+                    print("Skipped: " + key + ", " + str(skipped))
 
 
 if __name__ == "__main__":
-    parser_tests = inspect.getmembers(test_parser, inspect.isfunction)
-    for key, value in parser_tests:
-        if key.startswith("test_"):
-            print("Running: " + key)
-            value()
-
-    regexps_tests = inspect.getmembers(test_regexps, inspect.isfunction)
-    for key, value in regexps_tests:
-        if key.startswith("test_"):
-            print("Running: " + key)
-            value()
+    # With no arguments run the tests, otherwise behave like grep:
+    #   python -m spyre [-n] [-c] [-l] [-v] PATTERN FILE...
+    if len(sys.argv) == 1:
+        run_tests()
+    else:
+        import spyre_grep
+        sys.exit(spyre_grep.main(sys.argv[1:]))
 
 
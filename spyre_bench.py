@@ -0,0 +1,416 @@
+#!/usr/bin/python3
+
+"""
+SPYRE - Simple PYthon 3 Regular Expression Engine
+Copyright (C) 2018 Francesco Rigoni - francesco.rigoni@gmail.com
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License v3 as published by
+the Free Software Foundation.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+from spyre_engine import *
+import argparse
+import ast
+import json
+import math
+import os
+import platform
+import random
+import re
+import sys
+import time
+import tracemalloc
+import warnings
+
+
+# Version of the layout of the JSON results
+BENCH_VERSION = 1
+
+DEFAULT_SIZES = (1000, 10000, 100000)
+DEFAULT_REPEAT = 3
+DEFAULT_ENGINES = ("nfa", "dfa")
+
+# A run slower than the baseline by more than this ratio is reported as a regression
+REGRESSION_THRESHOLD = 1.1
+
+
+def regexps_of_tests():
+    """
+    :return: the regexps used by test_regexps.py, read from its source
+    """
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "test_regexps.py")
+    with open(path) as f, warnings.catch_warnings():
+        # The tests write escapes like "\\[" as "\[", which is deprecated
+        warnings.simplefilter("ignore")
+        tree = ast.parse(f.read())
+    regexps = []
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Call) and isinstance(node.func, ast.Name) and \
+                node.func.id in ("match_regexp", "compile") and len(node.args) > 0 and \
+                isinstance(node.args[0], ast.Constant) and isinstance(node.args[0].value, str):
+            regexp = node.args[0].value
+            if len(regexp) > 0 and regexp not in regexps:
+                regexps.append(regexp)
+    return regexps
+
+
+def to_python_regexp(regexp):
+    """
+    :return: a regexp for the re module matching like the SPYRE one.
+             SPYRE's "$" matches only at the very end and "." matches newlines too,
+             the regexp has to be compiled with re.DOTALL.
+    """
+    python_regexp = ""
+    in_brackets = False
+    escape = False
+    for char in regexp:
+        if escape:
+            python_regexp += char
+            escape = False
+        elif char == "\\":
+            python_regexp += char
+            escape = True
+        elif char == "[":
+            in_brackets = True
+            python_regexp += char
+        elif char == "]":
+            in_brackets = False
+            python_regexp += char
+        elif char == "$" and not in_brackets:
+            python_regexp += r"\Z"
+        else:
+            python_regexp += char
+    return python_regexp
+
+
+class Workload:
+    """
+    A benchmark: make(size) returns the regexps and the subject for an input size,
+    operation is "search", "finditer", "set" or "set_lines", a set matched on each line.
+    """
+    def __init__(self, name, make, operation, sizes=None):
+        self.name = name
+        self.make = make
+        self.operation = operation
+        # Sizes of its own, for the workloads the default sizes are too large for
+        self.sizes = sizes
+
+
+def random_text(size, alphabet, seed=0):
+    rnd = random.Random(seed)
+    return "".join(rnd.choice(alphabet) for _ in range(size))
+
+
+def log_text(size, seed=0):
+    rnd = random.Random(seed)
+    levels = ["INFO", "INFO", "INFO", "WARN", "ERROR"]
+    paths = ["/api/users", "/api/orders", "/static/app.js", "/health"]
+    lines = []
+    length = 0
+    while length < size:
+        line = "2018-0" + str(rnd.randint(1, 9)) + "-1" + str(rnd.randint(0, 9)) + " " + \
+               rnd.choice(levels) + " user" + str(rnd.randint(1, 5000)) + " GET " + \
+               rnd.choice(paths) + " " + str(rnd.choice([200, 200, 200, 404, 500])) + "\n"
+        lines.append(line)
+        length += len(line)
+    return "".join(lines)[:size]
+
+
+def make_test_regexps(size):
+    return regexps_of_tests(), random_text(size, "abcdefxyz0123456789.&$^[] ")
+
+
+def make_log_lines(size):
+    return ["ERROR user[0-9]+", "GET /api/[a-z]+ 5[0-9][0-9]", "user4[0-9][0-9][0-9] GET"], log_text(size)
+
+
+def make_late_match(size):
+    return ["abcd[0-9]+", "[a-z]+@[a-z]+[.]com"], "x" * (size - 21) + " abcd12345 me@spy.com"
+
+
+def make_pathological(size):
+    # Quadratic or worse for a backtracking engine, there is no "c" nor "d"
+    return ["[ab]*[ab]*[cd]", "a*a*a*a*[bc]"], "ab" * (size // 2)
+
+
+def make_restarts(size):
+    # Every start position in the run of "a" begins a match attempt failing at its end,
+    # quadratic when they are tried one after the other
+    return ["a*b", "[a-z]*[0-9]"], "a" * (size - 3) + " 1b"
+
+
+def make_exponential(size):
+    # a?^n a^n over a^n, exponential for a backtracking engine
+    return ["a?" * size + "a" * size], "a" * size
+
+
+def make_counted_repeat(size):
+    # Size is the bound of the repetitions, the subject does not change: time should not either
+    return ["user[0-9]{1," + str(size) + "} GET", "[A-Z]{4," + str(size) + "} user"], log_text(20000)
+
+
+def make_counted_window(size):
+    # The repeated class runs over up to size characters at every position, the only "x" is at
+    # the end so the prefilter lets the whole subject through: time should not grow with size
+    return [".{0," + str(size) + "}x"], random_text(20000, "abcdefgh ") + "x"
+
+
+def make_many_patterns(size):
+    regexps = ["user" + str(i) + "[0-9]* logged in" for i in range(50)] + \
+              ["ERROR code" + str(i) for i in range(30)] + \
+              ["GET /api/v" + str(i) + "/[a-z]+" for i in range(20)]
+    return regexps, log_text(size) + "user42 logged in\nGET /api/v7/items"
+
+
+def make_many_regexps(size):
+    # Size is the number of regexps, none of them a plain literal: they all go to the DFA of
+    # the set, whose states grow with them
+    regexps = []
+    for i in range(size):
+        kind = i % 3
+        if kind == 0:
+            regexps.append("user" + str(i) + "[0-9]* GET")
+        elif kind == 1:
+            regexps.append("ERROR user" + str(i) + " [A-Z]+")
+        else:
+            regexps.append("[0-9]+-0" + str(i % 9 + 1) + "-1" + str(i % 10) + " INFO user" + str(i) + "[0-9]")
+    return regexps, log_text(50000)
+
+
+def workloads():
+    return [
+        Workload("test_regexps", make_test_regexps, "search"),
+        Workload("log_lines", make_log_lines, "finditer"),
+        Workload("late_match", make_late_match, "search"),
+        Workload("pathological", make_pathological, "search", sizes=(100, 200, 400)),
+        Workload("restarts", make_restarts, "search", sizes=(500, 1000, 2000)),
+        Workload("exponential", make_exponential, "search", sizes=(8, 12, 16, 20)),
+        Workload("counted_repeat", make_counted_repeat, "finditer", sizes=(10, 100, 1000, 10000)),
+        Workload("counted_window", make_counted_window, "search", sizes=(10, 100, 1000, 4096)),
+        Workload("many_patterns", make_many_patterns, "set"),
+        Workload("many_regexps", make_many_regexps, "set_lines", sizes=(150, 300, 600)),
+    ]
+
+
+def compile_spyre(regexps, operation, engine):
+    if operation in ("set", "set_lines"):
+        return RegexSet(regexps)
+    # Pattern rather than compile(), the cache would hide the compile time
+    return [Pattern(regexp, engine) for regexp in regexps]
+
+
+def compile_python(regexps, operation):
+    re.purge()
+    return [re.compile(to_python_regexp(regexp), re.DOTALL) for regexp in regexps]
+
+
+def run_spyre(compiled, operation, subject):
+    """
+    :return: the result of the operation, comparable with the one of run_python
+    """
+    if operation == "set":
+        return compiled.matches(subject)
+    if operation == "set_lines":
+        return [compiled.matches(line) for line in subject.splitlines()]
+    if operation == "finditer":
+        return [[match.span() for match in pattern.finditer(subject)] for pattern in compiled]
+    results = []
+    for pattern in compiled:
+        match = pattern.search(subject)
+        results.append(match.span() if match is not None else None)
+    return results
+
+
+def run_python(compiled, operation, subject):
+    if operation == "set":
+        return [i for i, pattern in enumerate(compiled) if pattern.search(subject) is not None]
+    if operation == "set_lines":
+        return [[i for i, pattern in enumerate(compiled) if pattern.search(line) is not None]
+                for line in subject.splitlines()]
+    if operation == "finditer":
+        return [[match.span() for match in pattern.finditer(subject)] for pattern in compiled]
+    results = []
+    for pattern in compiled:
+        match = pattern.search(subject)
+        results.append(match.span() if match is not None else None)
+    return results
+
+
+def best_time(function, repeat):
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        function()
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def peak_memory(function):
+    """
+    :return: the peak of the memory allocated while running function, in bytes
+    """
+    tracemalloc.start()
+    try:
+        function()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def measure(compile_function, run_function, subject, repeat):
+    compile_seconds = best_time(compile_function, repeat)
+    compiled = compile_function()
+    seconds = best_time(lambda: run_function(compiled, subject), repeat)
+    return {
+        "compile_seconds": compile_seconds,
+        "seconds": seconds,
+        "chars_per_second": len(subject) / seconds if seconds > 0 else None,
+        "peak_bytes": peak_memory(lambda: run_function(compiled, subject)),
+    }, run_function(compiled, subject)
+
+
+def scaling_exponent(runs):
+    """
+    :return: how the time grows with the input: about 1 for linear, 2 for quadratic
+    """
+    first, last = runs[0], runs[-1]
+    if len(runs) < 2 or first["seconds"] <= 0 or last["size"] == first["size"]:
+        return None
+    return math.log(last["seconds"] / first["seconds"]) / math.log(last["size"] / first["size"])
+
+
+def run_workload(workload, engine, sizes, repeat, baseline=True):
+    """
+    :param baseline: if True measure the re module too
+    :return: the list of the measures, one for each size
+    """
+    runs = []
+    for size in (workload.sizes or sizes):
+        regexps, subject = workload.make(size)
+        spyre_measure, spyre_result = measure(lambda: compile_spyre(regexps, workload.operation, engine),
+                                              lambda compiled, s: run_spyre(compiled, workload.operation, s),
+                                              subject, repeat)
+        spyre_measure["size"] = size
+        spyre_measure["length"] = len(subject)
+        if baseline:
+            python_measure, python_result = measure(lambda: compile_python(regexps, workload.operation),
+                                                    lambda compiled, s: run_python(compiled, workload.operation, s),
+                                                    subject, repeat)
+            spyre_measure["re"] = python_measure
+            spyre_measure["agrees_with_re"] = spyre_result == python_result
+            spyre_measure["speedup_vs_re"] = python_measure["seconds"] / spyre_measure["seconds"] \
+                if spyre_measure["seconds"] > 0 else None
+        runs.append(spyre_measure)
+    return runs
+
+
+def run_benchmarks(engines_to_run=DEFAULT_ENGINES, sizes=DEFAULT_SIZES, repeat=DEFAULT_REPEAT,
+                   names=None, baseline=True):
+    """
+    Runs the workloads named in names, all of them if None.
+    :return: the results, ready to be saved as JSON
+    """
+    results = {}
+    for workload in workloads():
+        if names is not None and workload.name not in names:
+            continue
+        results[workload.name] = {}
+        for engine in engines_to_run:
+            runs = run_workload(workload, engine, sizes, repeat, baseline)
+            results[workload.name][engine] = {"runs": runs, "scaling_exponent": scaling_exponent(runs)}
+    return {
+        "version": BENCH_VERSION,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "repeat": repeat,
+        "results": results,
+    }
+
+
+def format_results(report):
+    lines = []
+    header = "%-16s %-6s %9s %12s %12s %12s %10s %8s" % \
+             ("workload", "engine", "size", "compile ms", "match ms", "chars/s", "peak KB", "vs re")
+    lines.append(header)
+    lines.append("-" * len(header))
+    for name, by_engine in report["results"].items():
+        for engine, result in by_engine.items():
+            for run in result["runs"]:
+                speedup = run.get("speedup_vs_re")
+                lines.append("%-16s %-6s %9d %12.3f %12.3f %12.0f %10.1f %8s" % (
+                    name, engine, run["size"], run["compile_seconds"] * 1000, run["seconds"] * 1000,
+                    run["chars_per_second"] or 0, run["peak_bytes"] / 1024,
+                    ("%.2fx" % speedup) if speedup is not None else "-"))
+            if result["scaling_exponent"] is not None:
+                lines.append("%-16s %-6s scaling exponent %.2f" % (name, engine, result["scaling_exponent"]))
+    return "\n".join(lines)
+
+
+def compare_results(report, baseline, threshold=REGRESSION_THRESHOLD):
+    """
+    :return: list of (workload, engine, size, ratio) for the runs slower than in baseline by
+             more than threshold, ratio being the new time over the old one
+    """
+    regressions = []
+    for name, by_engine in report["results"].items():
+        for engine, result in by_engine.items():
+            old = baseline["results"].get(name, {}).get(engine)
+            if old is None:
+                continue
+            old_runs = dict((run["size"], run) for run in old["runs"])
+            for run in result["runs"]:
+                old_run = old_runs.get(run["size"])
+                if old_run is None or old_run["seconds"] <= 0:
+                    continue
+                ratio = run["seconds"] / old_run["seconds"]
+                if ratio > threshold:
+                    regressions.append((name, engine, run["size"], ratio))
+    return regressions
+
+
+def build_argument_parser():
+    parser = argparse.ArgumentParser(prog="spyre_bench", description="Benchmark SPYRE against the re module")
+    parser.add_argument("--engine", action="append", choices=sorted(engines),
+                        help="an engine to benchmark, can be repeated, defaults to " + ", ".join(DEFAULT_ENGINES))
+    parser.add_argument("--sizes", type=int, nargs="+", default=list(DEFAULT_SIZES), help="the input lengths")
+    parser.add_argument("--repeat", type=int, default=DEFAULT_REPEAT, help="runs per measure, the best is kept")
+    parser.add_argument("--workload", action="append", help="a workload to run, can be repeated, defaults to all")
+    parser.add_argument("--output", help="save the results as JSON to this file")
+    parser.add_argument("--compare", metavar="BASELINE", help="JSON results to report regressions against")
+    return parser
+
+
+def main(argv):
+    """
+    :return: the exit status, 1 if regressions were found comparing to a baseline
+    """
+    arguments = build_argument_parser().parse_args(argv)
+    report = run_benchmarks(tuple(arguments.engine or DEFAULT_ENGINES), tuple(arguments.sizes),
+                            arguments.repeat, arguments.workload)
+    print(format_results(report))
+    if arguments.output is not None:
+        with open(arguments.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+    if arguments.compare is not None:
+        with open(arguments.compare) as f:
+            baseline = json.load(f)
+        regressions = compare_results(report, baseline)
+        for name, engine, size, ratio in regressions:
+            print("regression: %s %s size %d is %.2fx slower" % (name, engine, size, ratio))
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
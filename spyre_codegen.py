@@ -0,0 +1,421 @@
+#!/usr/bin/python3
+
+"""
+SPYRE - Simple PYthon 3 Regular Expression Engine
+Copyright (C) 2018 Francesco Rigoni - francesco.rigoni@gmail.com
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License v3 as published by
+the Free Software Foundation.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+from spyre_nfa import *
+from collections import OrderedDict
+import threading
+
+
+# Loops that may have to give characters back are nested in the generated code, Python
+# allows 20 nested blocks. Patterns needing more run on the Pike VM.
+MAX_BACKTRACKING_LOOPS = 16
+
+# Character classes with at most this many characters are tested with a set lookup
+MAX_SET_SIZE = 64
+
+# Highest code point, and highest byte value
+MAX_CHAR = 0x10FFFF
+MAX_BYTE = 0xFF
+
+# Code objects of the generated sources, compiled once for every pattern with the same source.
+# Least recently used first, the oldest are evicted beyond CODE_CACHE_SIZE.
+CODE_CACHE_SIZE = 256
+code_cache = OrderedDict()
+code_cache_lock = threading.Lock()
+
+
+class CodegenUnsupported(Exception):
+    pass
+
+
+def matcher_ranges(matcher, bytes_mode):
+    """
+    :return: the sorted inclusive ranges of the code points matcher matches. Matchers of
+             unknown type are assumed to match everything.
+    """
+    top = MAX_BYTE if bytes_mode else MAX_CHAR
+    if type(matcher) == CharMatcher:
+        code = matcher.char if bytes_mode else ord(matcher.char)
+        return [(code, code)]
+    char_class = getattr(matcher, "char_class", None)
+    if type(matcher) == AnyMatcher or char_class is None:
+        return [(0, top)]
+    if not char_class.negate:
+        return list(char_class.ranges)
+    ranges = []
+    next_code = 0
+    for start, end in char_class.ranges:
+        if start > next_code:
+            ranges.append((next_code, start - 1))
+        next_code = end + 1
+    if next_code <= top:
+        ranges.append((next_code, top))
+    return ranges
+
+
+def disjoint(ranges, other_ranges):
+    for start, end in ranges:
+        for other_start, other_end in other_ranges:
+            if start <= other_end and other_start <= end:
+                return False
+    return True
+
+
+def elements_of(state_machines):
+    """
+    :return: list of (kind, argument): kind is "literal" with a tuple of characters, "one",
+             "optional", "plus" or "star" with a matcher, or "start" and "end" for anchors
+    """
+    kinds = {
+        SingleMatchStateMachine: "one",
+        ZeroOrOneMatchStateMachine: "optional",
+        OneOrMoreMatchStateMachine: "plus",
+        ZeroOrMoreMatchStateMachine: "star",
+        StartOfStringStateMachine: "start",
+        EndOfStringStateMachine: "end",
+    }
+    elements = []
+    for sm in state_machines:
+        kind = kinds.get(type(sm))
+        if type(sm) == LiteralStateMachine:
+            chars = sm.chars
+        elif kind is None:
+            raise CodegenUnsupported("unsupported state machine " + type(sm).__name__)
+        elif kind == "one" and type(sm.matcher) == CharMatcher:
+            chars = (sm.matcher.char,)
+        else:
+            elements.append((kind, sm.matcher))
+            continue
+        if elements and elements[-1][0] == "literal":
+            elements[-1] = ("literal", elements[-1][1] + chars)
+        else:
+            elements.append(("literal", chars))
+    return elements
+
+
+class CodeGenerator:
+    """
+    Writes the Python source of the match and search functions of a pattern.
+    Each element becomes inlined tests on the string: literal runs are checked with
+    startswith(), loops are while loops. A loop only keeps a for loop to give characters back,
+    backtracking, when what follows it may start with a character the loop matches, and
+    remembers the positions the rest of the pattern already failed from.
+    """
+    def __init__(self, elements, bytes_mode, prefix):
+        self.elements = elements
+        self.bytes_mode = bytes_mode
+        self.prefix = prefix
+        self.lines = []
+        self.constants = {}
+        self.constant_names = {}
+        self.names = 0
+        self.backtracking_loops = 0
+
+    def name(self, base):
+        self.names += 1
+        return base + str(self.names)
+
+    def constant(self, value):
+        """
+        :return: the name of a global of the generated functions holding value
+        """
+        key = value if isinstance(value, frozenset) else id(value)
+        name = self.constant_names.get(key)
+        if name is None:
+            name = self.name("k")
+            self.constant_names[key] = name
+            self.constants[name] = value
+        return name
+
+    def write(self, indent, text):
+        self.lines.append("    " * indent + text)
+
+    def char_test(self, matcher, char):
+        """
+        :return: an expression testing the character expression char against matcher
+        """
+        if type(matcher) == AnyMatcher:
+            return "True"
+        if type(matcher) == CharMatcher:
+            return char + " == " + repr(matcher.char)
+        char_class = getattr(matcher, "char_class", None)
+        if char_class is None:
+            return self.constant(matcher) + ".match(" + char + ")"
+        if self.bytes_mode:
+            return self.constant(char_class.bitmap) + "[" + char + "] == 1"
+        ranges = char_class.ranges
+        size = sum(end - start + 1 for start, end in ranges)
+        if size <= MAX_SET_SIZE:
+            chars = frozenset(chr(code) for start, end in ranges for code in range(start, end + 1))
+            return char + (" not in " if char_class.negate else " in ") + self.constant(chars)
+        if len(ranges) == 1:
+            start, end = ranges[0]
+            test = repr(chr(start)) + " <= " + char + " <= " + repr(chr(end))
+            return "not " + test if char_class.negate else test
+        return self.constant(matcher) + ".match(" + char + ")"
+
+    def literal_test(self, chars, position, fast):
+        literal = bytes(chars) if self.bytes_mode else "".join(chars)
+        if fast:
+            return "string.startswith(" + repr(literal) + ", " + position + ")"
+        return "string[" + position + ":" + position + " + " + str(len(literal)) + "] == " + repr(literal)
+
+    def possessive(self, i, matcher):
+        """
+        :return: True if the loop at i never has to give characters back: what follows it
+                 cannot start with a character it matches, or matches the empty string anywhere
+        """
+        ranges = matcher_ranges(matcher, self.bytes_mode)
+        for kind, argument in self.elements[i + 1:]:
+            if kind == "end":
+                # Only matches at endpos, giving characters back never gets there
+                return True
+            if kind == "start":
+                return False
+            if kind == "literal":
+                first = argument[0] if self.bytes_mode else ord(argument[0])
+                return disjoint(ranges, [(first, first)])
+            if not disjoint(ranges, matcher_ranges(argument, self.bytes_mode)):
+                return False
+            if kind in ("one", "plus"):
+                return True
+        return True
+
+    def sequence(self, i, position, indent, fail, success, fast, searching=False):
+        """
+        Writes the code matching the elements from i on, starting at position.
+        :param fail: the statements run when they cannot match
+        :param success: the statement run when they match, formatted with the end position
+        :param searching: True for the first element of the search loop
+        """
+        if i == len(self.elements):
+            self.write(indent, success % position)
+            return
+        kind, argument = self.elements[i]
+
+        def fail_if(condition):
+            self.write(indent, "if " + condition + ":")
+            for statement in fail:
+                self.write(indent + 1, statement)
+
+        if kind == "start":
+            fail_if(position + " != 0")
+            self.sequence(i + 1, position, indent, fail, success, fast)
+            return
+        if kind == "end":
+            fail_if(position + " != endpos")
+            self.sequence(i + 1, position, indent, fail, success, fast)
+            return
+
+        after = self.name("p")
+        if kind == "literal":
+            fail_if(position + " + " + str(len(argument)) + " > endpos or not " +
+                    self.literal_test(argument, position, fast))
+            self.write(indent, after + " = " + position + " + " + str(len(argument)))
+            self.sequence(i + 1, after, indent, fail, success, fast)
+            return
+        if kind == "one":
+            fail_if(position + " >= endpos or not (" + self.char_test(argument, "string[" + position + "]") + ")")
+            self.write(indent, after + " = " + position + " + 1")
+            self.sequence(i + 1, after, indent, fail, success, fast)
+            return
+
+        if kind == "optional":
+            self.write(indent, after + " = " + position + " + 1 if " + position + " < endpos and (" +
+                       self.char_test(argument, "string[" + position + "]") + ") else " + position)
+        elif type(argument) == AnyMatcher:
+            self.write(indent, after + " = endpos")
+            if kind == "plus":
+                fail_if(after + " == " + position)
+        else:
+            self.write(indent, after + " = " + position)
+            self.write(indent, "while " + after + " < endpos and (" +
+                       self.char_test(argument, "string[" + after + "]") + "):")
+            self.write(indent + 1, after + " += 1")
+            if kind == "plus":
+                fail_if(after + " == " + position)
+        rest_fail = fail
+        if searching and kind in ("star", "plus"):
+            # The starts the loop went over reach the same position and fail the same way
+            rest_fail = ["start = " + after + " + 1", "continue"]
+        if self.possessive(i, argument):
+            self.sequence(i + 1, after, indent, rest_fail, success, fast)
+            return
+
+        self.backtracking_loops += 1
+        if self.backtracking_loops > MAX_BACKTRACKING_LOOPS:
+            raise CodegenUnsupported("too many loops giving characters back")
+        # Down to one character for "+", to none for "*" and "?"
+        stop = position if kind == "plus" else position + " - 1"
+        given_back = self.name("p")
+        self.write(indent, "for " + given_back + " in range(" + after + ", " + stop + ", -1):")
+        # What follows the loop fails from a position independently of how it got there
+        key = "(" + str(i) + ", " + given_back + ")"
+        self.write(indent + 1, "if " + key + " in failed:")
+        self.write(indent + 2, "continue")
+        self.sequence(i + 1, given_back, indent + 1, ["failed.add(" + key + ")", "continue"], success, fast)
+        if not self.lines[-1].lstrip().startswith(("return", "continue")):
+            self.write(indent + 1, "failed.add(" + key + ")")
+        for statement in rest_fail:
+            self.write(indent, statement)
+
+    def functions(self, fast):
+        """
+        Writes the match and search functions.
+        :param fast: if True the string has startswith() and find(), otherwise only slices are used
+        """
+        suffix = "_fast" if fast else "_sliced"
+        self.write(0, "def match" + suffix + "(string, pos, endpos):")
+        self.body(1, lambda: self.sequence(0, "pos", 1, ["return None"], "return pos, %s", fast))
+        self.write(0, "")
+
+        # Matches start from pos up to last
+        self.write(0, "def search" + suffix + "(string, pos, endpos, last):")
+        if self.elements and self.elements[0][0] == "start":
+            # Only a match starting at 0 is possible
+            self.write(1, "return match" + suffix + "(string, pos, endpos) if pos == 0 <= last else None")
+        else:
+            self.body(1, lambda: self.search_loop(fast))
+        self.write(0, "")
+
+    def search_loop(self, fast):
+        self.write(1, "start = pos")
+        if fast and self.prefix:
+            self.write(1, "find_end = min(endpos, last + " + str(len(self.prefix)) + ")")
+        self.write(1, "while start <= last:")
+        if fast and self.prefix:
+            # No match can start before the next occurrence of the prefix
+            self.write(2, "start = string.find(" + repr(self.prefix) + ", start, find_end)")
+            self.write(2, "if start == -1:")
+            self.write(3, "return None")
+        self.sequence(0, "start", 2, ["start += 1", "continue"], "return start, %s", fast, searching=True)
+        self.write(1, "return None")
+
+    def body(self, indent, write_body):
+        """
+        Writes a function body, with the set of the failed positions if it backtracks.
+        """
+        first_line = len(self.lines)
+        loops = self.backtracking_loops
+        write_body()
+        if self.backtracking_loops != loops:
+            self.lines.insert(first_line, "    " * indent + "failed = set()")
+
+    def source(self):
+        self.functions(True)
+        self.functions(False)
+        return "\n".join(self.lines)
+
+
+def generate_source(state_machines, bytes_mode=False, prefix=None):
+    """
+    :return: the Python source of the functions matching the state machines, and the
+             constants it refers to
+    """
+    generator = CodeGenerator(elements_of(state_machines), bytes_mode, prefix)
+    source = generator.source()
+    return source, generator.constants
+
+
+def compile_functions(source, constants):
+    """
+    :return: the namespace holding the functions defined by source. Sources are compiled
+             to code objects once, and cached.
+    """
+    with code_cache_lock:
+        code = code_cache.get(source)
+        if code is not None:
+            code_cache.move_to_end(source)
+    if code is None:
+        # The builtin compile(), spyre_engine has its own
+        code = compile(source, "<spyre codegen>", "exec")
+        with code_cache_lock:
+            code_cache[source] = code
+            while len(code_cache) > CODE_CACHE_SIZE:
+                code_cache.popitem(last=False)
+    namespace = dict(constants)
+    exec(code, namespace)
+    return namespace
+
+
+def clear_code_cache():
+    with code_cache_lock:
+        code_cache.clear()
+
+
+class CodegenBackend:
+    """
+    Matches with Python functions generated for the pattern, compiled once.
+    Patterns the generator cannot handle run on the Pike VM, so do the matches with a
+    budget: the generated functions do not count their steps.
+    """
+    def __init__(self, program, prefilter=None):
+        self.program = program
+        self.prefilter = prefilter
+        self.fallback = None
+        state_machines = program.optimized
+        bytes_mode = any(type(sm.matcher) == ByteClassMatcher or
+                         (type(sm.matcher) == CharMatcher and isinstance(sm.matcher.char, int)) or
+                         (type(sm) == LiteralStateMachine and isinstance(sm.text, bytes))
+                         for sm in state_machines)
+        prefix = prefilter.prefix if prefilter is not None else None
+        try:
+            self.source, constants = generate_source(state_machines, bytes_mode, prefix)
+            namespace = compile_functions(self.source, constants)
+        except (CodegenUnsupported, SyntaxError, RecursionError):
+            self.source = None
+            fallback = self.fallback = PikeVMBackend(program, prefilter)
+            self.match_fast = self.match_sliced = fallback.match
+            return
+        self.match_fast = namespace["match_fast"]
+        self.match_sliced = namespace["match_sliced"]
+        self.search_fast = namespace["search_fast"]
+        self.search_sliced = namespace["search_sliced"]
+
+    def dump(self):
+        """
+        :return: the generated source, or the NFA the Pike VM runs instead
+        """
+        return self.source if self.source is not None else self.fallback.dump()
+
+    def cost(self):
+        if self.source is None:
+            return self.fallback.cost()
+        return restart_cost(self.program.optimized)
+
+    def pike_vm(self):
+        fallback = self.fallback
+        if fallback is None:
+            fallback = self.fallback = PikeVMBackend(self.program, self.prefilter)
+        return fallback
+
+    def match(self, string, pos, endpos, budget=None):
+        if budget is not None:
+            return self.pike_vm().match(string, pos, endpos, budget)
+        if hasattr(string, "startswith"):
+            return self.match_fast(string, pos, endpos)
+        return self.match_sliced(string, pos, endpos)
+
+    def search(self, string, pos, endpos, budget=None, starts_before=None):
+        if budget is not None or self.source is None:
+            return self.pike_vm().search(string, pos, endpos, budget, starts_before)
+        last = endpos if starts_before is None else min(starts_before - 1, endpos)
+        if hasattr(string, "startswith"):
+            return self.search_fast(string, pos, endpos, last)
+        return self.search_sliced(string, pos, endpos, last)
@@ -0,0 +1,417 @@
+#!/usr/bin/python3
+
+"""
+SPYRE - Simple PYthon 3 Regular Expression Engine
+Copyright (C) 2018 Francesco Rigoni - francesco.rigoni@gmail.com
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License v3 as published by
+the Free Software Foundation.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+from spyre_nfa import *
+
+
+# Maximum number of DFA states plus transitions kept in the cache of a LazyDFA
+DEFAULT_MAX_CACHE_ENTRIES = 10000
+
+# The cache is considered to be thrashing when, between two resets, fewer than
+# this many characters per cache entry have been scanned
+THRASHING_CHARS_PER_ENTRY = 10
+
+# Patterns with counted loops above this bound run on the Pike VM: a DFA state holds a count
+# for each thread in a loop, the states would grow with the bound
+DFA_MAX_COUNT = 64
+
+# Pseudo instruction standing for "start a new match at the next position".
+# It is always the last, lowest priority, entry of a DFA state.
+restart_pc = -1
+
+
+class DFAState:
+    """
+    A DFA state: the NFA instructions alive at a position, in priority order.
+    Only instructions that wait for a character or for the end of the string are kept.
+    When the match instruction is reached, lower priority instructions are dropped, that
+    is what gives leftmost-first semantics to the DFA.
+    """
+    __slots__ = ("pcs", "is_match", "transitions")
+
+    def __init__(self, pcs, is_match):
+        self.pcs = pcs
+        self.is_match = is_match
+        self.transitions = {}
+
+
+class ScanCounts:
+    """
+    The characters scanned and the transitions computed by the DFAs during one call, kept
+    for a tracer. Each call counts into its own, the DFAs shared between threads are not
+    written to.
+    """
+    __slots__ = ("chars", "transitions")
+
+    def __init__(self):
+        self.chars = 0
+        self.transitions = 0
+
+
+class LazyDFA:
+    """
+    DFA built from an NFAProgram by subset construction, one state at a time, only when
+    the input actually reaches it.
+    States and transitions are kept in a cache bounded to max_cache_entries. When the cache
+    is full it is flushed, when flushes happen too often the scan goes on without caching,
+    by simulating the NFA directly.
+    A longest DFA keeps the instructions following a match alive, it finds the longest match
+    rather than the leftmost-first one.
+    """
+    def __init__(self, nfa, anchored, max_cache_entries=DEFAULT_MAX_CACHE_ENTRIES, longest=False):
+        self.nfa = nfa
+        self.anchored = anchored
+        self.longest = longest
+        self.max_cache_entries = max_cache_entries
+        self.states = {}
+        self.start_states = {}
+        self.cache_entries = 0
+        self.cache_resets = 0
+        self.fallbacks = 0
+
+    def follow(self, pc, at_start, at_end, out, seen):
+        """
+        Follows the empty transitions from pc, appending the reached instructions to out
+        in priority order.
+        :return: True if the match instruction is reached
+        """
+        nfa = self.nfa
+        matched = False
+        stack = [pc]
+        while stack:
+            pc = stack.pop()
+            if pc in seen:
+                continue
+            seen.add(pc)
+            instruction = nfa.instruction(pc)
+            op = nfa.ops[instruction]
+            if op < op_split:
+                out.append(pc)
+            elif op == op_split:
+                stack.append(nfa.ys[instruction])
+                stack.append(nfa.xs[instruction])
+            elif op == op_jump:
+                stack.append(nfa.xs[instruction])
+            elif op == op_assert_start:
+                if at_start:
+                    stack.append(nfa.xs[instruction])
+            elif op == op_assert_end:
+                if at_end:
+                    stack.append(nfa.xs[instruction])
+                else:
+                    out.append(pc)
+            elif op == op_match:
+                out.append(pc)
+                if not self.longest:
+                    return True
+                matched = True
+            elif op == op_repeat:
+                stack.extend(target for target in reversed(nfa.repeat(pc)) if target is not None)
+        return matched
+
+    def start_pcs(self, at_start):
+        out = []
+        if not self.follow(0, at_start, False, out, set()) and not self.anchored:
+            out.append(restart_pc)
+        return tuple(out)
+
+    def step_pcs(self, pcs, char):
+        """
+        :return: the instructions alive after consuming char
+        """
+        nfa = self.nfa
+        out = []
+        seen = set()
+        for pc in pcs:
+            if pc == restart_pc:
+                if not self.follow(0, False, False, out, seen):
+                    out.append(restart_pc)
+                break
+            if nfa.ops[nfa.instruction(pc)] < op_split and nfa.accepts(pc, char):
+                if self.follow(nfa.successor(pc), False, False, out, seen) and not self.longest:
+                    break
+        return tuple(out)
+
+    def matches_at_end(self, pcs, at_start):
+        """
+        :return: True if the instructions alive at the end of the string lead to a match
+        """
+        nfa = self.nfa
+        seen = set()
+        for pc in pcs:
+            op = nfa.ops[nfa.instruction(pc)] if pc != restart_pc else None
+            if op == op_match:
+                return True
+            if op == op_assert_end and self.follow(nfa.xs[pc], at_start, True, [], seen):
+                return True
+        return False
+
+    def is_match_pcs(self, pcs):
+        if self.longest:
+            return self.nfa.match_pc in pcs
+        return len(pcs) > 0 and pcs[-1] == self.nfa.match_pc
+
+    def reset_cache(self):
+        self.states = {}
+        self.start_states = {}
+        self.cache_entries = 0
+        self.cache_resets += 1
+
+    def intern(self, pcs):
+        state = self.states.get(pcs)
+        if state is None:
+            if self.cache_entries >= self.max_cache_entries:
+                self.reset_cache()
+            state = DFAState(pcs, self.is_match_pcs(pcs))
+            self.states[pcs] = state
+            self.cache_entries += 1
+        return state
+
+    def start_state(self, at_start):
+        state = self.start_states.get(at_start)
+        if state is None:
+            state = self.intern(self.start_pcs(at_start))
+            self.start_states[at_start] = state
+        return state
+
+    def compute_transition(self, state, char):
+        next_state = self.intern(self.step_pcs(state.pcs, char))
+        state.transitions[char] = next_state
+        self.cache_entries += 1
+        return next_state
+
+    def scan(self, string, pos, endpos, prefix=None, budget=None, starts_before=None, counts=None):
+        """
+        Runs the DFA from pos.
+        :param prefix: literal every match starts with, used to skip to the next candidate
+                       position while no match is in progress
+        :param budget: Budget spent with one step for each character, and one for each NFA
+                       instruction when a transition is computed. It is checked between
+                       stretches of the string, not at every character.
+        :param starts_before: no match may start at or after this position, the matches
+                              started before it are still followed up to endpos
+        :param counts: ScanCounts the characters scanned and the transitions computed are
+                       added to, None when nobody traces the scan
+        :return: the end of the leftmost-first match, or None if there is no match
+        """
+        state = self.start_state(pos == 0)
+        idle = self.start_state(False) if prefix and not self.anchored else None
+        last_end = pos if state.is_match else None
+        resets = self.cache_resets
+        entries_before_reset = self.cache_entries
+        scanned = 0
+        # Characters the prefix search went past
+        found_past = 0
+        i = pos
+        # Up to limit new matches may start, the state there is the last holding a restart
+        limit = endpos if starts_before is None else min(starts_before - 1, endpos)
+        stop = limit if budget is None else budget.stop(i, limit)
+        while True:
+            stretch = i
+            while i < stop:
+                if not state.pcs:
+                    if counts is not None:
+                        counts.chars += i - pos - found_past
+                    return last_end
+                if state is idle:
+                    found = string.find(prefix, i, min(endpos, limit + len(prefix)))
+                    if found == -1:
+                        if counts is not None:
+                            counts.chars += i - pos - found_past
+                        return last_end
+                    found_past += found - i
+                    i = found
+                    if i >= stop:
+                        break
+                char = string[i]
+                next_state = state.transitions.get(char)
+                if next_state is None:
+                    if budget is not None:
+                        budget.spend(len(state.pcs), i)
+                    next_state = self.compute_transition(state, char)
+                    if counts is not None:
+                        counts.transitions += 1
+                    if self.cache_resets != resets:
+                        if scanned < THRASHING_CHARS_PER_ENTRY * entries_before_reset:
+                            # The cache does not pay off for this input, go on with the slow path
+                            self.fallbacks += 1
+                            if counts is not None:
+                                counts.chars += i + 1 - pos - found_past
+                            return self.scan_uncached(string, i + 1, endpos, next_state.pcs, last_end, budget,
+                                                      limit if limit < endpos else None, counts)
+                        resets = self.cache_resets
+                        scanned = 0
+                        if idle is not None:
+                            idle = self.start_state(False)
+                    entries_before_reset = self.cache_entries
+                state = next_state
+                i += 1
+                scanned += 1
+                if state.is_match:
+                    last_end = i
+            if i >= limit:
+                if limit == endpos:
+                    break
+                # No match starts past here, the ones already started go on up to endpos
+                if state.pcs and state.pcs[-1] == restart_pc:
+                    state = self.intern(state.pcs[:-1])
+                idle = None
+                limit = endpos
+            if budget is not None:
+                budget.spend(i - stretch, i)
+                stop = budget.stop(i, limit)
+            else:
+                stop = limit
+
+        if counts is not None:
+            counts.chars += i - pos - found_past
+        if state.pcs and self.matches_at_end(state.pcs, endpos == 0):
+            last_end = endpos
+        return last_end
+
+    def scan_reverse(self, string, end, pos, endpos, budget=None, counts=None):
+        """
+        Runs the DFA of a reversed NFA backwards, from end down to pos.
+        :param endpos: where the string is considered to end, "$" only matches there
+        :param budget: Budget spent with one step for each character
+        :param counts: ScanCounts, or None, as for scan()
+        :return: the start of the longest match ending at end, or None if there is none
+        """
+        state = self.start_state(end == endpos)
+        first_start = end if state.is_match else None
+        i = end
+        while i > pos:
+            if not state.pcs:
+                if counts is not None:
+                    counts.chars += end - i
+                return first_start
+            i -= 1
+            if budget is not None:
+                budget.spend(1, i)
+            char = string[i]
+            next_state = state.transitions.get(char)
+            if next_state is None:
+                next_state = self.compute_transition(state, char)
+                if counts is not None:
+                    counts.transitions += 1
+            state = next_state
+            if state.is_match:
+                first_start = i
+
+        if counts is not None:
+            counts.chars += end - i
+        # "^" is at the end of the reversed NFA, it only matches at the very start of the string
+        if i == 0 and state.pcs and self.matches_at_end(state.pcs, end == 0 and end == endpos):
+            first_start = 0
+        return first_start
+
+    def scan_uncached(self, string, i, endpos, pcs, last_end, budget=None, last_start=None, counts=None):
+        """
+        Continues a scan simulating the NFA, without touching the cache.
+        :param last_start: last position where a new match may start
+        """
+        if self.is_match_pcs(pcs):
+            last_end = i
+        start = i
+        while i < endpos:
+            if i == last_start and pcs and pcs[-1] == restart_pc:
+                pcs = pcs[:-1]
+            if not pcs:
+                if counts is not None:
+                    counts.chars += i - start
+                return last_end
+            if budget is not None:
+                budget.spend(len(pcs), i)
+            pcs = self.step_pcs(pcs, string[i])
+            if counts is not None:
+                counts.transitions += 1
+            i += 1
+            if self.is_match_pcs(pcs):
+                last_end = i
+
+        if counts is not None:
+            counts.chars += i - start
+        if pcs and self.matches_at_end(pcs, endpos == 0):
+            last_end = endpos
+        return last_end
+
+
+class DFABackend:
+    """
+    Matches using lazy DFAs: an unanchored one finds where the leftmost match ends, one
+    running the reversed NFA backwards from there finds where it starts.
+    Patterns with counted loops above DFA_MAX_COUNT run on the Pike VM.
+    """
+    def __init__(self, program, prefilter=None, max_cache_entries=DEFAULT_MAX_CACHE_ENTRIES, nfa=None,
+                 reverse_nfa=None):
+        """
+        :param nfa: the NFA of program, and reverse_nfa the reversed one, when they are
+                    compiled already
+        """
+        self.nfa = nfa if nfa is not None else compile_nfa(program.optimized)
+        self.pike_vm = PikeVMBackend(program, prefilter, self.nfa) if self.nfa.largest_count() > DFA_MAX_COUNT \
+            else None
+        self.prefix = prefilter.prefix if prefilter is not None else None
+        self.forward = LazyDFA(self.nfa, False, max_cache_entries)
+        self.anchored = LazyDFA(self.nfa, True, max_cache_entries)
+        # The NFA is compiled now, the patterns do not keep their state machines, its DFA is
+        # built by the first search finding a match
+        self.reverse_nfa = reverse_nfa if reverse_nfa is not None else compile_reverse_nfa(program.optimized)
+        self.max_cache_entries = max_cache_entries
+        self.reverse = None
+
+    def dump(self):
+        return self.nfa.dump()
+
+    def cost(self):
+        if self.pike_vm is not None:
+            return self.pike_vm.cost()
+        # A character is read once forward and once backwards, a state of either DFA is
+        # computed from at most every instruction with every count
+        return Cost(2 * state_bound(self.nfa), 1)
+
+    def reverse_dfa(self):
+        reverse = self.reverse
+        if reverse is None:
+            reverse = self.reverse = LazyDFA(self.reverse_nfa, True, self.max_cache_entries, longest=True)
+        return reverse
+
+    def match(self, string, pos, endpos, budget=None, counts=None):
+        """
+        :param counts: ScanCounts the DFAs count into, for a tracer
+        """
+        if self.pike_vm is not None:
+            return self.pike_vm.match(string, pos, endpos, budget)
+        end = self.anchored.scan(string, pos, endpos, None, budget, None, counts)
+        return (pos, end) if end is not None else None
+
+    def search(self, string, pos, endpos, budget=None, starts_before=None, counts=None):
+        if self.pike_vm is not None:
+            return self.pike_vm.search(string, pos, endpos, budget, starts_before)
+        if starts_before is not None and starts_before <= pos:
+            return None
+        prefix = self.prefix if searchable(string) else None
+        end = self.forward.scan(string, pos, endpos, prefix, budget, starts_before, counts)
+        if end is None:
+            return None
+        # The leftmost match ends at end. No match starts before it, so it starts at the
+        # first position from which the string up to end matches: the longest match of
+        # the reversed NFA, read backwards from end.
+        start = self.reverse_dfa().scan_reverse(string, end, pos, endpos, budget, counts)
+        return start, end
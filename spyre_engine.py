@@ -18,71 +18,635 @@ along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
 
 from spyre_parser import *
+from spyre_optimizer import *
+from spyre_dfa import *
+from spyre_codegen import *
+from spyre_prefilter import *
+from spyre_stream import *
+from spyre_set import *
+from spyre_trace import *
+from spyre_limits import *
+from collections import OrderedDict, namedtuple
+import copy
+import threading
+import time
 
 
-def remove_prefix(s, prefix):
-    return s[len(prefix):] if s.startswith(prefix) else s
+DEFAULT_CACHE_SIZE = 128
 
+DEFAULT_ENGINE = "nfa"
 
-def match_regexp(regexp, string):
-    state_machines = parse_regexp(regexp)
-    matched_string = None
-    current_sm = 0
-    current_char = 0
 
-    while current_sm < len(state_machines):
+class Program:
+    """
+    The immutable, compiled form of a regexp: the state machines built by parse_regexp,
+    and the optimized ones the engines run.
+    A program never changes after construction, all the state of a match is kept in a
+    MatchCursor, so the same program can serve concurrent matches without locking.
+    """
+    __slots__ = ("state_machines", "optimized")
+
+    def __init__(self, state_machines):
+        object.__setattr__(self, "state_machines", tuple(state_machines))
+        object.__setattr__(self, "optimized", tuple(optimize(self.state_machines)))
+
+    def __setattr__(self, name, value):
+        raise AttributeError("Program is immutable")
+
+    def __len__(self):
+        return len(self.state_machines)
+
+    def new_cursor(self, start=0):
+        return MatchCursor(len(self.state_machines), start)
+
+
+class RegexpProgram(Program):
+    """
+    The Program of a regexp, parsed the first time its state machines are asked for.
+    Patterns keep it rather than their state machines, engines only need those to build
+    themselves: only the patterns that are traced, streamed, saved or debugged hold them.
+    Two threads asking at once may both parse, either result is kept, they are equivalent.
+    """
+    __slots__ = ("regexp", "parsed", "parsed_optimized")
+
+    def __init__(self, regexp):
+        object.__setattr__(self, "regexp", regexp)
+        object.__setattr__(self, "parsed", None)
+        object.__setattr__(self, "parsed_optimized", None)
+
+    @property
+    def state_machines(self):
+        parsed = self.parsed
+        if parsed is None:
+            parsed = tuple(parse_regexp(self.regexp))
+            object.__setattr__(self, "parsed", parsed)
+        return parsed
+
+    @property
+    def optimized(self):
+        optimized = self.parsed_optimized
+        if optimized is None:
+            optimized = tuple(optimize(self.state_machines))
+            object.__setattr__(self, "parsed_optimized", optimized)
+        return optimized
+
+
+class MatchCursor:
+    """
+    The state of a single match attempt against a Program.
+    Positions are indexes into the subject string, which is never copied.
+    """
+    __slots__ = ("match_states", "current_sm", "start", "sm_start", "position")
+
+    def __init__(self, size, start):
+        self.match_states = [MatchState() for _ in range(size)]
+        self.current_sm = 0
+        # Where the whole match starts
+        self.start = start
+        # Where the match of the current state machine starts
+        self.sm_start = start
+        # Next character to process
+        self.position = start
+
+    def restart(self, start):
+        """
+        Starts the match attempt again from start.
+        """
+        for match_state in self.match_states:
+            match_state.reset()
+        self.current_sm = 0
+        self.start = start
+        self.sm_start = start
+        self.position = start
+
+
+class Match:
+    """
+    The result of a successful match: the subject string and the span of the match.
+    The matched text is sliced only when asked for.
+    """
+    __slots__ = ("string", "pos", "endpos", "_start", "_end")
+
+    def __init__(self, string, start, end, pos=0, endpos=None):
+        self.string = string
+        self.pos = pos
+        self.endpos = len(string) if endpos is None else endpos
+        self._start = start
+        self._end = end
+
+    def __repr__(self):
+        return "<Match span=" + str(self.span()) + " match=" + repr(self.group()) + ">"
+
+    def start(self):
+        return self._start
+
+    def end(self):
+        return self._end
+
+    def span(self):
+        return self._start, self._end
+
+    def group(self):
+        return self.string[self._start:self._end]
+
+
+def run_program(program, string, anchored, pos, endpos, budget=None, starts_before=None):
+    """
+    Runs a program against a string, walking it by index.
+    :param program: the Program to run
+    :param string: the string to match
+    :param anchored: if True the match has to start exactly at pos
+    :param pos: where to start matching
+    :param endpos: where the string is considered to end
+    :param budget: Budget spent with one step for each event sent to a state machine
+    :param starts_before: no match may start at or after this position
+    :return: the (start, end) span of the match or None
+    """
+    last = endpos if starts_before is None else min(starts_before - 1, endpos)
+    if pos > last:
+        return None
+    state_machines = program.state_machines
+    cursor = program.new_cursor(pos)
+    match_states = cursor.match_states
+
+    while True:
+        run_attempt(state_machines, cursor, string, anchored, endpos, last, budget)
+        # Check if all machines match, the match ends where the last state machine stopped consuming
+        if all(match_state.is_match() for match_state in match_states):
+            end = cursor.start
+            for match_state in match_states:
+                end += match_state.matched_length
+            return cursor.start, end
+        if anchored or cursor.start >= last:
+            return None
+        # A state machine after the first one failed: the next start position may still match
+        cursor.restart(cursor.start + 1)
+
+
+def run_attempt(state_machines, cursor, string, anchored, endpos, last, budget):
+    """
+    Runs the state machines from the start of the cursor until one of them fails, they all
+    match or the string ends. Starts again further on, up to last, while the first one fails
+    at once.
+    """
+    match_states = cursor.match_states
+    while cursor.current_sm < len(state_machines):
+        current_sm = cursor.current_sm
+        sm = state_machines[current_sm]
+        match_state = match_states[current_sm]
+        if budget is not None:
+            budget.spend(1, cursor.position)
+
         # The following conditional block deals with sending the meta events to the current
         # state machine (start of string, end of string, ...)
-        if current_char == 0 and current_sm == 0:
+        if cursor.position == 0 and current_sm == 0:
             # Propagate start of string event
-            state_machines[current_sm].start_of_string()
+            sm.start_of_string(match_state)
 
-        if current_char == len(string):
+        if cursor.position >= endpos and not match_state.is_match():
             # If end of string is reached, all remaining state machines have to be informed
             # So they can succeed (for optional matches) or fail (for mandatory matches)
             # Check is performed at the beginning to correctly handle an empty string
-            [sm.end_of_string() for sm in state_machines[current_sm:]]
+            for i in range(current_sm, len(state_machines)):
+                state_machines[i].end_of_string(match_states[i])
             break
 
         # The following conditional block deals with checking the status of the current state machine
         # after the meta events from the first conditional are processed.
         # Characters events are processed here.
-        if state_machines[current_sm].is_initial():
+        if match_state.is_initial():
             # Process next character
-            state_machines[current_sm].process(string[current_char])
+            if type(sm) == LiteralStateMachine:
+                # The whole run at once, it failed on its first character only if that differs
+                sm.process_text(match_state, string, cursor.position, endpos)
+                failed_first = match_state.is_fail() and string[cursor.position] != sm.chars[0]
+            else:
+                sm.process(match_state, string[cursor.position])
+                failed_first = match_state.is_fail()
 
             # If the first state machine fails processing the very first character
-            # then it is not considered as a failure, that state machine gets reset and the not maching
-            # character is removed from the string.
+            # then it is not considered as a failure, that state machine gets reset and the
+            # match is attempted again from the next character.
             # This is to allow matching in a position different than the very beginning of the
-            # string.
-            if state_machines[current_sm].is_fail() and current_char == 0 and current_sm == 0:
-                state_machines[current_sm].reset()
-                string = string[1:]
+            # string. Anchored matches are not allowed to skip characters.
+            if failed_first and cursor.position == cursor.sm_start and current_sm == 0 \
+                    and not anchored:
+                match_state.reset()
+                if type(sm) == LiteralStateMachine and searchable(string):
+                    # Straight to the next position the run may start at
+                    cursor.start = string.find(sm.text[:1], cursor.start + 1, endpos)
+                    if cursor.start == -1:
+                        cursor.start = endpos
+                else:
+                    cursor.start = cursor.start + 1
+                if cursor.start > last:
+                    break
+                cursor.sm_start = cursor.start
+                cursor.position = cursor.start
             else:
                 # Otherwise proceed to the next character
-                current_char = current_char + 1
+                cursor.position = cursor.position + 1
 
-        elif state_machines[current_sm].is_looping():
+        elif match_state.is_looping():
             # Still looping, go on to the next character
-            state_machines[current_sm].process(string[current_char])
-            current_char = current_char + 1
-        elif state_machines[current_sm].is_match():
-            # When a match is found, remove the matched string from the beginning of
-            # the main string
-            string = remove_prefix(string, state_machines[current_sm].matched_string)
-            # The go on to the next state machine and reset the char position since the
-            # prefix has been removed
-            current_sm = current_sm + 1
-            current_char = 0
-        elif state_machines[current_sm].is_fail():
+            sm.process(match_state, string[cursor.position])
+            cursor.position = cursor.position + 1
+        elif match_state.is_match():
+            # When a match is found the next state machine starts right after the
+            # characters consumed by this one
+            cursor.sm_start = cursor.sm_start + match_state.matched_length
+            cursor.position = cursor.sm_start
+            cursor.current_sm = current_sm + 1
+        elif match_state.is_fail():
             # Or just exit if the current state machine failed
             break
 
-    # Check if all machines match and build the matched string
-    if all(state_machine.is_match() for state_machine in state_machines):
-        matched_string = ""
-        for sm in state_machines:
-            matched_string += sm.matched_string
 
-    return matched_string
+class StateMachineBackend:
+    """
+    Matches by running the state machines built by parse_regexp, optimized.
+    Each state machine consumes greedily and never gives characters back.
+    """
+    def __init__(self, program, prefilter=None):
+        self.program = Program(optimize(program.state_machines, rewrite_loops=False))
+
+    def dump(self):
+        return dump_state_machines(self.program.state_machines)
+
+    def cost(self):
+        return restart_cost(self.program.state_machines)
+
+    def match(self, string, pos, endpos, budget=None):
+        return run_program(self.program, string, True, pos, endpos, budget)
+
+    def search(self, string, pos, endpos, budget=None, starts_before=None):
+        return run_program(self.program, string, False, pos, endpos, budget, starts_before)
+
+
+engines = {
+    "nfa": PikeVMBackend,
+    "dfa": DFABackend,
+    "codegen": CodegenBackend,
+    "statemachine": StateMachineBackend,
+}
+
+
+class TracedBackend:
+    """
+    Runs the engine of a pattern on copies of its state machines reporting to a tracer,
+    and times every call. Only the patterns with a tracer installed go through it.
+    Calls the prefilter rejects never reach the backend and are not traced.
+    """
+    def __init__(self, pattern, tracer):
+        self.pattern = pattern
+        self.tracer = tracer
+        self.untraced = pattern.backend
+        program = Program(traced_state_machines(pattern.program.state_machines, tracer, pattern))
+        self.backend = engines[pattern.engine](program, pattern.prefilter)
+
+    def cache_resets(self):
+        """
+        :return: the cache resets of the DFAs of the engine, 0 for the engines without DFA
+        """
+        dfas = [getattr(self.backend, name, None) for name in ("forward", "anchored", "reverse")]
+        return sum(dfa.cache_resets for dfa in dfas if dfa is not None)
+
+    def run(self, operation, string, pos, endpos, budget, starts_before=None):
+        self.tracer.begin(self.pattern, operation, string, pos, endpos)
+        resets = self.cache_resets()
+        # Only the DFAs count the characters they scan, into this call's own counts
+        counts = ScanCounts() if isinstance(self.backend, DFABackend) else None
+        started = time.perf_counter()
+        if counts is None:
+            span = self.backend.match(string, pos, endpos, budget) if operation == "match" \
+                else self.backend.search(string, pos, endpos, budget, starts_before)
+        elif operation == "match":
+            span = self.backend.match(string, pos, endpos, budget, counts)
+        else:
+            span = self.backend.search(string, pos, endpos, budget, starts_before, counts)
+        seconds = time.perf_counter() - started
+        if operation == "match":
+            skipped = 0
+        else:
+            skipped = (span[0] if span is not None else endpos + 1) - pos
+        if counts is not None and (counts.chars or counts.transitions):
+            self.tracer.scan(self.pattern, counts.chars, counts.transitions)
+        self.tracer.end(self.pattern, operation, span, seconds, skipped, self.cache_resets() - resets)
+        return span
+
+    def dump(self):
+        return self.backend.dump()
+
+    def cost(self):
+        return self.backend.cost()
+
+    def match(self, string, pos, endpos, budget=None):
+        return self.run("match", string, pos, endpos, budget)
+
+    def search(self, string, pos, endpos, budget=None, starts_before=None):
+        return self.run("search", string, pos, endpos, budget, starts_before)
+
+
+class Pattern:
+    """
+    A compiled regexp. Parsing happens once, the pattern can then be used to match
+    any number of strings, also from multiple threads at the same time.
+    """
+    def __init__(self, regexp, engine=DEFAULT_ENGINE, state_machines=None, prefilter=None,
+                 max_steps=None, timeout=None, backend=None):
+        """
+        :param state_machines: the state machines of regexp, when they are already known,
+                               parsing is skipped
+        :param prefilter: their Prefilter, when it is already known
+        :param backend: the engine built already, with prefilter, nothing is parsed nor compiled
+        :param max_steps: the most steps of a match or a search, each call of the finditer loop
+                          counting as one search, a step being a character examined by a thread
+                          of the NFA, a DFA or a state machine
+        :param timeout: the most seconds of a match or a search, the clock is read every
+                        DEADLINE_CHECK_STEPS steps
+        Beyond the limits matches and searches raise MatchLimitExceeded. With no limits, the
+        default, matching runs exactly the same code as before. Matches with limits on a
+        "codegen" pattern run on the Pike VM. The limits of a pattern never change, patterns
+        are shared through the cache of compile().
+        """
+        if engine not in engines:
+            raise ValueError("Unknown engine " + repr(engine) + ", expected one of " + ", ".join(engines))
+        self.pattern = regexp
+        self.engine = engine
+        self.bytes_mode = isinstance(regexp, (bytes, bytearray))
+        if backend is None:
+            program = Program(state_machines if state_machines is not None else parse_regexp(regexp))
+            if prefilter is None:
+                prefilter = build_prefilter(program.state_machines, self.bytes_mode)
+            backend = engines[engine](program, prefilter)
+        self.prefilter = prefilter
+        self.backend = backend
+        # The engine holds what it runs, the state machines are parsed again if ever needed
+        self.program = RegexpProgram(regexp)
+        self.tracer = None
+        self.limits = Limits(max_steps, timeout) if max_steps is not None or timeout is not None else None
+
+    def __repr__(self):
+        return "Pattern(" + repr(self.pattern) + ", engine=" + repr(self.engine) + ")"
+
+    def with_tracer(self, tracer):
+        """
+        :return: a copy of this pattern, sharing what it compiled, whose matches and searches
+                 report to a Tracer, None for a copy without tracer. Patterns without a tracer
+                 run exactly the same code as before, untraced matching costs nothing more.
+        """
+        pattern = copy.copy(self)
+        install_tracer(pattern, tracer)
+        return pattern
+
+    def with_limits(self, max_steps=None, timeout=None):
+        """
+        :return: a copy of this pattern, sharing what it compiled, with other limits, see
+                 Pattern(), none for a copy without limits
+        """
+        pattern = copy.copy(self)
+        pattern.limits = Limits(max_steps, timeout) if max_steps is not None or timeout is not None else None
+        # The tracer of the copy reports it rather than this pattern
+        install_tracer(pattern, self.tracer)
+        return pattern
+
+    def cost(self):
+        """
+        :return: the Cost statically estimated for a match or a search with the engine
+                 of the pattern, to reject the expensive ones before running them
+        """
+        return self.backend.cost()
+
+    def debug(self):
+        """
+        :return: what runs when matching: the optimized state machines, then the program
+                 of the engine, NFA instructions or generated source
+        """
+        lines = [repr(self)]
+        if self.engine != "statemachine":
+            # The statemachine engine optimizes them its own way
+            lines += ["state machines:", dump_state_machines(self.program.optimized)]
+        lines += [self.engine + ":", self.backend.dump()]
+        return "\n".join(lines)
+
+    def check_subject(self, string):
+        """
+        str patterns match str, bytes patterns match bytes, bytearray, memoryview and mmap.
+        """
+        if isinstance(string, str) == self.bytes_mode:
+            if self.bytes_mode:
+                raise TypeError("cannot use a bytes pattern on a string")
+            raise TypeError("cannot use a string pattern on a bytes-like object")
+
+    def match(self, string, pos=0, endpos=None):
+        """
+        Matches the pattern at position pos of the string only.
+        :return: a Match or None
+        """
+        self.check_subject(string)
+        endpos = len(string) if endpos is None else min(endpos, len(string))
+        if self.prefilter.rejects_at(string, pos, endpos):
+            return None
+        if self.limits is None:
+            span = self.backend.match(string, pos, endpos)
+        else:
+            span = self.backend.match(string, pos, endpos, self.limits.budget())
+        return Match(string, span[0], span[1], pos, endpos) if span is not None else None
+
+    def search(self, string, pos=0, endpos=None, starts_before=None):
+        """
+        Looks for the first occurrence of the pattern in the string.
+        :param starts_before: if given, only a match starting before it is looked for, the
+                              search stops there unless a match in progress reads further
+        :return: a Match or None
+        """
+        self.check_subject(string)
+        endpos = len(string) if endpos is None else min(endpos, len(string))
+        if self.prefilter.rejects(string, pos, endpos):
+            return None
+        if self.limits is None:
+            span = self.backend.search(string, pos, endpos, None, starts_before)
+        else:
+            span = self.backend.search(string, pos, endpos, self.limits.budget(), starts_before)
+        return Match(string, span[0], span[1], pos, endpos) if span is not None else None
+
+    def finditer(self, string, pos=0, endpos=None, starts_before=None):
+        """
+        Generates all the non overlapping matches, left to right.
+        Every search resumes where the previous match ended, the string is never copied.
+        :param starts_before: if given, only the matches starting before it are generated
+        """
+        self.check_subject(string)
+        endpos = len(string) if endpos is None else min(endpos, len(string))
+        while pos <= endpos:
+            if self.prefilter.rejects(string, pos, endpos):
+                return
+            if self.limits is None:
+                span = self.backend.search(string, pos, endpos, None, starts_before)
+            else:
+                span = self.backend.search(string, pos, endpos, self.limits.budget(), starts_before)
+            if span is None:
+                return
+            yield Match(string, span[0], span[1], pos, endpos)
+            # An empty match would be found again at the same position, step over it
+            pos = span[1] if span[1] > span[0] else span[1] + 1
+
+    def findall(self, string, pos=0, endpos=None):
+        """
+        :return: the list of all the matched strings
+        """
+        return [match.group() for match in self.finditer(string, pos, endpos)]
+
+    def stream(self):
+        """
+        :return: a StreamMatcher, to match over input that arrives in chunks
+        """
+        return StreamMatcher(self)
+
+    def afinditer(self, source, slice_size=ASYNC_SLICE_SIZE):
+        """
+        Finds the matches over data arriving asynchronously: async for match in pattern.afinditer(reader)
+        :param source: an asyncio.StreamReader, or an async iterable of chunks
+        :return: an async generator of StreamMatch
+        """
+        return stream_afinditer(self, source, slice_size)
+
+
+CacheInfo = namedtuple("CacheInfo", ["hits", "misses", "maxsize", "currsize"])
+
+
+def install_tracer(pattern, tracer):
+    """
+    Makes the matches and searches of a pattern report to a tracer, None stops them.
+    Only for the patterns of a single user, see Pattern.with_tracer() and set_tracer().
+    """
+    if isinstance(pattern.backend, TracedBackend):
+        pattern.backend = pattern.backend.untraced
+    pattern.tracer = tracer
+    if tracer is not None:
+        pattern.backend = TracedBackend(pattern, tracer)
+
+
+class PatternCache:
+    """
+    Least recently used cache of compiled patterns.
+    When the cache is full the least recently used pattern is evicted.
+    """
+    def __init__(self, maxsize=DEFAULT_CACHE_SIZE):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self.patterns = OrderedDict()
+        self.lock = threading.Lock()
+        # Installed on the patterns compiled through the cache
+        self.tracer = None
+
+    def get(self, regexp, engine=DEFAULT_ENGINE, max_steps=None, timeout=None):
+        if isinstance(regexp, bytearray):
+            regexp = bytes(regexp)
+        # Patterns with different limits are different patterns
+        key = (type(regexp), regexp, engine, max_steps, timeout)
+        with self.lock:
+            pattern = self.patterns.get(key)
+            if pattern is not None:
+                self.hits += 1
+                self.patterns.move_to_end(key)
+                return pattern
+            self.misses += 1
+
+        # Parse outside of the lock, a parse error must not leave the cache locked
+        pattern = Pattern(regexp, engine, max_steps=max_steps, timeout=timeout)
+        if self.tracer is not None:
+            install_tracer(pattern, self.tracer)
+        with self.lock:
+            if self.maxsize > 0:
+                self.patterns[key] = pattern
+                self.evict()
+        return pattern
+
+    def evict(self):
+        while len(self.patterns) > self.maxsize:
+            self.patterns.popitem(last=False)
+
+    def resize(self, maxsize):
+        if maxsize < 0:
+            raise ValueError("Cache size cannot be negative")
+        with self.lock:
+            self.maxsize = maxsize
+            self.evict()
+
+    def clear(self):
+        with self.lock:
+            self.patterns.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def set_tracer(self, tracer):
+        with self.lock:
+            self.tracer = tracer
+            for pattern in self.patterns.values():
+                install_tracer(pattern, tracer)
+
+    def info(self):
+        with self.lock:
+            return CacheInfo(self.hits, self.misses, self.maxsize, len(self.patterns))
+
+
+pattern_cache = PatternCache()
+
+
+def compile(regexp, engine=DEFAULT_ENGINE, max_steps=None, timeout=None, max_cost=None):
+    """
+    Compiles a regexp, going through the pattern cache.
+    :param regexp: the regexp to compile
+    :param engine: the name of the engine used for matching, one of the keys of engines
+    :param max_steps: the most steps of a match or a search, see Pattern()
+    :param timeout: the most seconds of a match or a search, see Pattern()
+    :param max_cost: the most steps per character the pattern is estimated to take, patterns
+                     above it, or taking time growing faster than the length of the string,
+                     raise PatternTooExpensive
+    :return: a Pattern object
+    """
+    pattern = pattern_cache.get(regexp, engine, max_steps, timeout)
+    if max_cost is not None:
+        cost = pattern.cost()
+        if cost.degree > 1 or cost.per_char > max_cost:
+            raise PatternTooExpensive(regexp, cost)
+    return pattern
+
+
+def set_cache_size(maxsize):
+    pattern_cache.resize(maxsize)
+
+
+def cache_info():
+    return pattern_cache.info()
+
+
+def purge():
+    """
+    Empties the pattern cache and the cache of the code generated by the "codegen" engine.
+    """
+    pattern_cache.clear()
+    clear_code_cache()
+
+
+def set_tracer(tracer):
+    """
+    Installs a tracer on the patterns in the cache and on the ones compiled from now on,
+    None removes it.
+    """
+    pattern_cache.set_tracer(tracer)
+
+
+def match_regexp(regexp, string, engine=DEFAULT_ENGINE):
+    match = compile(regexp, engine).search(string)
+    return match.group() if match is not None else None
+
+
+def finditer(regexp, string, engine=DEFAULT_ENGINE):
+    return compile(regexp, engine).finditer(string)
+
+
+def findall(regexp, string, engine=DEFAULT_ENGINE):
+    return compile(regexp, engine).findall(string)
@@ -0,0 +1,318 @@
+#!/usr/bin/python3
+
+"""
+SPYRE - Simple PYthon 3 Regular Expression Engine
+Copyright (C) 2018 Francesco Rigoni - francesco.rigoni@gmail.com
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License v3 as published by
+the Free Software Foundation.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+from spyre_engine import *
+import argparse
+import mmap
+import os
+import sys
+
+
+class GrepOptions:
+    def __init__(self, line_number=False, count=False, files_with_matches=False, invert=False,
+                 with_filename=False, jobs=1):
+        self.line_number = line_number
+        self.count = count
+        self.files_with_matches = files_with_matches
+        self.invert = invert
+        self.with_filename = with_filename
+        # Number of processes scanning each file
+        self.jobs = jobs
+
+
+def map_file(f):
+    """
+    :return: the content of the file, memory mapped
+    """
+    if os.fstat(f.fileno()).st_size == 0:
+        # Empty files cannot be mapped
+        return b""
+    return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def next_line_start(data, position):
+    """
+    :return: the start of the first line beginning at or after position
+    """
+    if position == 0 or position >= len(data):
+        return min(position, len(data))
+    newline = data.find(b"\n", position - 1)
+    return len(data) if newline == -1 else newline + 1
+
+
+def count_newlines(data, start, end):
+    count = 0
+    newline = data.find(b"\n", start, end)
+    while newline != -1:
+        count += 1
+        newline = data.find(b"\n", newline + 1, end)
+    return count
+
+
+def candidate_lines(pattern, data, start=0, end=None):
+    """
+    Generates (line_start, line_end) for the lines that may contain a match, among the lines
+    beginning between start and end, which are line starts.
+    When the pattern requires a literal, only the lines containing it are generated, they are
+    found with find() over the whole mapping instead of going through every line.
+    """
+    size = len(data)
+    end = size if end is None else end
+    # The lines beginning before end finish before the next line start
+    limit = next_line_start(data, end)
+    literal = pattern.prefilter.required[0] if len(pattern.prefilter.required) > 0 else None
+    position = start
+    while position < end:
+        if literal is not None:
+            found = data.find(literal, position, limit)
+            if found == -1:
+                return
+            line_start = data.rfind(b"\n", position, found) + 1
+            if line_start == 0:
+                line_start = position
+            if line_start >= end:
+                return
+        else:
+            line_start = position
+        line_end = data.find(b"\n", line_start)
+        if line_end == -1:
+            line_end = size
+        yield line_start, line_end
+        position = line_end + 1
+
+
+def all_lines(data, start=0, end=None):
+    size = len(data)
+    end = size if end is None else end
+    position = start
+    while position < end:
+        line_end = data.find(b"\n", position)
+        if line_end == -1:
+            line_end = size
+        yield position, line_end
+        position = line_end + 1
+
+
+def line_matches(pattern, view, line_start, line_end):
+    # A view of the line rather than pos/endpos, so that "^" matches at the start of every line
+    line = view[line_start:line_end]
+    try:
+        return pattern.search(line) is not None
+    finally:
+        line.release()
+
+
+def selected_lines(pattern, data, invert, start=0, end=None):
+    """
+    Generates (line_start, line_end) for the lines selected by grep, among the lines
+    beginning between start and end.
+    Lines are matched in place, through memoryviews of the mapping.
+    """
+    with memoryview(data) as view:
+        if not invert:
+            for line_start, line_end in candidate_lines(pattern, data, start, end):
+                if line_matches(pattern, view, line_start, line_end):
+                    yield line_start, line_end
+        else:
+            for line_start, line_end in all_lines(data, start, end):
+                if not line_matches(pattern, view, line_start, line_end):
+                    yield line_start, line_end
+
+
+def numbered_lines(data, lines):
+    """
+    Generates (line_number, line_start, line_end) for the lines generated by lines.
+    """
+    line_number = 1
+    counted_up_to = 0
+    for line_start, line_end in lines:
+        # Count the newlines skipped since the previous line
+        line_number += count_newlines(data, counted_up_to, line_start)
+        counted_up_to = line_start
+        yield line_number, line_start, line_end
+
+
+def write_lines(data, name, lines, options, out):
+    """
+    Writes the grep output for one file to out.
+    :param lines: generator of (line_number, line_start, line_end) for the selected lines,
+                  line numbers are only used with options.line_number
+    :return: the number of selected lines
+    """
+    prefix = (name.encode("utf-8", "surrogateescape") + b":") if options.with_filename else b""
+    selected = 0
+    for line_number, line_start, line_end in lines:
+        selected += 1
+        if options.files_with_matches:
+            out.write(name.encode("utf-8", "surrogateescape") + b"\n")
+            return selected
+        if options.count:
+            continue
+
+        line_prefix = prefix
+        if options.line_number:
+            line_prefix += str(line_number).encode("ascii") + b":"
+        out.write(line_prefix + data[line_start:line_end] + b"\n")
+
+    if options.count:
+        out.write(prefix + str(selected).encode("ascii") + b"\n")
+    return selected
+
+
+def grep_data(pattern, data, name, options, out):
+    """
+    Writes the grep output for one file to out.
+    :return: the number of selected lines
+    """
+    lines = selected_lines(pattern, data, options.invert)
+    try:
+        if options.line_number:
+            return write_lines(data, name, numbered_lines(data, lines), options, out)
+        return write_lines(data, name, ((None, line_start, line_end) for line_start, line_end in lines),
+                           options, out)
+    finally:
+        # Releases the memoryview on the mapping, which cannot be closed otherwise
+        lines.close()
+
+
+def grep_file(pattern, path, options, out):
+    with open(path, "rb") as f:
+        data = map_file(f)
+        try:
+            if options.jobs > 1 and len(data) > 0:
+                # Imported here, spyre_parallel builds on this module
+                from spyre_parallel import parallel_grep_lines
+                lines = parallel_grep_lines(pattern, path, len(data), options.invert, options.jobs)
+                try:
+                    return write_lines(data, path, lines, options, out)
+                finally:
+                    lines.close()
+            return grep_data(pattern, data, path, options, out)
+        finally:
+            if isinstance(data, mmap.mmap):
+                data.close()
+
+
+def pattern_elements(pattern):
+    """
+    :return: the (kind, text) elements of a pattern, kind being "literal", "any", "brackets"
+             or "quantifier", as far as parse_regexp needs to know
+    """
+    elements = []
+    i = 0
+    while i < len(pattern):
+        char = pattern[i]
+        if char == "\\" and i + 1 < len(pattern):
+            elements.append(("literal", pattern[i + 1]))
+            i += 2
+            continue
+        if char == "[":
+            end = pattern.find("]", i + 1)
+            if end == -1:
+                # Unclosed, parse_regexp reports it
+                break
+            elements.append(("brackets", pattern[i + 1:end]))
+            i = end + 1
+            continue
+        elements.append(("any" if char == "." else "quantifier" if char in "*+?{" else "literal", char))
+        i += 1
+    return elements
+
+
+def check_multibyte_characters(pattern):
+    """
+    Files are matched as bytes, a character the pattern holds is matched as its encoding. When
+    it takes several bytes they are only matched right in a row: inside brackets each byte would
+    be matched alone, a quantifier would repeat the last byte and "." would match a single byte,
+    part of a character.
+    :raise RegExpParseException: for the characters in those places
+    """
+    elements = pattern_elements(pattern)
+    for i, (kind, text) in enumerate(elements):
+        multibyte = [char for char in text if len(os.fsencode(char)) > 1]
+        if not multibyte:
+            continue
+        following = elements[i + 1][0] if i + 1 < len(elements) else None
+        preceding = elements[i - 1][0] if i > 0 else None
+        if kind == "brackets":
+            where = "inside brackets"
+        elif following == "quantifier":
+            where = "before a quantifier"
+        elif "any" in (preceding, following):
+            where = "next to \".\""
+        else:
+            continue
+        raise RegExpParseException("the character " + multibyte[0] + " is several bytes in the files, "
+                                   "it cannot be matched " + where)
+
+
+def build_argument_parser():
+    parser = argparse.ArgumentParser(prog="spyre", description="Search files for lines matching a SPYRE regexp")
+    parser.add_argument("pattern", help="the regexp")
+    parser.add_argument("files", nargs="+", metavar="FILE", help="the files to search")
+    parser.add_argument("-n", "--line-number", action="store_true", help="prefix lines with their line number")
+    parser.add_argument("-c", "--count", action="store_true", help="only print the number of selected lines")
+    parser.add_argument("-l", "--files-with-matches", action="store_true",
+                        help="only print the names of the files with selected lines")
+    parser.add_argument("-v", "--invert-match", action="store_true", help="select the lines not matching")
+    parser.add_argument("-j", "--jobs", type=int, default=1, metavar="N",
+                        help="scan each file with N processes, each one working on a part of it")
+    parser.add_argument("--engine", default="dfa", choices=sorted(engines), help="the matching engine")
+    return parser
+
+
+def main(argv, out=None):
+    """
+    :return: the exit status, 0 if lines were selected, 1 if not, 2 on errors
+    """
+    arguments = build_argument_parser().parse_args(argv)
+    out = sys.stdout.buffer if out is None else out
+    try:
+        # Files are matched as bytes, the pattern is turned back into the bytes of the command
+        # line: non-ASCII characters are matched in the encoding of the terminal, UTF-8 mostly,
+        # and the bytes it cannot decode are kept as they are. The characters encoded in
+        # several bytes are only accepted where their bytes are matched in a row
+        check_multibyte_characters(arguments.pattern)
+        pattern = compile(os.fsencode(arguments.pattern), arguments.engine)
+    except UnicodeEncodeError:
+        sys.stderr.write("spyre: the pattern cannot be encoded as bytes\n")
+        return 2
+    except RegExpParseException as e:
+        sys.stderr.write("spyre: " + str(e) + "\n")
+        return 2
+
+    options = GrepOptions(line_number=arguments.line_number,
+                          count=arguments.count,
+                          files_with_matches=arguments.files_with_matches,
+                          invert=arguments.invert_match,
+                          with_filename=len(arguments.files) > 1,
+                          jobs=arguments.jobs)
+    selected = 0
+    error = False
+    for path in arguments.files:
+        try:
+            selected += grep_file(pattern, path, options, out)
+        except OSError as e:
+            sys.stderr.write("spyre: " + path + ": " + e.strerror + "\n")
+            error = True
+    out.flush()
+
+    if error:
+        return 2
+    return 0 if selected > 0 else 1
@@ -17,6 +17,9 @@ You should have received a copy of the GNU General Public License
 along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
 
+from bisect import bisect_right
+
+
 class CharMatcher:
     """
     Matches a single character.
@@ -39,53 +42,150 @@ class AnyMatcher:
         return True
 
 
-class RangeMatcher:
+class CharClass:
+    """
+    Constant time membership test for a set of characters, described as inclusive ranges
+    of code points. Code points below 256 are looked up in a bitmap, the others with a
+    binary search over the sorted, merged ranges.
+    """
+    __slots__ = ("ranges", "negate", "bitmap", "starts", "ends")
+
+    bitmap_size = 256
+
+    def __init__(self, ranges, negate=False):
+        merged = []
+        for start, end in sorted(ranges):
+            if merged and start <= merged[-1][1] + 1:
+                merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+            else:
+                merged.append((start, end))
+        self.ranges = tuple(merged)
+        self.negate = negate
+
+        self.bitmap = bytearray([1 if negate else 0]) * CharClass.bitmap_size
+        for start, end in self.ranges:
+            for code in range(start, min(end, CharClass.bitmap_size - 1) + 1):
+                self.bitmap[code] = 0 if negate else 1
+
+        wide = [(max(start, CharClass.bitmap_size), end) for start, end in self.ranges
+                if end >= CharClass.bitmap_size]
+        self.starts = tuple(start for start, end in wide)
+        self.ends = tuple(end for start, end in wide)
+
+    def contains_wide(self, code):
+        i = bisect_right(self.starts, code) - 1
+        return (i >= 0 and code <= self.ends[i]) != self.negate
+
+    def contains(self, code):
+        if code < CharClass.bitmap_size:
+            return self.bitmap[code] == 1
+        return self.contains_wide(code)
+
+
+class CharClassMatcher:
+    """
+    Matches if a character is included in a bracket expression, any mix of ranges and single
+    characters, possibly negated.
+    """
+    def __init__(self, ranges, negate=False):
+        self.char_class = CharClass(ranges, negate)
+        self.bitmap = self.char_class.bitmap
+
+    def match(self, character):
+        code = ord(character)
+        if code < CharClass.bitmap_size:
+            return self.bitmap[code] == 1
+        return self.char_class.contains_wide(code)
+
+
+class ByteClassMatcher:
+    """
+    Matches if a byte value is included in a bracket expression.
+    Byte values are always in the bitmap, so matching is a single lookup.
+    """
+    def __init__(self, char_class):
+        self.char_class = char_class
+        self.bitmap = char_class.bitmap
+
+    def match(self, code):
+        return self.bitmap[code] == 1
+
+
+class RangeMatcher(CharClassMatcher):
     """
     Matches if a character is included in a range (inclusive) of characters.
     """
     def __init__(self, start_char, end_char):
+        CharClassMatcher.__init__(self, [(ord(start_char), ord(end_char))])
         self.start_char = start_char
         self.end_char = end_char
 
-    def match(self, character):
-        return self.start_char <= character <= self.end_char
-
 
-class ExcludeRangeMatcher:
+class ExcludeRangeMatcher(CharClassMatcher):
     """
     Matches if a character is not included in a range (inclusive) of characters.
     """
     def __init__(self, start_char, end_char):
+        CharClassMatcher.__init__(self, [(ord(start_char), ord(end_char))], negate=True)
         self.start_char = start_char
         self.end_char = end_char
 
-    def match(self, character):
-        return character < self.start_char or character > self.end_char
-
 
-class PoolMatcher:
+class PoolMatcher(CharClassMatcher):
     """
     Matches if a character is included in a set of characters.
     """
     def __init__(self, chars):
+        CharClassMatcher.__init__(self, [(ord(char), ord(char)) for char in chars])
         self.chars = chars
 
-    def match(self, character):
-        return character in self.chars
-
 
-class ExcludePoolMatcher:
+class ExcludePoolMatcher(CharClassMatcher):
     """
     Matches if a character is not included in a set of characters.
     """
     def __init__(self, chars):
+        CharClassMatcher.__init__(self, [(ord(char), ord(char)) for char in chars], negate=True)
         self.chars = chars
 
-    def match(self, character):
-        return character not in self.chars
+
+class MatchState:
+    """
+    The per match state of a single state machine.
+    State machines are shared and never modified while matching, everything that changes
+    during a match lives here.
+    """
+    __slots__ = ("current_state", "matched_length")
+
+    def __init__(self):
+        self.current_state = StateMachine.state_initial
+        self.matched_length = 0
+
+    def reset(self):
+        self.current_state = StateMachine.state_initial
+        self.matched_length = 0
+
+    def is_match(self):
+        return self.current_state == StateMachine.state_final
+
+    def is_initial(self):
+        return self.current_state == StateMachine.state_initial
+
+    def is_looping(self):
+        return self.current_state == StateMachine.state_looping
+
+    def is_fail(self):
+        return self.current_state == StateMachine.state_fail
 
 
 class StateMachine:
+    """
+    Describes how an element of the regexp reacts to characters and meta events.
+    A state machine holds no per match data, so it can be used by any number of
+    matches at the same time, from any thread.
+    """
+    __slots__ = ("matcher",)
+
     state_initial = 0
     state_looping = 1
     state_final = 2
@@ -93,124 +193,191 @@ class StateMachine:
 
     def __init__(self, matcher):
         self.matcher = matcher
-        self.current_state = StateMachine.state_initial
-        self.matched_string = ""
+
+    def with_matcher(self, matcher):
+        """
+        :return: a state machine like this one, using matcher
+        """
+        return type(self)(matcher)
 
     def state_description(self, state):
         return "(" + type(self).__name__ + ": " + str(state) + ")"
 
-    def transition(self, new_state):
-        # print("Transition " + self.state_description(self.current_state) +
+    def transition(self, match_state, new_state):
+        # print("Transition " + self.state_description(match_state.current_state) +
         # " -> " + self.state_description(new_state))
-        self.current_state = new_state
-
-    def reset(self):
-        self.current_state = StateMachine.state_initial
+        match_state.current_state = new_state
 
-    def try_match(self, char):
+    def try_match(self, match_state, char):
         if self.matcher.match(char):
-            self.matched_string += char
+            match_state.matched_length += 1
             return True
         else:
             return False
 
-    def is_match(self):
-        return self.current_state == StateMachine.state_final
-
-    def is_initial(self):
-        return self.current_state == StateMachine.state_initial
-
-    def is_looping(self):
-        return self.current_state == StateMachine.state_looping
-
-    def is_fail(self):
-        return self.current_state == StateMachine.state_fail
-
-    def start_of_string(self):
+    def start_of_string(self, match_state):
         pass
 
-    def end_of_string(self):
+    def end_of_string(self, match_state):
         pass
 
-    def process(self, char):
+    def process(self, match_state, char):
         pass
 
 
 class StartOfStringStateMachine(StateMachine):
+    __slots__ = ()
+
     def __init__(self):
         StateMachine.__init__(self, matcher=None)
 
-    def process(self, char):
-        self.transition(StateMachine.state_fail)
+    def process(self, match_state, char):
+        self.transition(match_state, StateMachine.state_fail)
 
-    def start_of_string(self):
-        if self.current_state == StateMachine.state_initial:
-            self.transition(StateMachine.state_final)
+    def start_of_string(self, match_state):
+        if match_state.current_state == StateMachine.state_initial:
+            self.transition(match_state, StateMachine.state_final)
 
 
 class EndOfStringStateMachine(StateMachine):
+    __slots__ = ()
+
     def __init__(self):
         StateMachine.__init__(self, matcher=None)
 
-    def process(self, char):
-        self.transition(StateMachine.state_fail)
+    def process(self, match_state, char):
+        self.transition(match_state, StateMachine.state_fail)
 
-    def end_of_string(self):
-        if self.current_state == StateMachine.state_initial:
-            self.transition(StateMachine.state_final)
+    def end_of_string(self, match_state):
+        if match_state.current_state == StateMachine.state_initial:
+            self.transition(match_state, StateMachine.state_final)
 
 
 class SingleMatchStateMachine(StateMachine):
-    def process(self, character):
-        if self.current_state == StateMachine.state_initial:
-            if self.try_match(character):
-                self.transition(StateMachine.state_final)
+    __slots__ = ()
+
+    def process(self, match_state, character):
+        if match_state.current_state == StateMachine.state_initial:
+            if self.try_match(match_state, character):
+                self.transition(match_state, StateMachine.state_final)
             else:
-                self.transition(StateMachine.state_fail)
+                self.transition(match_state, StateMachine.state_fail)
 
 
 class ZeroOrOneMatchStateMachine(StateMachine):
-    def process(self, character):
-        if self.current_state == StateMachine.state_initial:
-            if self.try_match(character):
-                self.transition(StateMachine.state_looping)
+    __slots__ = ()
+
+    def process(self, match_state, character):
+        if match_state.current_state == StateMachine.state_initial:
+            if self.try_match(match_state, character):
+                self.transition(match_state, StateMachine.state_looping)
             else:
-                self.transition(StateMachine.state_final)
-        elif self.current_state == StateMachine.state_looping:
-            self.transition(StateMachine.state_final)
+                self.transition(match_state, StateMachine.state_final)
+        elif match_state.current_state == StateMachine.state_looping:
+            self.transition(match_state, StateMachine.state_final)
 
-    def end_of_string(self):
-        self.transition(StateMachine.state_final)
+    def end_of_string(self, match_state):
+        self.transition(match_state, StateMachine.state_final)
 
 
 class OneOrMoreMatchStateMachine(StateMachine):
-    def process(self, character):
-        if self.current_state == StateMachine.state_initial:
-            if self.try_match(character):
-                self.transition(StateMachine.state_looping)
+    __slots__ = ()
+
+    def process(self, match_state, character):
+        if match_state.current_state == StateMachine.state_initial:
+            if self.try_match(match_state, character):
+                self.transition(match_state, StateMachine.state_looping)
             else:
-                self.transition(StateMachine.state_fail)
-        elif self.current_state == StateMachine.state_looping:
-            if not self.try_match(character):
-                self.transition(StateMachine.state_final)
-
-    def end_of_string(self):
-        if self.current_state == StateMachine.state_looping:
-            self.transition(StateMachine.state_final)
+                self.transition(match_state, StateMachine.state_fail)
+        elif match_state.current_state == StateMachine.state_looping:
+            if not self.try_match(match_state, character):
+                self.transition(match_state, StateMachine.state_final)
+
+    def end_of_string(self, match_state):
+        if match_state.current_state == StateMachine.state_looping:
+            self.transition(match_state, StateMachine.state_final)
         else:
-            self.transition(StateMachine.state_fail)
+            self.transition(match_state, StateMachine.state_fail)
 
 
 class ZeroOrMoreMatchStateMachine(StateMachine):
-    def process(self, character):
-        if self.current_state == StateMachine.state_initial:
-            if self.try_match(character):
-                self.transition(StateMachine.state_looping)
+    __slots__ = ()
+
+    def process(self, match_state, character):
+        if match_state.current_state == StateMachine.state_initial:
+            if self.try_match(match_state, character):
+                self.transition(match_state, StateMachine.state_looping)
+            else:
+                self.transition(match_state, StateMachine.state_final)
+        elif match_state.current_state == StateMachine.state_looping:
+            if not self.try_match(match_state, character):
+                self.transition(match_state, StateMachine.state_final)
+
+    def end_of_string(self, match_state):
+        self.transition(match_state, StateMachine.state_final)
+
+
+class CountedMatchStateMachine(StateMachine):
+    """
+    Matches between min_count and max_count times, max_count None meaning no upper bound.
+    The bounds are just two numbers, whatever their size.
+    """
+    __slots__ = ("min_count", "max_count")
+
+    def __init__(self, matcher, min_count, max_count):
+        StateMachine.__init__(self, matcher)
+        self.min_count = min_count
+        self.max_count = max_count
+
+    def with_matcher(self, matcher):
+        return CountedMatchStateMachine(matcher, self.min_count, self.max_count)
+
+    def finish(self, match_state):
+        if match_state.matched_length >= self.min_count:
+            self.transition(match_state, StateMachine.state_final)
+        else:
+            self.transition(match_state, StateMachine.state_fail)
+
+    def process(self, match_state, character):
+        if match_state.current_state in (StateMachine.state_initial, StateMachine.state_looping):
+            if self.max_count is not None and match_state.matched_length >= self.max_count:
+                self.finish(match_state)
+            elif self.try_match(match_state, character):
+                if self.max_count is not None and match_state.matched_length >= self.max_count:
+                    self.finish(match_state)
+                else:
+                    self.transition(match_state, StateMachine.state_looping)
             else:
-                self.transition(StateMachine.state_final)
-        elif self.current_state == StateMachine.state_looping:
-            if not self.try_match(character):
-                self.transition(StateMachine.state_final)
+                self.finish(match_state)
+
+    def end_of_string(self, match_state):
+        if match_state.current_state in (StateMachine.state_initial, StateMachine.state_looping):
+            self.finish(match_state)
+
 
-    def end_of_string(self):
-        self.transition(StateMachine.state_final)
+class LiteralStateMachine(StateMachine):
+    """
+    A run of literal characters compared with the string at once, built by the optimizer
+    from consecutive single character state machines.
+    """
+    __slots__ = ("chars", "text")
+
+    def __init__(self, chars):
+        StateMachine.__init__(self, matcher=None)
+        self.chars = tuple(chars)
+        # Byte values for bytes patterns
+        self.text = bytes(self.chars) if isinstance(self.chars[0], int) else "".join(self.chars)
+
+    def with_matcher(self, matcher):
+        return self
+
+    def process_text(self, match_state, string, position, endpos):
+        """
+        Compares the whole run with the string at position.
+        """
+        end = position + len(self.text)
+        if end <= endpos and string[position:end] == self.text:
+            match_state.matched_length = len(self.text)
+            self.transition(match_state, StateMachine.state_final)
+        else:
+            self.transition(match_state, StateMachine.state_fail)
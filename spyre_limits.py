@@ -0,0 +1,170 @@
+#!/usr/bin/python3
+
+"""
+SPYRE - Simple PYthon 3 Regular Expression Engine
+Copyright (C) 2018 Francesco Rigoni - francesco.rigoni@gmail.com
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License v3 as published by
+the Free Software Foundation.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+from spyre_internals import *
+from collections import namedtuple
+import time
+
+
+# The clock is read once every this many steps
+DEADLINE_CHECK_STEPS = 1024
+
+
+class MatchLimitExceeded(Exception):
+    """
+    A match or a search ran out of steps or of time, see Pattern().
+    reason:   "steps" or "timeout"
+    steps:    the steps taken
+    position: where in the string the engine was when it gave up
+    """
+    def __init__(self, reason, steps, position):
+        if reason == "steps":
+            message = "match exceeded its step budget: " + str(steps) + " steps"
+        else:
+            message = "match exceeded its deadline after " + str(steps) + " steps"
+        Exception.__init__(self, message + ", at position " + str(position))
+        self.reason = reason
+        self.steps = steps
+        self.position = position
+
+
+class PatternTooExpensive(Exception):
+    """
+    The estimated cost of a pattern is above the one allowed, see compile().
+    """
+    def __init__(self, regexp, cost):
+        Exception.__init__(self, "pattern " + repr(regexp) + " is too expensive: " + str(cost))
+        self.cost = cost
+
+
+class Budget:
+    """
+    The steps and the time left to a single match or search. Engines spend steps as they
+    go, one for each character examined by each thread or state machine, the budget raises
+    MatchLimitExceeded once they are over.
+    """
+    __slots__ = ("max_steps", "deadline", "steps", "next_check")
+
+    def __init__(self, max_steps=None, timeout=None):
+        """
+        :param max_steps: the most steps allowed, None for no limit
+        :param timeout: the most seconds allowed, None for no limit
+        """
+        self.max_steps = max_steps
+        self.deadline = time.monotonic() + timeout if timeout is not None else None
+        self.steps = 0
+        self.schedule()
+
+    def schedule(self):
+        limit = self.max_steps + 1 if self.max_steps is not None else None
+        if self.deadline is not None:
+            interval = self.steps + DEADLINE_CHECK_STEPS
+            limit = interval if limit is None else min(limit, interval)
+        self.next_check = limit
+
+    def spend(self, steps, position):
+        self.steps += steps
+        if self.next_check is not None and self.steps >= self.next_check:
+            self.check(position)
+
+    def check(self, position):
+        if self.max_steps is not None and self.steps > self.max_steps:
+            raise MatchLimitExceeded("steps", self.steps, position)
+        if self.deadline is not None and time.monotonic() > self.deadline:
+            raise MatchLimitExceeded("timeout", self.steps, position)
+        self.schedule()
+
+    def stop(self, position, endpos):
+        """
+        :return: how far a scan taking a step for each character can go before spending them
+        """
+        if self.next_check is None:
+            return endpos
+        return min(endpos, position + self.next_check - self.steps)
+
+
+class Limits:
+    """
+    The limits of every match and search of a pattern.
+    """
+    __slots__ = ("max_steps", "timeout")
+
+    def __init__(self, max_steps=None, timeout=None):
+        self.max_steps = max_steps
+        self.timeout = timeout
+
+    def budget(self):
+        return Budget(self.max_steps, self.timeout)
+
+
+class Cost(namedtuple("Cost", ["per_char", "degree"])):
+    """
+    Static worst case estimate of the steps a pattern takes: about per_char * n ** degree
+    for a string of length n. A degree of 1 means time linear in the length of the string.
+    """
+    __slots__ = ()
+
+    def steps(self, length):
+        """
+        :return: the steps estimated for a string of length characters, the end of the
+                 string counting as one more position
+        """
+        return self.per_char * (length + 1) ** self.degree
+
+    def __str__(self):
+        return str(self.per_char) + " steps per character" + \
+               (", growing as n^" + str(self.degree) if self.degree > 1 else "")
+
+
+def thread_bound(nfa):
+    """
+    :return: the threads the Pike VM usually has alive at a position: one for each instruction,
+             and one more for the body of each counted loop, whose threads are kept in groups
+    """
+    return len(nfa) + len(nfa.repeats)
+
+
+def state_bound(nfa):
+    """
+    :return: the most instructions in a state of a DFA: one for each instruction, and one for
+             each count of the body of a counted loop
+    """
+    bound = len(nfa)
+    for min_count, max_count in nfa.repeats:
+        bound += 2 * (max_count if max_count >= 0 else min_count)
+    return bound
+
+
+def restart_cost(state_machines):
+    """
+    The Cost of the engines trying start positions one after the other: from each of them
+    a loop may run to the end of the string.
+    """
+    width = 0
+    for sm in state_machines:
+        if type(sm) in (OneOrMoreMatchStateMachine, ZeroOrMoreMatchStateMachine) or \
+                (type(sm) == CountedMatchStateMachine and sm.max_count is None):
+            return Cost(len(state_machines), 2)
+        if type(sm) == LiteralStateMachine:
+            width += len(sm.chars)
+        elif type(sm) == CountedMatchStateMachine:
+            width += sm.max_count
+        elif sm.matcher is not None:
+            width += 1
+    return Cost(max(width, 1), 1)
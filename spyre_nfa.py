@@ -0,0 +1,639 @@
+#!/usr/bin/python3
+
+"""
+SPYRE - Simple PYthon 3 Regular Expression Engine
+Copyright (C) 2018 Francesco Rigoni - francesco.rigoni@gmail.com
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License v3 as published by
+the Free Software Foundation.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+from spyre_internals import *
+from spyre_prefilter import *
+from spyre_optimizer import *
+from spyre_limits import *
+from array import array
+from collections import deque
+
+
+# NFA programs are flat arrays, instruction pc is ops[pc], args[pc], xs[pc], ys[pc].
+# Opcodes below op_split consume one character, then go to x:
+# op_char:         the character whose code point, or the byte value, is arg
+# op_class:        a character of the CharClass classes[arg]
+# op_any:          any character
+# op_test:         a character accepted by matchers[arg], for the matchers the others do not describe
+# The others consume nothing:
+# op_split:        goes to both x and y, x has the higher priority
+# op_jump:         goes to x
+# op_assert_start: goes to x only at the start of the string
+# op_assert_end:   goes to x only at the end of the string
+# op_match:        the regexp matched
+# op_repeat:       counted loop, repeats[arg] holds its minimum and maximum, -1 if unbounded.
+#                  Goes to the loop body x while below the maximum, to y from the minimum on.
+# In the DFAs, a thread in a counted loop carries its count in its pc:
+# count * len(program) + instruction. Everywhere else the count is 0 and the two are the same.
+# The Pike VM keeps instead the threads in the body of a counted loop in groups, see Counters.
+op_char = 0
+op_class = 1
+op_any = 2
+op_test = 3
+op_split = 4
+op_jump = 5
+op_assert_start = 6
+op_assert_end = 7
+op_match = 8
+op_repeat = 9
+
+op_names = ("CHAR", "CLASS", "ANY", "TEST", "SPLIT", "JMP", "ASSERT_BOL", "ASSERT_EOL", "MATCH", "REPEAT")
+
+
+def char_code(char):
+    """
+    :return: the code point of a character, byte values are returned as they are
+    """
+    return char if isinstance(char, int) else ord(char)
+
+
+class NFAProgram:
+    """
+    A Thompson NFA built from the state machines produced by parse_regexp.
+    Execution starts at instruction 0.
+    """
+    __slots__ = ("ops", "args", "xs", "ys", "classes", "bitmaps", "matchers", "repeats", "loops", "match_pc",
+                 "closures", "vm_closures")
+
+    def __init__(self, instructions, tables=None):
+        """
+        :param instructions: (opcode, matcher, x, y) tuples, the matcher, or the bounds of
+                             a counted loop, is lowered to arg
+        :param tables: the ops, args, xs and ys arrays, classes, matchers and repeats of an NFA
+                       lowered already, a PatternStore reads them, used instead of instructions
+        """
+        if tables is not None:
+            self.ops, self.args, self.xs, self.ys, self.classes, self.matchers, self.repeats = tables
+        else:
+            self.ops = array("B")
+            self.args = array("i")
+            self.xs = array("i")
+            self.ys = array("i")
+            self.classes = []
+            self.matchers = []
+            self.repeats = []
+            for op, matcher, x, y in instructions:
+                self.ops.append(op)
+                self.args.append(self.lower(op, matcher))
+                self.xs.append(-1 if x is None else x)
+                self.ys.append(-1 if y is None else y)
+        self.classes = tuple(self.classes)
+        self.bitmaps = tuple(char_class.bitmap for char_class in self.classes)
+        self.matchers = tuple(self.matchers)
+        self.repeats = tuple(self.repeats)
+        # The counted loop instruction each loop body goes back to, -1 for the other instructions
+        self.loops = array("i", [-1] * len(self.ops))
+        for pc, op in enumerate(self.ops):
+            if op == op_repeat:
+                self.loops[self.xs[pc]] = pc
+        self.match_pc = len(self.ops) - 1
+        # Computed on demand, indexed by at_start * 2 + at_end, then by pc
+        self.closures = [None] * 4
+        self.vm_closures = [None] * 4
+
+    def lower(self, op, matcher):
+        if op == op_char:
+            return char_code(matcher.char)
+        if op == op_class:
+            return self.index_of(self.classes, matcher.char_class)
+        if op == op_test:
+            return self.index_of(self.matchers, matcher)
+        if op == op_repeat:
+            min_count, max_count = matcher
+            self.repeats.append((min_count, -1 if max_count is None else max_count))
+            return len(self.repeats) - 1
+        return -1
+
+    @staticmethod
+    def index_of(table, item):
+        for i, seen in enumerate(table):
+            if seen is item:
+                return i
+        table.append(item)
+        return len(table) - 1
+
+    def __len__(self):
+        return len(self.ops)
+
+    def largest_count(self):
+        """
+        :return: the largest bound of the counted loops, the minimum of the unbounded ones, 0
+                 without counted loops
+        """
+        return max([max_count if max_count >= 0 else min_count for min_count, max_count in self.repeats] + [0])
+
+    def instruction(self, pc):
+        """
+        :return: the instruction of a thread, without its count
+        """
+        return pc % len(self.ops)
+
+    def successor(self, pc):
+        """
+        :return: where a thread goes after the consuming instruction at pc, with its count
+        """
+        instruction = pc % len(self.ops)
+        return pc - instruction + self.xs[instruction]
+
+    def accepts(self, pc, char):
+        """
+        :param char: a character, or a byte value
+        :return: True if the consuming instruction at pc accepts char
+        """
+        pc = pc % len(self.ops)
+        op = self.ops[pc]
+        if op == op_char:
+            return char_code(char) == self.args[pc]
+        if op == op_class:
+            return self.classes[self.args[pc]].contains(char_code(char))
+        if op == op_any:
+            return True
+        return self.matchers[self.args[pc]].match(char)
+
+    def dump(self):
+        """
+        :return: one line for each instruction: pc, opcode, argument and targets
+        """
+        lines = []
+        for pc, op in enumerate(self.ops):
+            arg, x, y = self.args[pc], self.xs[pc], self.ys[pc]
+            if op == op_char:
+                argument = repr(describe_code(arg)) + " -> " + str(x)
+            elif op == op_class:
+                argument = describe_class(self.classes[arg]) + " -> " + str(x)
+            elif op == op_test:
+                argument = describe_matcher(self.matchers[arg]) + " -> " + str(x)
+            elif op == op_repeat:
+                min_count, max_count = self.repeats[arg]
+                argument = "{" + str(min_count) + "," + ("" if max_count < 0 else str(max_count)) + "} -> " + \
+                           str(x) + ", " + str(y)
+            elif op == op_split:
+                argument = "-> " + str(x) + ", " + str(y)
+            elif op == op_match:
+                # Set programs keep the index of the regexp in x
+                argument = str(x) if x >= 0 else ""
+            else:
+                argument = "-> " + str(x)
+            lines.append(("%4d  %-10s %s" % (pc, op_names[op], argument)).rstrip())
+        return "\n".join(lines)
+
+    def repeat(self, pc):
+        """
+        :param pc: a counted loop instruction, with the count of the thread reaching it
+        :return: where the thread goes: one more time in the loop, out of the loop, in priority
+                 order, None where it cannot go
+        """
+        size = len(self.ops)
+        count, instruction = divmod(pc, size)
+        min_count, max_count = self.repeats[self.args[instruction]]
+        body = None
+        if max_count == -1:
+            # Without maximum every count from the minimum on behaves the same
+            body = min(count + 1, min_count) * size + self.xs[instruction]
+        elif count < max_count:
+            body = (count + 1) * size + self.xs[instruction]
+        return body, self.ys[instruction] if count >= min_count else None
+
+    def closure_table(self, at_start, at_end):
+        closures = self.closures[at_start * 2 + at_end]
+        if closures is None:
+            closures = [None] * len(self.ops)
+            self.closures[at_start * 2 + at_end] = closures
+        return closures
+
+    def closure(self, pc, at_start, at_end):
+        """
+        :return: the consuming and match instructions reachable from pc without consuming
+                 characters, in priority order. Only the closures of threads out of counted
+                 loops are kept, there would be one for each count otherwise.
+        """
+        if pc >= len(self.ops):
+            # Back to its loop instruction after a character, the way out of the loop is the
+            # same for every count
+            body, out = self.repeat(pc)
+            reached = (body,) if body is not None else ()
+            return reached + self.closure(out, at_start, at_end) if out is not None else reached
+        closures = self.closure_table(at_start, at_end)
+        reached = closures[pc]
+        if reached is None:
+            reached = self.closure_of(pc, at_start, at_end, True)
+            closures[pc] = reached
+        return reached
+
+    def vm_closure_table(self, at_start, at_end):
+        closures = self.vm_closures[at_start * 2 + at_end]
+        if closures is None:
+            closures = [None] * len(self.ops)
+            self.vm_closures[at_start * 2 + at_end] = closures
+        return closures
+
+    def vm_closure(self, pc, at_start, at_end):
+        """
+        :return: the closure of pc for the Pike VM: a thread entering a counted loop reaches
+                 the body of the loop without a count, it is then added to a Counters group
+        """
+        closures = self.vm_closure_table(at_start, at_end)
+        reached = closures[pc]
+        if reached is None:
+            reached = self.closure_of(pc, at_start, at_end, False)
+            closures[pc] = reached
+        return reached
+
+    def closure_of(self, pc, at_start, at_end, counted):
+        ops, xs, ys = self.ops, self.xs, self.ys
+        size = len(ops)
+        out = []
+        seen = set()
+        stack = [pc]
+        while stack:
+            pc_reached = stack.pop()
+            if pc_reached in seen:
+                continue
+            seen.add(pc_reached)
+            instruction = pc_reached % size
+            op = ops[instruction]
+            if op < op_split or op == op_match:
+                out.append(pc_reached)
+            elif op == op_split:
+                stack.append(ys[instruction])
+                stack.append(xs[instruction])
+            elif op == op_jump:
+                stack.append(xs[instruction])
+            elif op == op_assert_start:
+                if at_start:
+                    stack.append(xs[instruction])
+            elif op == op_assert_end:
+                if at_end:
+                    stack.append(xs[instruction])
+            elif op == op_repeat:
+                body, out_of_loop = self.repeat(pc_reached)
+                if body is not None and not counted:
+                    body = xs[instruction]
+                stack.extend(target for target in (out_of_loop, body) if target is not None)
+        return tuple(out)
+
+
+def consume(matcher, x):
+    """
+    :return: the instruction consuming a character accepted by matcher, then going to x
+    """
+    if type(matcher) == CharMatcher:
+        return op_char, matcher, x, None
+    if type(matcher) == AnyMatcher:
+        return op_any, None, x, None
+    if isinstance(matcher, (CharClassMatcher, ByteClassMatcher)):
+        return op_class, matcher, x, None
+    return op_test, matcher, x, None
+
+
+def compile_state_machine(state_machine, instructions):
+    """
+    Appends the instructions describing a single state machine.
+    Every state machine continues to the instruction following its own ones.
+    """
+    matcher = state_machine.matcher
+    pc = len(instructions)
+    if type(state_machine) == StartOfStringStateMachine:
+        instructions.append((op_assert_start, None, pc + 1, None))
+    elif type(state_machine) == EndOfStringStateMachine:
+        instructions.append((op_assert_end, None, pc + 1, None))
+    elif type(state_machine) == SingleMatchStateMachine:
+        instructions.append(consume(matcher, pc + 1))
+    elif type(state_machine) == ZeroOrOneMatchStateMachine:
+        instructions.append((op_split, None, pc + 1, pc + 2))
+        instructions.append(consume(matcher, pc + 2))
+    elif type(state_machine) == OneOrMoreMatchStateMachine:
+        instructions.append(consume(matcher, pc + 1))
+        instructions.append((op_split, None, pc, pc + 2))
+    elif type(state_machine) == ZeroOrMoreMatchStateMachine:
+        instructions.append((op_split, None, pc + 1, pc + 3))
+        instructions.append(consume(matcher, pc + 2))
+        instructions.append((op_jump, None, pc, None))
+    elif type(state_machine) == LiteralStateMachine:
+        for char in state_machine.chars:
+            instructions.append(consume(CharMatcher(char), len(instructions) + 1))
+    elif type(state_machine) == CountedMatchStateMachine:
+        # Two instructions whatever the bounds, threads count their way through the loop
+        instructions.append((op_repeat, (state_machine.min_count, state_machine.max_count), pc + 1, pc + 2))
+        instructions.append(consume(matcher, pc))
+    else:
+        raise ValueError("compile_state_machine: unsupported state machine " + type(state_machine).__name__)
+
+
+def compile_nfa(state_machines):
+    """
+    :param state_machines: the state machines produced by parse_regexp, or optimized ones
+    :return: an NFAProgram matching the same strings
+    """
+    instructions = []
+    for state_machine in state_machines:
+        compile_state_machine(state_machine, instructions)
+    instructions.append((op_match, None, None, None))
+    return NFAProgram(instructions)
+
+
+def compile_reverse_nfa(state_machines):
+    """
+    :param state_machines: the state machines produced by parse_regexp, or optimized ones
+    :return: an NFAProgram matching the same strings read backwards, from their end.
+             "$" is then tested at the start of the program, "^" at its end
+    """
+    reversed_state_machines = []
+    for state_machine in reversed(state_machines):
+        if type(state_machine) == StartOfStringStateMachine:
+            state_machine = EndOfStringStateMachine()
+        elif type(state_machine) == EndOfStringStateMachine:
+            state_machine = StartOfStringStateMachine()
+        elif type(state_machine) == LiteralStateMachine:
+            state_machine = LiteralStateMachine(reversed(state_machine.chars))
+        reversed_state_machines.append(state_machine)
+    return compile_nfa(reversed_state_machines)
+
+
+def compile_nfa_set(state_machine_lists):
+    """
+    Builds a single NFA matching any of several regexps.
+    The match instruction of each regexp holds its index in x.
+    :param state_machine_lists: a list of state machine lists produced by parse_regexp
+    :return: an NFAProgram
+    """
+    # A chain of splits, placed first, leads to the first instruction of every regexp
+    splits = len(state_machine_lists) - 1
+    instructions = [None] * splits
+    starts = []
+    for i, state_machines in enumerate(state_machine_lists):
+        starts.append(len(instructions))
+        for state_machine in state_machines:
+            compile_state_machine(state_machine, instructions)
+        instructions.append((op_match, None, i, None))
+    for i in range(splits):
+        instructions[i] = (op_split, None, starts[i], i + 1 if i + 1 < splits else starts[i + 1])
+    return NFAProgram(instructions)
+
+
+def add_thread(nfa, threads, seen, pc, start, at_start, at_end):
+    """
+    Adds to threads the thread at pc and all the threads reachable from it without consuming
+    characters, in priority order. Threads reaching an instruction already in seen are dropped,
+    since a higher priority thread got there first.
+    """
+    for reached in nfa.closure(pc, at_start, at_end):
+        if reached not in seen:
+            seen.add(reached)
+            threads.append((reached, start))
+
+
+def descending(group):
+    """
+    :return: True if the counts of a Counters group decrease from its first, highest priority,
+             thread on: it entered the loop first
+    """
+    return len(group) == 1 or group[0][0] < group[1][0]
+
+
+def ascending(group):
+    return len(group) == 1 or group[0][0] > group[1][0]
+
+
+def add_group(nfa, threads, groups, pc, group):
+    """
+    Adds a Counters group to threads, merging it with the previous thread when that is a group
+    in the same loop whose counts go the same way.
+    """
+    previous = groups.get(pc)
+    if previous is not None and nfa.repeats[nfa.args[nfa.loops[pc]]][1] == -1:
+        # Without maximum a thread can do all a thread with a lower count can do: the counts
+        # only increase along the groups of the loop, the last thread has the highest
+        while group and group[0][0] >= previous[-1][0]:
+            group.popleft()
+        if not group:
+            return
+    if previous is not None and threads[-1][1] is previous:
+        if (previous[-1][0] < group[0][0] and descending(previous) and descending(group)) or \
+                (previous[-1][0] > group[0][0] and ascending(previous) and ascending(group)):
+            if len(previous) < len(group):
+                group.extendleft(reversed(previous))
+                threads[-1] = (pc, group)
+                groups[pc] = group
+            else:
+                previous.extend(group)
+            return
+    groups[pc] = group
+    threads.append((pc, group))
+
+
+def enter_loop(nfa, threads, seen, groups, pc, start, position):
+    """
+    Adds to threads a thread entering the counted loop whose body is pc, at position.
+    The threads in the body of a loop are kept in Counters groups: deques of (entry, start)
+    pairs, the count of each being the position minus its entry, next to each other in
+    priority order. A loop costs a few steps for each character whatever its bounds.
+    The loop pc in seen means a thread with a higher priority entered at the same position.
+    """
+    if pc not in seen:
+        seen.add(pc)
+        add_group(nfa, threads, groups, pc, deque(((position, start),)))
+
+
+def add_vm_threads(nfa, threads, seen, groups, reached, start, position):
+    """
+    Adds the threads at the reached instructions, in priority order, the ones reaching an
+    instruction already in seen are dropped, since a higher priority thread got there first.
+    """
+    loops = nfa.loops
+    for pc in reached:
+        if loops[pc] >= 0:
+            enter_loop(nfa, threads, seen, groups, pc, start, position)
+        elif pc not in seen:
+            seen.add(pc)
+            threads.append((pc, start))
+
+
+def step_counters(nfa, threads, seen, groups, pc, group, position, closures, at_end):
+    """
+    Moves a Counters group in the body of a counted loop past a character it accepted.
+    Every thread goes on in the loop first, out of it second, and the threads getting out
+    at the same position all reach the same instructions: only the first of them that can
+    get out matters. In a group whose counts decrease it is the first thread, the others
+    come after the threads it reaches; in a group whose counts increase it is the one with
+    the smallest count from the minimum on, the ones after it can only do less.
+    """
+    loop = nfa.loops[pc]
+    min_count, max_count = nfa.repeats[nfa.args[loop]]
+    out = nfa.ys[loop]
+    if not descending(group):
+        while len(group) > 1 and position - group[-2][0] >= min_count:
+            group.pop()
+        entry, last_start = group[-1]
+        count = position - entry
+        if count == max_count:
+            group.pop()
+        if group:
+            add_group(nfa, threads, groups, pc, group)
+        if count >= min_count:
+            reached = closures[out]
+            if reached is None:
+                reached = nfa.vm_closure(out, False, at_end)
+            add_vm_threads(nfa, threads, seen, groups, reached, last_start, position)
+        return
+
+    entry, first_start = group[0]
+    count = position - entry
+    if count >= min_count:
+        reached = closures[out]
+        if reached is None:
+            reached = nfa.vm_closure(out, False, at_end)
+        if any(next_pc not in seen for next_pc in reached):
+            group.popleft()
+            if count != max_count:
+                add_group(nfa, threads, groups, pc, deque(((entry, first_start),)))
+            add_vm_threads(nfa, threads, seen, groups, reached, first_start, position)
+            if max_count == -1:
+                # Without maximum the first thread does all the others can do
+                group.clear()
+        elif count == max_count:
+            group.popleft()
+        elif max_count == -1:
+            group.clear()
+            group.append((entry, first_start))
+    if group:
+        add_group(nfa, threads, groups, pc, group)
+
+
+def run_pike_vm(nfa, string, anchored, pos, endpos, prefix=None, budget=None, starts_before=None):
+    """
+    Simulates all the threads of the NFA in lockstep, one character at a time.
+    Each instruction holds at most one thread, and the body of a counted loop a few groups
+    of them, so the running time is O(len(nfa) * (endpos - pos)) whatever the regexp and
+    the string.
+    :param prefix: literal every match starts with, used to skip to the next candidate
+                   position when no thread is alive
+    :param budget: Budget spent with one step for each thread, or group, alive at each position
+    :param starts_before: no match may start at or after this position, the threads started
+                          before it still run up to endpos
+    :return: the (start, end) span of the leftmost-first match or None
+    """
+    if starts_before is None or starts_before > endpos:
+        starts_before = endpos + 1
+    ops, args, xs = nfa.ops, nfa.args, nfa.xs
+    classes, bitmaps, matchers = nfa.classes, nfa.bitmaps, nfa.matchers
+    loops = nfa.loops
+    text = isinstance(string, str)
+    matched = None
+    threads = []
+    seen = set()
+    groups = {}
+    i = pos
+    while True:
+        if not threads and matched is None and prefix and not anchored:
+            i = string.find(prefix, i, min(endpos, starts_before - 1 + len(prefix)))
+            if i == -1:
+                break
+            seen = set()
+            groups = {}
+        if matched is None and (not anchored or i == pos) and i < starts_before:
+            # A new thread starting here, with lower priority than all the others
+            add_vm_threads(nfa, threads, seen, groups, nfa.vm_closure(0, i == 0, i == endpos), i, i)
+        if not threads:
+            if anchored or matched is not None or i + 1 >= starts_before:
+                break
+            # Nothing starts here, "$" for instance, the next position may start a match
+            seen = set()
+            groups = {}
+            i += 1
+            continue
+        if budget is not None:
+            budget.spend(len(threads), i)
+
+        if i < endpos:
+            char = string[i]
+            code = ord(char) if text else char
+        else:
+            char = code = None
+        next_threads = []
+        next_seen = set()
+        next_groups = {}
+        at_end = i + 1 == endpos
+        closures = nfa.vm_closure_table(False, at_end)
+        for pc, start in threads:
+            op = ops[pc]
+            if op == op_char:
+                accepted = code == args[pc]
+            elif op == op_class:
+                accepted = code is not None and (bitmaps[args[pc]][code] == 1 if code < 256
+                                                 else classes[args[pc]].contains_wide(code))
+            elif op == op_any:
+                accepted = code is not None
+            elif op == op_test:
+                accepted = char is not None and matchers[args[pc]].match(char)
+            else:
+                # Lower priority threads can only produce less preferred matches
+                matched = (start, i)
+                break
+            if not accepted:
+                continue
+            if loops[pc] < 0:
+                x = xs[pc]
+                reached = closures[x]
+                if reached is None:
+                    reached = nfa.vm_closure(x, False, at_end)
+                for next_pc in reached:
+                    if loops[next_pc] >= 0:
+                        enter_loop(nfa, next_threads, next_seen, next_groups, next_pc, start, i + 1)
+                    elif next_pc not in next_seen:
+                        next_seen.add(next_pc)
+                        next_threads.append((next_pc, start))
+                continue
+
+            # A group in the body of a counted loop, start holds its Counters
+            step_counters(nfa, next_threads, next_seen, next_groups, pc, start, i + 1, closures, at_end)
+
+        if i >= endpos:
+            break
+        threads = next_threads
+        seen = next_seen
+        groups = next_groups
+        i += 1
+
+    return matched
+
+
+class PikeVMBackend:
+    """
+    Matches by simulating the NFA, Pike VM style.
+    """
+    def __init__(self, program, prefilter=None, nfa=None):
+        """
+        :param nfa: the NFA of program, when it is compiled already
+        """
+        self.nfa = nfa if nfa is not None else compile_nfa(program.optimized)
+        self.prefix = prefilter.prefix if prefilter is not None else None
+
+    def dump(self):
+        return self.nfa.dump()
+
+    def cost(self):
+        return Cost(thread_bound(self.nfa), 1)
+
+    def match(self, string, pos, endpos, budget=None):
+        return run_pike_vm(self.nfa, string, True, pos, endpos, None, budget)
+
+    def search(self, string, pos, endpos, budget=None, starts_before=None):
+        prefix = self.prefix if searchable(string) else None
+        return run_pike_vm(self.nfa, string, False, pos, endpos, prefix, budget, starts_before)
@@ -0,0 +1,217 @@
+#!/usr/bin/python3
+
+"""
+SPYRE - Simple PYthon 3 Regular Expression Engine
+Copyright (C) 2018 Francesco Rigoni - francesco.rigoni@gmail.com
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License v3 as published by
+the Free Software Foundation.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+from spyre_internals import *
+
+
+# Names of the state machines in the dumps
+kind_names = {
+    StartOfStringStateMachine: "ASSERT_BOL",
+    EndOfStringStateMachine: "ASSERT_EOL",
+    SingleMatchStateMachine: "ONE",
+    ZeroOrOneMatchStateMachine: "OPTIONAL",
+    OneOrMoreMatchStateMachine: "PLUS",
+    ZeroOrMoreMatchStateMachine: "STAR",
+    CountedMatchStateMachine: "REPEAT",
+    LiteralStateMachine: "LITERAL",
+}
+
+class_matchers = (CharClassMatcher, RangeMatcher, ExcludeRangeMatcher, PoolMatcher, ExcludePoolMatcher,
+                  ByteClassMatcher)
+
+
+def same_matcher(matcher, other):
+    """
+    :return: True if both matchers are known to match the same characters
+    """
+    if type(matcher) != type(other):
+        return False
+    if type(matcher) == CharMatcher:
+        return matcher.char == other.char
+    if type(matcher) == AnyMatcher:
+        return True
+    if type(matcher) in class_matchers:
+        return matcher.char_class.ranges == other.char_class.ranges and \
+            matcher.char_class.negate == other.char_class.negate
+    return matcher is other
+
+
+def simplify_matcher(matcher):
+    """
+    :return: a CharMatcher for the classes matching a single character, matcher otherwise
+    """
+    if type(matcher) not in class_matchers or matcher.char_class.negate:
+        return matcher
+    ranges = matcher.char_class.ranges
+    if len(ranges) != 1 or ranges[0][0] != ranges[0][1]:
+        return matcher
+    code = ranges[0][0]
+    return CharMatcher(code if type(matcher) == ByteClassMatcher else chr(code))
+
+
+def is_any_star(state_machine):
+    return type(state_machine) == ZeroOrMoreMatchStateMachine and type(state_machine.matcher) == AnyMatcher
+
+
+def is_nullable(state_machine):
+    """
+    :return: True for the state machines matching the empty string anywhere
+    """
+    if type(state_machine) in (ZeroOrOneMatchStateMachine, ZeroOrMoreMatchStateMachine):
+        return True
+    return type(state_machine) == CountedMatchStateMachine and state_machine.min_count == 0
+
+
+def fuse(state_machines):
+    """
+    Merges loops with the state machines next to them matching the same characters:
+    "aa*" becomes "a+", "a+a*" and "a*a*" lose their second loop.
+    """
+    fused = []
+    for sm in state_machines:
+        previous = fused[-1] if len(fused) > 0 else None
+        if type(sm) == ZeroOrMoreMatchStateMachine and previous is not None and \
+                same_matcher(previous.matcher, sm.matcher):
+            if type(previous) == SingleMatchStateMachine:
+                fused[-1] = OneOrMoreMatchStateMachine(previous.matcher)
+                continue
+            if type(previous) in (OneOrMoreMatchStateMachine, ZeroOrMoreMatchStateMachine):
+                continue
+        fused.append(sm)
+    return fused
+
+
+def absorb_around_any_star(state_machines):
+    """
+    ".*" takes everything up to the end of the string and gives back what the rest needs,
+    so the state machines matching the empty string next to it never change a match,
+    nor does a "$" ending the regexp right after it.
+    """
+    absorbed = []
+    for sm in state_machines:
+        if is_any_star(sm):
+            while len(absorbed) > 0 and is_nullable(absorbed[-1]):
+                absorbed.pop()
+        elif len(absorbed) > 0 and is_any_star(absorbed[-1]) and is_nullable(sm):
+            continue
+        absorbed.append(sm)
+    if len(absorbed) > 1 and type(absorbed[-1]) == EndOfStringStateMachine and is_any_star(absorbed[-2]):
+        absorbed.pop()
+    return absorbed
+
+
+def strip_edges(state_machines):
+    """
+    Drops a leading ".*", unless "^" is before it, and a trailing ".*". Only whether there
+    is a match is kept, not where it starts and ends.
+    """
+    stripped = list(state_machines)
+    if len(stripped) > 0 and is_any_star(stripped[-1]):
+        stripped.pop()
+    if len(stripped) > 0 and is_any_star(stripped[0]):
+        stripped.pop(0)
+    return stripped
+
+
+def merge_literals(state_machines):
+    """
+    Replaces runs of single characters with LiteralStateMachines.
+    """
+    merged = []
+    run = []
+    for sm in state_machines + [None]:
+        if sm is not None and type(sm) == SingleMatchStateMachine and type(sm.matcher) == CharMatcher:
+            run.append(sm)
+            continue
+        if len(run) > 1:
+            merged.append(LiteralStateMachine(single.matcher.char for single in run))
+        else:
+            merged.extend(run)
+        run = []
+        if sm is not None:
+            merged.append(sm)
+    return merged
+
+
+def optimize(state_machines, keep_span=True, rewrite_loops=True):
+    """
+    Peephole pass over the state machines produced by parse_regexp, the result matches the
+    same strings, with the same spans.
+    :param keep_span: False when only whether there is a match matters, ".*" at the edges
+                      are then dropped too
+    :param rewrite_loops: False keeps the loops as they are, for the statemachine engine
+                          whose possessive loops behave differently once rewritten
+    :return: a new list of state machines
+    """
+    optimized = []
+    for sm in state_machines:
+        matcher = simplify_matcher(sm.matcher)
+        optimized.append(sm if matcher is sm.matcher else sm.with_matcher(matcher))
+    if rewrite_loops:
+        optimized = absorb_around_any_star(fuse(optimized))
+    if not keep_span:
+        optimized = strip_edges(optimized)
+    return merge_literals(optimized)
+
+
+def describe_code(code):
+    char = chr(code)
+    if char.isprintable() and char not in "\\]-^":
+        return char
+    return "\\x%02x" % code if code < 0x100 else "\\u%04x" % code if code < 0x10000 else "\\U%08x" % code
+
+
+def describe_class(char_class):
+    ranges = []
+    for start, end in char_class.ranges:
+        ranges.append(describe_code(start) if start == end else describe_code(start) + "-" + describe_code(end))
+    return "[" + ("^" if char_class.negate else "") + "".join(ranges) + "]"
+
+
+def describe_matcher(matcher):
+    """
+    :return: a short description of the characters matcher matches
+    """
+    if matcher is None:
+        return ""
+    if type(matcher) == CharMatcher:
+        return repr(bytes([matcher.char]) if isinstance(matcher.char, int) else matcher.char)
+    if type(matcher) == AnyMatcher:
+        return "ANY"
+    if type(matcher) in class_matchers:
+        return describe_class(matcher.char_class)
+    return type(matcher).__name__
+
+
+def dump_state_machines(state_machines):
+    """
+    :return: one line for each state machine: index, kind and what it matches
+    """
+    lines = []
+    for index, sm in enumerate(state_machines):
+        kind = kind_names.get(type(sm), type(sm).__name__)
+        if type(sm) == LiteralStateMachine:
+            argument = repr(sm.text)
+        elif type(sm) == CountedMatchStateMachine:
+            argument = describe_matcher(sm.matcher) + " {" + str(sm.min_count) + "," + \
+                       ("" if sm.max_count is None else str(sm.max_count)) + "}"
+        else:
+            argument = describe_matcher(sm.matcher)
+        lines.append(("%4d  %-10s %s" % (index, kind, argument)).rstrip())
+    return "\n".join(lines)
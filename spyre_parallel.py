@@ -0,0 +1,274 @@
+#!/usr/bin/python3
+
+"""
+SPYRE - Simple PYthon 3 Regular Expression Engine
+Copyright (C) 2018 Francesco Rigoni - francesco.rigoni@gmail.com
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License v3 as published by
+the Free Software Foundation.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+from spyre_engine import *
+from spyre_grep import *
+from concurrent.futures import ProcessPoolExecutor
+from collections import deque
+from itertools import islice
+import mmap
+import os
+
+
+DEFAULT_CHUNKSIZE = 1024
+
+# Size of the byte ranges a file is split into, there are at least as many ranges as workers
+DEFAULT_RANGE_SIZE = 16 * 1024 * 1024
+
+# Chunks submitted to the pool and not yet consumed, for each worker
+CHUNKS_IN_FLIGHT_PER_WORKER = 2
+
+# The pattern compiled by each worker process when it starts
+worker_pattern = None
+
+
+def init_worker(regexp, engine):
+    global worker_pattern
+    worker_pattern = compile(regexp, engine)
+
+
+def match_chunk(strings, anchored):
+    """
+    Runs in a worker process.
+    :return: the span of the match for each string, or None. Only spans travel back, the
+             strings are still in the parent process.
+    """
+    spans = []
+    for string in strings:
+        match = worker_pattern.match(string) if anchored else worker_pattern.search(string)
+        spans.append(match.span() if match is not None else None)
+    return spans
+
+
+def chunks_of(iterable, chunksize):
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, chunksize))
+        if not chunk:
+            return
+        yield chunk
+
+
+def match_many(regexp, iterable, workers=None, chunksize=DEFAULT_CHUNKSIZE, engine=DEFAULT_ENGINE, anchored=False):
+    """
+    Matches a regexp against every string of iterable, spreading the work over processes.
+    The regexp is compiled once in each worker, strings are sent in chunks of chunksize to
+    keep the cost of inter process communication low.
+    Results come back in the same order as iterable, as it is consumed: at most a few chunks
+    per worker are in flight at any time.
+    :param regexp: the regexp, or a Pattern
+    :param workers: number of processes, defaults to the number of CPUs. With 1 or less
+                    everything runs in the calling process
+    :param anchored: if True use match() rather than search()
+    :return: a generator of Match or None, one for each string
+    """
+    if isinstance(regexp, Pattern):
+        engine = regexp.engine
+        regexp = regexp.pattern
+    if workers is None:
+        workers = os.cpu_count() or 1
+
+    if workers <= 1:
+        pattern = compile(regexp, engine)
+        for string in iterable:
+            yield pattern.match(string) if anchored else pattern.search(string)
+        return
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_worker, initargs=(regexp, engine)) as executor:
+        in_flight = deque()
+        for chunk in chunks_of(iterable, chunksize):
+            in_flight.append((chunk, executor.submit(match_chunk, chunk, anchored)))
+            if len(in_flight) >= workers * CHUNKS_IN_FLIGHT_PER_WORKER:
+                for match in chunk_results(*in_flight.popleft()):
+                    yield match
+        while in_flight:
+            for match in chunk_results(*in_flight.popleft()):
+                yield match
+
+
+def chunk_results(chunk, future):
+    for string, span in zip(chunk, future.result()):
+        yield Match(string, span[0], span[1]) if span is not None else None
+
+
+def byte_ranges(size, workers, range_size=DEFAULT_RANGE_SIZE):
+    """
+    :return: list of (start, end) splitting size bytes into ranges of about the same size
+    """
+    if size == 0:
+        return []
+    count = max(workers, (size + range_size - 1) // range_size)
+    step = (size + count - 1) // count
+    return [(start, min(start + step, size)) for start in range(0, size, step)]
+
+
+def bounded_results(executor, workers, tasks):
+    """
+    Submits tasks, tuples of a function and its arguments, and generates their results in
+    order. At most a few tasks per worker are in flight at any time.
+    """
+    in_flight = deque()
+    for task in tasks:
+        in_flight.append(executor.submit(*task))
+        if len(in_flight) >= workers * CHUNKS_IN_FLIGHT_PER_WORKER:
+            yield in_flight.popleft().result()
+    while in_flight:
+        yield in_flight.popleft().result()
+
+
+def grep_range(path, start, end, invert, line_numbers):
+    """
+    Runs in a worker process, selects the lines of the file beginning between start and end.
+    A line straddling end belongs to this range, and is matched whole.
+    :return: list of (newlines, line_start, line_end) for the selected lines, newlines being
+             the number of newlines between the first line of the range and the line, and
+             the number of newlines in the range. Newlines are only counted if line_numbers
+    """
+    with open(path, "rb") as f:
+        data = map_file(f)
+        start = next_line_start(data, start)
+        end = next_line_start(data, end)
+        selected = []
+        newlines = 0
+        counted_up_to = start
+        lines = selected_lines(worker_pattern, data, invert, start, end)
+        try:
+            for line_start, line_end in lines:
+                if line_numbers:
+                    newlines += count_newlines(data, counted_up_to, line_start)
+                    counted_up_to = line_start
+                selected.append((newlines, line_start, line_end))
+            if line_numbers:
+                newlines += count_newlines(data, counted_up_to, end)
+        finally:
+            lines.close()
+            if isinstance(data, mmap.mmap):
+                data.close()
+        return selected, newlines
+
+
+def parallel_grep_lines(pattern, path, size, invert, workers, range_size=DEFAULT_RANGE_SIZE):
+    """
+    Selects the lines of a file like selected_lines, splitting it into byte ranges scanned
+    by different processes.
+    :param size: the size of the file
+    :return: a generator of (line_number, line_start, line_end), in file order
+    """
+    ranges = byte_ranges(size, workers, range_size)
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_worker,
+                             initargs=(pattern.pattern, pattern.engine)) as executor:
+        tasks = ((grep_range, path, start, end, invert, True) for start, end in ranges)
+        line_number = 1
+        for selected, newlines in bounded_results(executor, workers, tasks):
+            for line_newlines, line_start, line_end in selected:
+                yield line_number + line_newlines, line_start, line_end
+            line_number += newlines
+
+
+def find_range(path, start, end):
+    """
+    Runs in a worker process.
+    :return: the spans of the matches finditer finds from start beginning before end. The
+             last ones may end after end, no search goes further than the match it is reading
+    """
+    with open(path, "rb") as f:
+        data = map_file(f)
+        try:
+            return [match.span() for match in worker_pattern.finditer(data, start, None, end)]
+        finally:
+            if isinstance(data, mmap.mmap):
+                data.close()
+
+
+def next_search_pos(span):
+    # An empty match is stepped over, as finditer does
+    return span[1] if span[1] > span[0] else span[1] + 1
+
+
+def merge_range(pattern, data, spans, start, end, pos):
+    """
+    Turns the matches found by a worker from the start of its range into the matches found
+    searching from pos, where the matches of the previous ranges left off.
+    When a match of the previous range ends inside this one, pos is after start: the
+    positions the worker skipped are the ones inside its own matches, only those are tried
+    again until a match the worker found is met, from there the two agree.
+    :return: the list of the spans, and the position the search goes on from
+    """
+    merged = []
+    i = 0
+    while True:
+        while i < len(spans) and spans[i][0] < pos:
+            i += 1
+        # Where the worker resumed searching before finding spans[i]. No match begins
+        # between there and spans[i], nor after the last span up to end
+        resumed = next_search_pos(spans[i - 1]) if i > 0 else start
+        found = None
+        for candidate in range(pos, min(resumed, end)):
+            match = pattern.match(data, candidate)
+            if match is not None:
+                found = match.span()
+                break
+        if found is None:
+            merged.extend(spans[i:])
+            if i < len(spans):
+                pos = next_search_pos(spans[-1])
+            # No other match begins before end
+            return merged, max(pos, end)
+        merged.append(found)
+        pos = next_search_pos(found)
+
+
+def parallel_finditer(regexp, path, workers=None, range_size=DEFAULT_RANGE_SIZE, engine=DEFAULT_ENGINE):
+    """
+    Generates the matches finditer finds in a file, splitting the file into byte ranges
+    searched by different processes. Matches straddling two ranges are found once, and in
+    file order.
+    :param regexp: a bytes regexp, or a Pattern
+    :param workers: number of processes, defaults to the number of CPUs
+    :return: a generator of StreamMatch, holding the matched bytes since the file is not kept
+    """
+    pattern = regexp if isinstance(regexp, Pattern) else compile(regexp, engine)
+    if workers is None:
+        workers = os.cpu_count() or 1
+
+    with open(path, "rb") as f:
+        data = map_file(f)
+        try:
+            if workers <= 1:
+                for match in pattern.finditer(data):
+                    yield StreamMatch(match.group(), match.start(), match.end())
+                return
+
+            ranges = byte_ranges(len(data), workers, range_size)
+            pos = 0
+            with ProcessPoolExecutor(max_workers=workers, initializer=init_worker,
+                                     initargs=(pattern.pattern, pattern.engine)) as executor:
+                tasks = ((find_range, path, start, end) for start, end in ranges)
+                for (start, end), spans in zip(ranges, bounded_results(executor, workers, tasks)):
+                    merged, pos = merge_range(pattern, data, spans, start, end, pos)
+                    for match_start, match_end in merged:
+                        yield StreamMatch(data[match_start:match_end], match_start, match_end)
+            # An empty match at the end of the file is in no range
+            if pos <= len(data):
+                match = pattern.match(data, len(data))
+                if match is not None:
+                    yield StreamMatch(match.group(), match.start(), match.end())
+        finally:
+            if isinstance(data, mmap.mmap):
+                data.close()
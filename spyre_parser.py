@@ -26,43 +26,104 @@ class RegExpParseException(Exception):
 
 def parse_square_brackets_block(block):
     """
-    Example: 0-9, abc
+    Example: 0-9, abc, a-cx-z0
     :param block: the block between square brackets, brackets excluded
     :return: a matcher describing the block
     """
     exclude_chars_in_block = False
-    if block[0] == '^':
+    if len(block) > 0 and block[0] == '^':
         # Exclude characters described in this block
         exclude_chars_in_block = True
         block = block[1:]
 
-    if '-' in block:
-        for i in range(len(block)):
-            if block[i] == '-':
-                if 0 < i < len(block)-1:
-                    return ExcludeRangeMatcher(block[i-1], block[i+1]) \
-                        if exclude_chars_in_block is True \
-                        else RangeMatcher(block[i-1], block[i+1])
-                else:
-                    raise RegExpParseException("parse_square_brackets_block: parse error, malformed block")
-    else:
+    if len(block) == 0:
+        raise RegExpParseException("parse_square_brackets_block: parse error, empty block")
+
+    # A '-' between two characters describes a range, anywhere else it is a literal
+    ranges = []
+    chars = []
+    i = 0
+    while i < len(block):
+        if i + 2 < len(block) and block[i + 1] == '-':
+            if block[i] > block[i + 2]:
+                raise RegExpParseException("parse_square_brackets_block: parse error, inverted range " +
+                                           block[i] + "-" + block[i + 2])
+            ranges.append((block[i], block[i + 2]))
+            i += 3
+        else:
+            chars.append(block[i])
+            i += 1
+
+    if len(ranges) == 1 and len(chars) == 0:
+        start_char, end_char = ranges[0]
+        return ExcludeRangeMatcher(start_char, end_char) \
+            if exclude_chars_in_block is True \
+            else RangeMatcher(start_char, end_char)
+    elif len(ranges) == 0:
         return ExcludePoolMatcher(block) \
             if exclude_chars_in_block is True \
             else PoolMatcher(block)
+    else:
+        code_ranges = [(ord(start_char), ord(end_char)) for start_char, end_char in ranges]
+        code_ranges += [(ord(char), ord(char)) for char in chars]
+        return CharClassMatcher(code_ranges, negate=exclude_chars_in_block)
+
+
+# Largest bound of a counted repetition
+MAX_REPEAT = 65535
 
 
 def is_frequency_modifier(char):
     return char in ['?', '*', '+']
 
 
+def parse_counted_repetition(regexp, position):
+    """
+    Example: {3}, {2,5}, {2,}, {,5}, {,}
+    :param position: where the opening brace is
+    :return: the text of the counted repetition, or None if there is none at position, then
+             the braces are literal characters
+    """
+    end = regexp.find('}', position)
+    if position >= len(regexp) or regexp[position] != '{' or end == -1:
+        return None
+    bounds = regexp[position + 1:end].split(',')
+    if len(bounds) > 2 or bounds == [""] or \
+            not all(bound == "" or bound.isdigit() and bound.isascii() for bound in bounds):
+        return None
+    return regexp[position:end + 1]
+
+
+def counted_repetition_bounds(frequency_modifier):
+    """
+    :param frequency_modifier: a counted repetition, as returned by parse_counted_repetition
+    :return: the minimum and the maximum number of repetitions, the maximum is None if unbounded
+    """
+    bounds = frequency_modifier[1:-1].split(',')
+    min_count = int(bounds[0]) if bounds[0] != "" else 0
+    if len(bounds) == 1:
+        max_count = min_count
+    else:
+        max_count = int(bounds[1]) if bounds[1] != "" else None
+    if max(min_count, max_count or 0) > MAX_REPEAT:
+        raise RegExpParseException("Counted repetition " + frequency_modifier + " larger than " + str(MAX_REPEAT))
+    if max_count is not None and max_count < min_count:
+        raise RegExpParseException("Counted repetition " + frequency_modifier + " with maximum below minimum")
+    return min_count, max_count
+
+
 def lookahead_for_frequency_modifier(regexp, position):
     next_position = position + 1
     if next_position < len(regexp) and is_frequency_modifier(regexp[next_position]):
         return regexp[next_position]
+    return parse_counted_repetition(regexp, next_position)
 
 
 def build_state_machine_with_frequency_modifier(matcher, frequency_modifier):
-    if frequency_modifier == '?':
+    if frequency_modifier is not None and frequency_modifier[0] == '{':
+        min_count, max_count = counted_repetition_bounds(frequency_modifier)
+        return CountedMatchStateMachine(matcher, min_count, max_count)
+    elif frequency_modifier == '?':
         return ZeroOrOneMatchStateMachine(matcher)
     elif frequency_modifier == '+':
         return OneOrMoreMatchStateMachine(matcher)
@@ -72,6 +133,37 @@ def build_state_machine_with_frequency_modifier(matcher, frequency_modifier):
         return SingleMatchStateMachine(matcher)
 
 
+def skip_counted_repetition(regexp, position, frequency_modifier):
+    """
+    :param position: where the element followed by frequency_modifier ends
+    :return: where parsing goes on after a counted repetition
+    """
+    if frequency_modifier is None or frequency_modifier[0] != '{':
+        return position + 1
+    end = position + 1 + len(frequency_modifier)
+    # Consecutive frequency modifiers are not supported
+    if lookahead_for_frequency_modifier(regexp, end - 1) is not None:
+        raise RegExpParseException("Unexpected frequency modifier in regexp " + regexp + " at position " + str(end))
+    return end
+
+
+def to_bytes_matcher(matcher):
+    """
+    :return: a matcher accepting the byte values, rather than the characters, matcher accepts
+    """
+    if type(matcher) == CharMatcher:
+        return CharMatcher(ord(matcher.char))
+    elif isinstance(matcher, CharClassMatcher):
+        return ByteClassMatcher(matcher.char_class)
+    return matcher
+
+
+def to_bytes_state_machine(state_machine):
+    if state_machine.matcher is None:
+        return state_machine
+    return state_machine.with_matcher(to_bytes_matcher(state_machine.matcher))
+
+
 def parse_regexp(regexp):
     """
     AKA not the best parsing ever
@@ -79,14 +171,24 @@ def parse_regexp(regexp):
        abc[0-9]+    : literal a, literal b, literal c, range[0-9] one or more times
        abc[abc]*    : literal a, literal b, literal c, a or b or c one or more times
        a+bc[abc]?   : literal a one or more times, literal b, literal c, a or b or c zero or one times
+       a[0-9]{2,4}  : literal a, range[0-9] two to four times
 
-    :param regexp: supports [abcd], [a-z], *,+,?, and literals
+    :param regexp: supports [abcd], [a-z], *,+,?, {m,n} and literals. When regexp is bytes the state
+                   machines match byte values, as found in bytes, bytearray, memoryview and mmap
     :return: a list of state machines representing the regexp
     """
+    if isinstance(regexp, (bytes, bytearray)):
+        # Parse as Latin-1, one character per byte, then switch the matchers to byte values
+        return [to_bytes_state_machine(sm) for sm in parse_regexp(bytes(regexp).decode("latin-1"))]
+
     escape = None
     current_group = None
     state_machines = []
+    # Counted repetitions are read by the element they follow, their characters are skipped
+    skip_until = 0
     for i in range(len(regexp)):
+        if i < skip_until:
+            continue
         if regexp[i] == '\\':
             # Consider escape when reading next character
             escape = True
@@ -106,6 +208,7 @@ def parse_regexp(regexp):
                 frequency_modifier = lookahead_for_frequency_modifier(regexp, i)
                 state_machine = build_state_machine_with_frequency_modifier(matcher, frequency_modifier)
                 state_machines.append(state_machine)
+                skip_until = skip_counted_repetition(regexp, i, frequency_modifier)
             elif is_frequency_modifier(regexp[i]):
                 # Check for consecutive frequency modifiers, which are not supported
                 frequency_modifier = lookahead_for_frequency_modifier(regexp, i)
@@ -119,6 +222,7 @@ def parse_regexp(regexp):
                 matcher = parse_square_brackets_block(current_group)
                 state_machine = build_state_machine_with_frequency_modifier(matcher, frequency_modifier)
                 state_machines.append(state_machine)
+                skip_until = skip_counted_repetition(regexp, i, frequency_modifier)
                 current_group = None
             else:
                 current_group.append(regexp[i])
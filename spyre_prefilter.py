@@ -0,0 +1,141 @@
+#!/usr/bin/python3
+
+"""
+SPYRE - Simple PYthon 3 Regular Expression Engine
+Copyright (C) 2018 Francesco Rigoni - francesco.rigoni@gmail.com
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License v3 as published by
+the Free Software Foundation.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+from spyre_internals import *
+
+
+class Prefilter:
+    """
+    What can be told about the strings matched by a regexp without running it.
+    prefix:      literal every match starts with
+    required:    literals every match contains, longest first
+    min_length:  minimum length of a match
+    """
+    __slots__ = ("prefix", "required", "min_length")
+
+    def __init__(self, prefix, required, min_length):
+        self.prefix = prefix
+        self.required = tuple(required)
+        self.min_length = min_length
+
+    def __repr__(self):
+        return "Prefilter(prefix=" + repr(self.prefix) + ", required=" + repr(self.required) + \
+               ", min_length=" + str(self.min_length) + ")"
+
+    def rejects(self, string, pos, endpos):
+        """
+        :return: True if the string cannot contain a match between pos and endpos
+        """
+        if endpos - pos < self.min_length:
+            return True
+        if not searchable(string):
+            return False
+        for literal in self.required:
+            if string.find(literal, pos, endpos) == -1:
+                return True
+        return False
+
+    def rejects_at(self, string, pos, endpos):
+        """
+        :return: True if no match can start exactly at pos
+        """
+        if endpos - pos < self.min_length:
+            return True
+        if len(self.prefix) == 0 or not searchable(string):
+            return False
+        # find() rather than startswith(), mmap has no startswith()
+        return string.find(self.prefix, pos, min(endpos, pos + len(self.prefix))) != pos
+
+
+def searchable(string):
+    """
+    :return: True if the string has find(), memoryview for instance does not
+    """
+    return hasattr(string, "find")
+
+
+def literal_char(state_machine):
+    """
+    :return: the character a state machine matches if it is a literal, None otherwise.
+             For state machines matching byte values it is returned as a bytes object.
+    """
+    if type(state_machine.matcher) == CharMatcher:
+        char = state_machine.matcher.char
+        return char if isinstance(char, str) else bytes([char])
+    return None
+
+
+def min_width(state_machine):
+    if type(state_machine) == LiteralStateMachine:
+        return len(state_machine.chars)
+    if type(state_machine) in (SingleMatchStateMachine, OneOrMoreMatchStateMachine):
+        return 1
+    if type(state_machine) == CountedMatchStateMachine:
+        return state_machine.min_count
+    return 0
+
+
+def build_prefilter(state_machines, bytes_mode=False):
+    """
+    Analyzes the state machines produced by parse_regexp, or optimized ones.
+    :param bytes_mode: True if the state machines match byte values, literals are then bytes
+    :return: a Prefilter
+    """
+    empty = b"" if bytes_mode else ""
+    min_length = sum(min_width(sm) for sm in state_machines)
+
+    # Runs of characters that must appear one after the other in every match.
+    # "x+" contributes an "x" at both ends of the run it breaks: "ax+b" requires "ax" and "xb"
+    runs = []
+    run = empty
+    for sm in state_machines:
+        char = literal_char(sm) if type(sm) in (SingleMatchStateMachine, OneOrMoreMatchStateMachine) else None
+        if type(sm) == LiteralStateMachine:
+            run += sm.text
+        elif char is None:
+            if type(sm) in (StartOfStringStateMachine, EndOfStringStateMachine):
+                # Anchors take no room, the characters around them are still adjacent
+                continue
+            runs.append(run)
+            run = empty
+        elif type(sm) == OneOrMoreMatchStateMachine:
+            runs.append(run + char)
+            run = char
+        else:
+            run += char
+    runs.append(run)
+
+    prefix = empty
+    for sm in state_machines:
+        if type(sm) == StartOfStringStateMachine:
+            continue
+        if type(sm) == LiteralStateMachine:
+            prefix += sm.text
+            continue
+        if type(sm) != SingleMatchStateMachine or literal_char(sm) is None:
+            if type(sm) == OneOrMoreMatchStateMachine and literal_char(sm) is not None:
+                prefix += literal_char(sm)
+            break
+        prefix += literal_char(sm)
+
+    required = sorted(set(run for run in runs if len(run) > 0), key=lambda run: (-len(run), run))
+    # Literals contained in longer ones are already checked by them
+    required = [literal for i, literal in enumerate(required)
+                if not any(literal in longer for longer in required[:i])]
+    return Prefilter(prefix, required, min_length)
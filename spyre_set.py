@@ -0,0 +1,341 @@
+#!/usr/bin/python3
+
+"""
+SPYRE - Simple PYthon 3 Regular Expression Engine
+Copyright (C) 2018 Francesco Rigoni - francesco.rigoni@gmail.com
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License v3 as published by
+the Free Software Foundation.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+from spyre_parser import *
+from spyre_dfa import *
+
+# Cache entries of a SetDFA for each instruction of its NFA, when its cache size is not given:
+# sets of many regexps have many states
+SET_CACHE_ENTRIES_PER_INSTRUCTION = 2
+
+
+class AhoCorasick:
+    """
+    Finds which of many literals occur in a string, in a single pass.
+    """
+    def __init__(self, keywords):
+        """
+        :param keywords: list of (literal, value), the values of the literals found are reported
+        """
+        self.goto = [{}]
+        self.fail = [0]
+        self.out = [set()]
+        for literal, value in keywords:
+            node = 0
+            for char in literal:
+                next_node = self.goto[node].get(char)
+                if next_node is None:
+                    next_node = len(self.goto)
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.out.append(set())
+                    self.goto[node][char] = next_node
+                node = next_node
+            self.out[node].add(value)
+
+        # Breadth first, so the failure link of the parent is known before its children
+        queue = list(self.goto[0].values())
+        for node in queue:
+            for char, child in self.goto[node].items():
+                fail = self.fail[node]
+                while fail and char not in self.goto[fail]:
+                    fail = self.fail[fail]
+                self.fail[child] = self.goto[fail].get(char, 0)
+                self.out[child] |= self.out[self.fail[child]]
+                queue.append(child)
+        self.out = [frozenset(values) for values in self.out]
+
+    def scan(self, string, pos, endpos, found):
+        """
+        Adds to found the values of the literals occurring in string between pos and endpos.
+        """
+        goto = self.goto
+        fail = self.fail
+        out = self.out
+        node = 0
+        for i in range(pos, endpos):
+            char = string[i]
+            while node and char not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(char, 0)
+            if out[node]:
+                found |= out[node]
+        return found
+
+
+class SetDFAState:
+    """
+    The NFA instructions alive at a position, with no priority order, but for the roots of
+    the SetDFA, and the indexes of the regexps matching at that position.
+    """
+    __slots__ = ("pcs", "matches", "transitions")
+
+    def __init__(self, pcs, matches):
+        self.pcs = pcs
+        self.matches = matches
+        self.transitions = {}
+
+
+class SetDFA:
+    """
+    Lazy DFA over an NFA built by compile_nfa_set, finding every regexp that matches
+    anywhere in the string. Caching works as in LazyDFA.
+    Every position starts a match of every regexp, the instructions reached from the start,
+    the roots, are alive everywhere: states leave them out, and what they reach with each
+    character is computed once. States and steps only cost the regexps being matched.
+    """
+    def __init__(self, nfa, max_cache_entries=None):
+        """
+        :param max_cache_entries: by default SET_CACHE_ENTRIES_PER_INSTRUCTION for each
+                                  instruction of the NFA, DEFAULT_MAX_CACHE_ENTRIES at least
+        """
+        self.nfa = nfa
+        if max_cache_entries is None:
+            max_cache_entries = max(DEFAULT_MAX_CACHE_ENTRIES, SET_CACHE_ENTRIES_PER_INSTRUCTION * len(nfa))
+        self.max_cache_entries = max_cache_entries
+        self.states = {}
+        self.start_states = {}
+        self.cache_entries = 0
+        self.cache_resets = 0
+        self.fallbacks = 0
+        self.roots, self.root_matches = self.follow([0], False, False)
+        self.root_set = frozenset(self.roots)
+        self.root_ends = [nfa.xs[pc] for pc in self.roots if nfa.ops[nfa.instruction(pc)] == op_assert_end]
+        # Character -> instructions, but for the roots, reached from the roots with it. Each
+        # is a cache entry, thrown away with the states when the cache is reset
+        self.root_transitions = {}
+
+    def follow(self, pcs, at_start, at_end):
+        """
+        :return: the instructions reachable from pcs without consuming characters, and the
+                 indexes of the regexps whose match instruction is reached
+        """
+        nfa = self.nfa
+        out = set()
+        matches = set()
+        seen = set()
+        stack = list(pcs)
+        while stack:
+            pc = stack.pop()
+            if pc in seen:
+                continue
+            seen.add(pc)
+            instruction = nfa.instruction(pc)
+            op = nfa.ops[instruction]
+            if op < op_split:
+                out.add(pc)
+            elif op == op_split:
+                stack.append(nfa.xs[instruction])
+                stack.append(nfa.ys[instruction])
+            elif op == op_jump:
+                stack.append(nfa.xs[instruction])
+            elif op == op_assert_start:
+                if at_start:
+                    stack.append(nfa.xs[instruction])
+            elif op == op_assert_end:
+                if at_end:
+                    stack.append(nfa.xs[instruction])
+                else:
+                    out.add(pc)
+            elif op == op_match:
+                matches.add(nfa.xs[instruction])
+            elif op == op_repeat:
+                stack.extend(target for target in nfa.repeat(pc) if target is not None)
+        return tuple(sorted(out)), frozenset(matches)
+
+    def without_roots(self, pcs, matches):
+        root_set = self.root_set
+        return tuple(pc for pc in pcs if pc not in root_set), matches
+
+    def successors(self, pcs, char):
+        nfa = self.nfa
+        return [nfa.successor(pc) for pc in pcs if nfa.ops[nfa.instruction(pc)] < op_split and nfa.accepts(pc, char)]
+
+    def step_pcs(self, pcs, char):
+        """
+        :return: the instructions, but for the roots, alive after char and the indexes of the
+                 regexps matching there
+        """
+        root_pcs = self.root_transitions.get(char)
+        if root_pcs is None:
+            root_pcs = self.without_roots(*self.follow(self.successors(self.roots, char), False, False))
+            if self.cache_entries >= self.max_cache_entries:
+                self.reset_cache()
+            self.root_transitions[char] = root_pcs
+            self.cache_entries += 1
+        if not pcs:
+            # Only the roots were alive, every position can start a match
+            return root_pcs[0], root_pcs[1] | self.root_matches
+        next_pcs, matches = self.without_roots(*self.follow(self.successors(pcs, char), False, False))
+        if root_pcs[0]:
+            next_pcs = tuple(sorted(set(next_pcs).union(root_pcs[0])))
+        return next_pcs, matches | root_pcs[1] | self.root_matches
+
+    def matches_at_end(self, pcs, at_start):
+        nfa = self.nfa
+        ends = self.root_ends + [nfa.xs[pc] for pc in pcs if nfa.ops[nfa.instruction(pc)] == op_assert_end]
+        return self.follow(ends, at_start, True)[1] if ends else frozenset()
+
+    def reset_cache(self):
+        self.states = {}
+        self.start_states = {}
+        self.root_transitions = {}
+        self.cache_entries = 0
+        self.cache_resets += 1
+
+    def intern(self, pcs, matches):
+        key = (pcs, matches)
+        state = self.states.get(key)
+        if state is None:
+            if self.cache_entries >= self.max_cache_entries:
+                self.reset_cache()
+            state = SetDFAState(pcs, matches)
+            self.states[key] = state
+            self.cache_entries += 1
+        return state
+
+    def start_state(self, at_start):
+        state = self.start_states.get(at_start)
+        if state is None:
+            state = self.intern(*self.without_roots(*self.follow([0], at_start, False)))
+            self.start_states[at_start] = state
+        return state
+
+    def scan(self, string, pos, endpos, found, wanted):
+        """
+        Adds to found the indexes of the regexps matching in string between pos and endpos.
+        Stops as soon as wanted regexps are found.
+        """
+        state = self.start_state(pos == 0)
+        found |= state.matches
+        resets = self.cache_resets
+        scanned = 0
+        for i in range(pos, endpos):
+            if len(found) >= wanted:
+                return found
+            char = string[i]
+            next_state = state.transitions.get(char)
+            if next_state is None:
+                next_state = self.intern(*self.step_pcs(state.pcs, char))
+                state.transitions[char] = next_state
+                self.cache_entries += 1
+                if self.cache_resets != resets:
+                    if scanned < THRASHING_CHARS_PER_ENTRY * self.max_cache_entries:
+                        self.fallbacks += 1
+                        found |= next_state.matches
+                        return self.scan_uncached(string, i + 1, endpos, next_state.pcs, found)
+                    resets = self.cache_resets
+                    scanned = 0
+            state = next_state
+            scanned += 1
+            if state.matches:
+                found |= state.matches
+
+        found |= self.matches_at_end(state.pcs, endpos == 0)
+        return found
+
+    def scan_uncached(self, string, i, endpos, pcs, found):
+        while i < endpos:
+            pcs, matches = self.step_pcs(pcs, string[i])
+            found |= matches
+            i += 1
+        found |= self.matches_at_end(pcs, endpos == 0)
+        return found
+
+
+def literal_of(state_machines):
+    """
+    :return: the literal a regexp is made of, or None if it is not a plain literal
+    """
+    if len(state_machines) == 0:
+        return None
+    chars = []
+    for sm in state_machines:
+        if type(sm) == LiteralStateMachine:
+            chars.extend(sm.chars)
+        elif type(sm) != SingleMatchStateMachine or type(sm.matcher) != CharMatcher:
+            return None
+        else:
+            chars.append(sm.matcher.char)
+    return tuple(chars)
+
+
+class RegexSet:
+    """
+    Matches many regexps at once and tells which of them match somewhere in a string.
+    Plain literals are found by an Aho-Corasick automaton, all the other regexps are merged
+    into a single lazy DFA. The DFA is skipped when none of the other regexps can match
+    because a literal they require is missing, which Aho-Corasick finds in the same pass.
+    """
+    def __init__(self, regexps, max_cache_entries=None):
+        self.patterns = list(regexps)
+        self.bytes_mode = len(self.patterns) > 0 and isinstance(self.patterns[0], (bytes, bytearray))
+        keywords = []
+        # Indexes of the regexps handled by the DFA
+        self.dfa_indexes = []
+        dfa_state_machines = []
+        # Keys of the literals gating the DFA, one for each DFA regexp requiring a literal
+        self.gates = []
+        self.always_run_dfa = False
+        for i, regexp in enumerate(self.patterns):
+            if isinstance(regexp, (bytes, bytearray)) != self.bytes_mode:
+                raise TypeError("cannot mix str and bytes regexps in a RegexSet")
+            # Only which regexps match is reported, ".*" at their edges changes nothing
+            state_machines = optimize(parse_regexp(regexp), keep_span=False)
+            literal = literal_of(state_machines)
+            if literal is not None:
+                keywords.append((literal, i))
+                continue
+            self.dfa_indexes.append(i)
+            dfa_state_machines.append(state_machines)
+            required = build_prefilter(state_machines, self.bytes_mode).required
+            if len(required) > 0:
+                gate = ("gate", i)
+                keywords.append((required[0], gate))
+                self.gates.append(gate)
+            else:
+                self.always_run_dfa = True
+
+        self.aho_corasick = AhoCorasick(keywords) if len(keywords) > 0 else None
+        self.literal_count = len(self.patterns) - len(self.dfa_indexes)
+        self.dfa = SetDFA(compile_nfa_set(dfa_state_machines), max_cache_entries) \
+            if len(dfa_state_machines) > 0 else None
+
+    def __len__(self):
+        return len(self.patterns)
+
+    def matches(self, string, pos=0, endpos=None):
+        """
+        :return: the sorted list of the indexes of the regexps matching string between pos and endpos
+        """
+        if isinstance(string, str) == self.bytes_mode and len(self.patterns) > 0:
+            raise TypeError("cannot match str and bytes together")
+        endpos = len(string) if endpos is None else min(endpos, len(string))
+        found = set()
+        if self.aho_corasick is not None:
+            self.aho_corasick.scan(string, pos, endpos, found)
+
+        matched = set(i for i in found if not isinstance(i, tuple))
+        if self.dfa is not None and (self.always_run_dfa or any(gate in found for gate in self.gates)):
+            dfa_found = self.dfa.scan(string, pos, endpos, set(), len(self.dfa_indexes))
+            matched |= set(self.dfa_indexes[i] for i in dfa_found)
+        return sorted(matched)
+
+    def is_match(self, string, pos=0, endpos=None):
+        return len(self.matches(string, pos, endpos)) > 0
@@ -0,0 +1,590 @@
+#!/usr/bin/python3
+
+"""
+SPYRE - Simple PYthon 3 Regular Expression Engine
+Copyright (C) 2018 Francesco Rigoni - francesco.rigoni@gmail.com
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License v3 as published by
+the Free Software Foundation.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+from spyre_engine import *
+import mmap
+import os
+import struct
+import sys
+import threading
+import zlib
+
+# File layout, all integers little endian:
+#   header:  MAGIC, FORMAT_VERSION (uint16), number of patterns (uint32)
+#   index:   for each pattern, offset and length of its key, offset, length and CRC32 of its record
+#   data:    the keys and the records the index points to
+# A key is the type of the regexp (0 str, 1 bytes), the engine name and the regexp.
+# A record is made of fixed size tables, each read with a single unpack:
+#   sizes:          state machines, ranges, bytes of text, required literals, NFAs, DFAs
+#   limits:         max_steps and timeout of the pattern, -1 for none
+#   state machines: type, matcher type, two arguments of the matcher, bounds of counted repetitions
+#   ranges:         first and last code point of the ranges of the character classes
+#   prefilter:      min_length, then offset and length in the text of the prefix and required literals
+#   text:           characters of the pools and of the prefilter literals, UTF-8 for str patterns
+#   NFAs:           the NFAPrograms the engine runs, lowered: their ops, args, xs and ys arrays,
+#                   read at once into arrays, then their classes, matchers and repeats tables
+#   DFAs:           the states a LazyDFA has built, their instructions and transitions
+# The engines running NFAs are built from them, nothing is parsed nor compiled. The state
+# machines are only saved for the other engines.
+# Records are only decoded when their pattern is asked for, after their CRC32 is checked. Every
+# index into a table is checked against its size, a damaged record is compiled again.
+
+MAGIC = b"SPYRE\0"
+
+# To be increased whenever the layout, or the NFA the DFA states refer to, changes.
+# Files with another version are ignored and their patterns compiled again.
+FORMAT_VERSION = 5
+
+header_format = struct.Struct("<6sHI")
+index_format = struct.Struct("<QIQII")
+key_format = struct.Struct("<BI")
+sizes_format = struct.Struct("<IIIIBB")
+limits_format = struct.Struct("<qd")
+nfa_sizes_format = struct.Struct("<BIIII")
+dfa_sizes_format = struct.Struct("<BIIIB")
+
+state_machine_codes = {
+    StartOfStringStateMachine: 0,
+    EndOfStringStateMachine: 1,
+    SingleMatchStateMachine: 2,
+    ZeroOrOneMatchStateMachine: 3,
+    OneOrMoreMatchStateMachine: 4,
+    ZeroOrMoreMatchStateMachine: 5,
+    CountedMatchStateMachine: 6,
+}
+state_machine_types = dict((code, sm_type) for sm_type, code in state_machine_codes.items())
+
+matcher_none = 0
+matcher_char = 1
+matcher_any = 2
+matcher_class = 3
+matcher_negated_class = 4
+matcher_range = 5
+matcher_exclude_range = 6
+matcher_pool = 7
+matcher_exclude_pool = 8
+
+# The attributes of the backends holding NFAs, also the arguments building them
+nfa_names = ("nfa", "reverse_nfa")
+dfa_names = ("forward", "anchored")
+
+
+class StoreFormatException(Exception):
+    pass
+
+
+def encode_text(text, bytes_mode):
+    # Lone surrogates are valid in Python strings, keep them
+    return bytes(text) if bytes_mode else text.encode("utf-8", "surrogatepass")
+
+
+def decode_text(data, bytes_mode):
+    return bytes(data) if bytes_mode else data.decode("utf-8", "surrogatepass")
+
+
+def store_key(regexp, engine):
+    """
+    :return: the key of a pattern in the index of a PatternStore
+    """
+    if isinstance(regexp, (bytes, bytearray)):
+        return bytes, bytes(regexp), engine
+    return str, regexp, engine
+
+
+def encode_key(regexp, engine):
+    bytes_mode = isinstance(regexp, (bytes, bytearray))
+    engine_name = engine.encode("utf-8")
+    return key_format.pack(1 if bytes_mode else 0, len(engine_name)) + engine_name + encode_text(regexp, bytes_mode)
+
+
+def decode_key(data):
+    kind, engine_length = key_format.unpack_from(data)
+    engine = data[key_format.size:key_format.size + engine_length].decode("utf-8")
+    regexp = decode_text(data[key_format.size + engine_length:], kind == 1)
+    return store_key(regexp, engine)
+
+
+def pack_array(code, values):
+    return struct.pack("<" + code * len(values), *values)
+
+
+def pack_table(row_format, rows):
+    return struct.pack("<" + row_format * len(rows), *[value for row in rows for value in row])
+
+
+def pack_ints(values):
+    """
+    :return: the bytes of an array("i"), little endian as the rest of the file
+    """
+    if sys.byteorder == "big":
+        values = array("i", values)
+        values.byteswap()
+    return values.tobytes()
+
+
+class RecordWriter:
+    """
+    Builds a record: fixed size rows are packed in tables, texts go to a shared blob and
+    are referred to by offset and length.
+    """
+    def __init__(self, bytes_mode):
+        self.bytes_mode = bytes_mode
+        self.state_machines = []
+        self.ranges = []
+        self.text = []
+        self.text_length = 0
+        # The rows of the CharClasses packed already, the NFAs of a pattern share them
+        self.class_rows = {}
+
+    def add_text(self, text):
+        data = encode_text(text, self.bytes_mode)
+        self.text.append(data)
+        self.text_length += len(data)
+        return self.text_length - len(data), len(data)
+
+    def add_ranges(self, ranges):
+        self.ranges.extend(ranges)
+        return len(self.ranges) - len(ranges), len(ranges)
+
+    def matcher_row(self, matcher):
+        """
+        :return: the type of matcher and its two arguments
+        """
+        matcher_type = type(matcher)
+        if matcher is None:
+            row = (matcher_none, 0, 0)
+        elif matcher_type == CharMatcher:
+            row = (matcher_char, matcher.char if self.bytes_mode else ord(matcher.char), 0)
+        elif matcher_type == AnyMatcher:
+            row = (matcher_any, 0, 0)
+        elif matcher_type in (RangeMatcher, ExcludeRangeMatcher):
+            row = (matcher_range if matcher_type == RangeMatcher else matcher_exclude_range,
+                   ord(matcher.start_char), ord(matcher.end_char))
+        elif matcher_type in (PoolMatcher, ExcludePoolMatcher):
+            row = (matcher_pool if matcher_type == PoolMatcher else matcher_exclude_pool,) + \
+                  self.add_text("".join(matcher.chars))
+        elif matcher_type in (CharClassMatcher, ByteClassMatcher):
+            row = (matcher_negated_class if matcher.char_class.negate else matcher_class,) + \
+                  self.add_ranges(matcher.char_class.ranges)
+        else:
+            raise ValueError("cannot serialize " + matcher_type.__name__)
+        return row
+
+    def add_state_machine(self, sm):
+        code = state_machine_codes.get(type(sm))
+        if code is None:
+            raise ValueError("cannot serialize " + type(sm).__name__)
+        if type(sm) == CountedMatchStateMachine:
+            bounds = (sm.min_count, -1 if sm.max_count is None else sm.max_count)
+        else:
+            bounds = (0, 0)
+        self.state_machines.append((code,) + self.matcher_row(sm.matcher) + bounds)
+
+    def nfa(self, number, nfa):
+        """
+        Packs the arrays and the tables of an NFAProgram.
+        """
+        classes = []
+        for char_class in nfa.classes:
+            row = self.class_rows.get(id(char_class))
+            if row is None:
+                row = self.class_rows[id(char_class)] = (1 if char_class.negate else 0,) + \
+                    self.add_ranges(char_class.ranges)
+            classes.append(row)
+        matchers = [self.matcher_row(matcher) for matcher in nfa.matchers]
+        return nfa_sizes_format.pack(number, len(nfa), len(classes), len(matchers), len(nfa.repeats)) + \
+            nfa.ops.tobytes() + pack_ints(nfa.args) + pack_ints(nfa.xs) + pack_ints(nfa.ys) + \
+            pack_table("BII", classes) + pack_table("BII", matchers) + pack_table("ii", nfa.repeats)
+
+    def dfa(self, number, dfa):
+        """
+        Packs the states a LazyDFA has built so far, and their transitions.
+        """
+        states = list(dfa.states.values())
+        numbers = dict((id(state), i) for i, state in enumerate(states))
+        rows = []
+        pcs = []
+        transitions = []
+        for state in states:
+            state_transitions = [(char if self.bytes_mode else ord(char), numbers[id(target)])
+                                 for char, target in state.transitions.items() if id(target) in numbers]
+            rows.append((len(state.pcs), len(state_transitions)))
+            pcs.extend(state.pcs)
+            transitions.extend(state_transitions)
+        start_states = [(1 if at_start else 0, numbers[id(state)])
+                        for at_start, state in dfa.start_states.items() if id(state) in numbers]
+        return dfa_sizes_format.pack(number, len(states), len(pcs), len(transitions), len(start_states)) + \
+            pack_table("II", rows) + pack_array("i", pcs) + pack_table("II", transitions) + \
+            pack_table("BI", start_states)
+
+    def record(self, state_machines, prefilter, limits, nfas, dfas):
+        """
+        :param limits: the Limits of the pattern, or None
+        :param nfas: (number in nfa_names, NFAProgram) pairs
+        :param dfas: (number in dfa_names, LazyDFA) pairs
+        :return: the record, as bytes
+        """
+        for sm in state_machines:
+            self.add_state_machine(sm)
+        packed_nfas = [self.nfa(number, nfa) for number, nfa in nfas]
+        literals = [self.add_text(prefilter.prefix)] + [self.add_text(literal) for literal in prefilter.required]
+        max_steps = limits.max_steps if limits is not None and limits.max_steps is not None else -1
+        timeout = limits.timeout if limits is not None and limits.timeout is not None else -1
+        parts = [sizes_format.pack(len(self.state_machines), len(self.ranges), self.text_length,
+                                   len(prefilter.required), len(nfas), len(dfas)),
+                 limits_format.pack(max_steps, timeout),
+                 pack_table("BBIIIi", self.state_machines),
+                 pack_table("II", self.ranges),
+                 pack_array("I", [prefilter.min_length]),
+                 pack_table("II", literals)]
+        parts.extend(self.text)
+        parts.extend(packed_nfas)
+        for number, dfa in dfas:
+            parts.append(self.dfa(number, dfa))
+        return b"".join(parts)
+
+
+class RecordReader:
+    """
+    Reads the tables of a record, each with a single unpack.
+    """
+    def __init__(self, data, offset, end):
+        self.data = data
+        self.offset = offset
+        self.end = end
+
+    def take(self, length):
+        if self.offset + length > self.end:
+            raise StoreFormatException("truncated record")
+        offset = self.offset
+        self.offset += length
+        return offset
+
+    def row(self, row_format):
+        return row_format.unpack_from(self.data, self.take(row_format.size))
+
+    def array(self, code, count):
+        """
+        :return: count values of the struct type code
+        """
+        if count == 0:
+            return ()
+        offset = self.take(count * struct.calcsize("<" + code))
+        return struct.unpack_from("<" + code * count, self.data, offset)
+
+    def table(self, row_format, count):
+        """
+        :return: the list of count rows, each a tuple of the struct types in row_format
+        """
+        if count == 0:
+            return []
+        values = self.array(row_format, count)
+        width = len(row_format)
+        return [values[i:i + width] for i in range(0, len(values), width)]
+
+    def bytes(self, length):
+        offset = self.take(length)
+        return self.data[offset:offset + length]
+
+    def typed_array(self, typecode, count):
+        """
+        :return: an array of count values, copied at once from the record
+        """
+        values = array(typecode)
+        values.frombytes(self.bytes(values.itemsize * count))
+        if values.itemsize > 1 and sys.byteorder == "big":
+            values.byteswap()
+        return values
+
+
+def check_slice(first, length, size, what):
+    if first + length > size:
+        raise StoreFormatException(what + " out of bounds")
+
+
+def decode_matcher(code, first, second, ranges, text, bytes_mode):
+    if code == matcher_char:
+        return CharMatcher(first if bytes_mode else chr(first))
+    if code == matcher_any:
+        return AnyMatcher()
+    if code == matcher_range:
+        return RangeMatcher(chr(first), chr(second))
+    if code == matcher_exclude_range:
+        return ExcludeRangeMatcher(chr(first), chr(second))
+    if code in (matcher_pool, matcher_exclude_pool):
+        check_slice(first, second, len(text), "pool")
+        chars = decode_text(text[first:first + second], bytes_mode)
+        return PoolMatcher(chars) if code == matcher_pool else ExcludePoolMatcher(chars)
+    if code in (matcher_class, matcher_negated_class):
+        check_slice(first, second, len(ranges), "class")
+        class_ranges = ranges[first:first + second]
+        negate = code == matcher_negated_class
+        if bytes_mode:
+            return ByteClassMatcher(CharClass(class_ranges, negate))
+        return CharClassMatcher(class_ranges, negate)
+    raise StoreFormatException("unknown matcher " + str(code))
+
+
+def check_nfa(ops, args, xs, ys, tables, repeats):
+    """
+    Checks that the instructions of an NFA only refer to instructions and table entries it has.
+    :param tables: the size of the table the argument of each opcode indexes
+    """
+    size = len(ops)
+    if size == 0 or ops[-1] != op_match or ops.count(op_match) != 1 or max(ops) > op_repeat:
+        raise StoreFormatException("bad NFA opcodes")
+    if min(xs) < -1 or max(xs) >= size or min(ys) < -1 or max(ys) >= size:
+        raise StoreFormatException("NFA target out of bounds")
+    if any(not 0 <= arg < tables[op] for op, arg in zip(ops, args) if op in tables):
+        raise StoreFormatException("NFA argument out of bounds")
+    if any(ops[x] >= op_split for op, x in zip(ops, xs) if op == op_repeat):
+        raise StoreFormatException("counted loop without body")
+    if any(min_count < 0 or max_count < -1 or 0 <= max_count < min_count for min_count, max_count in repeats):
+        raise StoreFormatException("bad counted loop bounds")
+
+
+def decode_nfa(reader, ranges, text, bytes_mode, classes):
+    """
+    :param classes: the CharClasses decoded so far, by row, the NFAs of a pattern share them
+    :return: the number in nfa_names and the NFAProgram packed by RecordWriter.nfa()
+    """
+    number, size, class_count, matcher_count, repeat_count = reader.row(nfa_sizes_format)
+    ops = reader.typed_array("B", size)
+    args = reader.typed_array("i", size)
+    xs = reader.typed_array("i", size)
+    ys = reader.typed_array("i", size)
+    class_rows = reader.table("BII", class_count)
+    matcher_rows = reader.table("BII", matcher_count)
+    repeats = reader.table("ii", repeat_count)
+    check_nfa(ops, args, xs, ys, {op_class: class_count, op_test: matcher_count, op_repeat: repeat_count},
+              repeats)
+    nfa_classes = []
+    for row in class_rows:
+        char_class = classes.get(row)
+        if char_class is None:
+            negate, first, length = row
+            check_slice(first, length, len(ranges), "class")
+            char_class = classes[row] = CharClass(ranges[first:first + length], negate == 1)
+        nfa_classes.append(char_class)
+    matchers = [decode_matcher(code, first, second, ranges, text, bytes_mode) for code, first, second in matcher_rows]
+    return nfa_names[number], NFAProgram((), (ops, args, xs, ys, nfa_classes, matchers, repeats))
+
+
+def decode_dfa(reader, backend, bytes_mode):
+    """
+    Fills the cache of a LazyDFA of backend with the states packed by RecordWriter.dfa().
+    """
+    number, state_count, pcs_count, transition_count, start_count = reader.row(dfa_sizes_format)
+    rows = reader.table("II", state_count)
+    pcs = reader.array("i", pcs_count)
+    transitions = reader.table("II", transition_count)
+    start_states = reader.table("BI", start_count)
+    dfa = getattr(backend, dfa_names[number], None) if number < len(dfa_names) else None
+    if not isinstance(dfa, LazyDFA) or state_count + transition_count > dfa.max_cache_entries:
+        # Another engine, or too big for the cache: the DFA builds its states again
+        return
+    if sum(pc_count for pc_count, _ in rows) != pcs_count or \
+            sum(count for _, count in rows) != transition_count:
+        raise StoreFormatException("DFA tables do not add up")
+    # A count goes up to the largest bound of the counted loops
+    pc_bound = len(dfa.nfa) * (dfa.nfa.largest_count() + 1)
+    if any(pc < restart_pc or pc >= pc_bound for pc in pcs) or \
+            any(target >= state_count for _, target in transitions) or \
+            any(i >= state_count for _, i in start_states):
+        raise StoreFormatException("DFA state out of bounds")
+
+    states = []
+    pc = 0
+    for pc_count, _ in rows:
+        state_pcs = pcs[pc:pc + pc_count]
+        states.append(DFAState(state_pcs, dfa.is_match_pcs(state_pcs)))
+        pc += pc_count
+    transition = 0
+    for state, (_, count) in zip(states, rows):
+        for char, target in transitions[transition:transition + count]:
+            state.transitions[char if bytes_mode else chr(char)] = states[target]
+        transition += count
+        dfa.states[state.pcs] = state
+    for at_start, i in start_states:
+        dfa.start_states[at_start == 1] = states[i]
+    dfa.cache_entries = state_count + transition_count
+
+
+def save_patterns(path, patterns):
+    """
+    Writes compiled patterns to a file, with the DFA states they have built so far.
+    The file is replaced at once, readers never see it half written.
+    """
+    keys = []
+    records = []
+    for pattern in patterns:
+        backend = pattern.backend.untraced if isinstance(pattern.backend, TracedBackend) else pattern.backend
+        dfas = [(number, getattr(backend, name, None)) for number, name in enumerate(dfa_names)]
+        # A DFA without states has nothing to save
+        dfas = [(number, dfa) for number, dfa in dfas if isinstance(dfa, LazyDFA) and dfa.states]
+        nfas = [(number, getattr(backend, name, None)) for number, name in enumerate(nfa_names)]
+        nfas = [(number, nfa) for number, nfa in nfas if isinstance(nfa, NFAProgram)]
+        # The engine is built again from its NFAs when it has some
+        state_machines = pattern.program.state_machines if not nfas else ()
+        keys.append(encode_key(pattern.pattern, pattern.engine))
+        records.append(RecordWriter(pattern.bytes_mode).record(state_machines, pattern.prefilter, pattern.limits,
+                                                               nfas, dfas))
+
+    offset = header_format.size + index_format.size * len(keys)
+    index = []
+    for key, record in zip(keys, records):
+        index.append(index_format.pack(offset, len(key), offset + len(key), len(record), zlib.crc32(record)))
+        offset += len(key) + len(record)
+
+    temporary_path = path + ".tmp"
+    with open(temporary_path, "wb") as f:
+        f.write(header_format.pack(MAGIC, FORMAT_VERSION, len(keys)))
+        f.write(b"".join(index))
+        for key, record in zip(keys, records):
+            f.write(key)
+            f.write(record)
+    os.replace(temporary_path, path)
+
+
+class PatternStore:
+    """
+    Patterns saved by save_patterns, read from a memory mapped file. Only the index is read
+    when the store is opened, each pattern is decoded the first time it is asked for.
+    When the file is missing, damaged or has another format version the store is stale:
+    it holds no pattern and get() compiles them.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.data = None
+        self.index = {}
+        self.patterns = {}
+        self.stale = True
+        self.lock = threading.Lock()
+        try:
+            with open(path, "rb") as f:
+                if os.fstat(f.fileno()).st_size < header_format.size:
+                    return
+                self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            magic, version, count = header_format.unpack_from(self.data, 0)
+            if magic != MAGIC or version != FORMAT_VERSION:
+                return
+            for i in range(count):
+                key_offset, key_length, record_offset, record_length, crc = \
+                    index_format.unpack_from(self.data, header_format.size + i * index_format.size)
+                key = decode_key(self.data[key_offset:key_offset + key_length])
+                self.index[key] = (record_offset, record_length, crc)
+            self.stale = False
+        except (OSError, ValueError, struct.error):
+            self.index = {}
+
+    def __len__(self):
+        return len(self.index)
+
+    def __contains__(self, key):
+        """
+        :param key: a (regexp, engine) pair
+        """
+        return store_key(*key) in self.index
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        if self.data is not None:
+            self.data.close()
+            self.data = None
+
+    def get(self, regexp, engine=DEFAULT_ENGINE):
+        """
+        :return: the Pattern for regexp, decoded from the file, or compiled if the file
+                 does not have it
+        """
+        key = store_key(regexp, engine)
+        with self.lock:
+            pattern = self.patterns.get(key)
+            if pattern is None:
+                location = self.index.get(key)
+                pattern = self.decode(key[1], engine, *location) if location is not None else None
+                if pattern is None:
+                    pattern = compile(key[1], engine)
+                self.patterns[key] = pattern
+        return pattern
+
+    def decode(self, regexp, engine, offset, length, crc):
+        """
+        :return: the Pattern in the record, or None if it cannot be decoded
+        """
+        if self.data is None or engine not in engines:
+            return None
+        if zlib.crc32(self.data[offset:offset + length]) != crc:
+            return None
+        bytes_mode = isinstance(regexp, bytes)
+        reader = RecordReader(self.data, offset, offset + length)
+        try:
+            sm_count, range_count, text_length, required_count, nfa_count, dfa_count = reader.row(sizes_format)
+            max_steps, timeout = reader.row(limits_format)
+            rows = reader.table("BBIIIi", sm_count)
+            ranges = reader.table("II", range_count)
+            min_length = reader.array("I", 1)[0]
+            literals = reader.table("II", required_count + 1)
+            text = reader.bytes(text_length)
+
+            state_machines = []
+            # Matchers hold no state, equal rows share one
+            matchers = {}
+            for code, matcher_code, first, second, min_count, max_count in rows:
+                sm_type = state_machine_types[code]
+                if matcher_code == matcher_none:
+                    state_machines.append(sm_type())
+                    continue
+                matcher = matchers.get((matcher_code, first, second))
+                if matcher is None:
+                    matcher = decode_matcher(matcher_code, first, second, ranges, text, bytes_mode)
+                    matchers[(matcher_code, first, second)] = matcher
+                if sm_type == CountedMatchStateMachine:
+                    state_machines.append(sm_type(matcher, min_count, max_count if max_count != -1 else None))
+                else:
+                    state_machines.append(sm_type(matcher))
+            for start, size in literals:
+                check_slice(start, size, text_length, "literal")
+            literals = [decode_text(text[start:start + size], bytes_mode) for start, size in literals]
+            prefilter = Prefilter(literals[0], literals[1:], min_length)
+            classes = {}
+            nfas = dict(decode_nfa(reader, ranges, text, bytes_mode, classes) for _ in range(nfa_count))
+            # Should an NFA be missing, the regexp is parsed again to compile it
+            program = RegexpProgram(regexp) if nfas else Program(state_machines)
+            backend = engines[engine](program, prefilter, **nfas)
+            pattern = Pattern(regexp, engine, None, prefilter, max_steps if max_steps >= 0 else None,
+                              timeout if timeout >= 0 else None, backend)
+            for _ in range(dfa_count):
+                decode_dfa(reader, pattern.backend, bytes_mode)
+            return pattern
+        except (StoreFormatException, KeyError, IndexError, ValueError, TypeError, OverflowError, MemoryError,
+                struct.error):
+            return None
+
+
+def load_patterns(path):
+    """
+    :return: a PatternStore reading the file written by save_patterns
+    """
+    return PatternStore(path)
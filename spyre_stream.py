@@ -0,0 +1,231 @@
+#!/usr/bin/python3
+
+"""
+SPYRE - Simple PYthon 3 Regular Expression Engine
+Copyright (C) 2018 Francesco Rigoni - francesco.rigoni@gmail.com
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License v3 as published by
+the Free Software Foundation.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+from spyre_nfa import *
+import asyncio
+
+
+# Characters matched between two returns to the event loop
+ASYNC_SLICE_SIZE = 64 * 1024
+
+
+class StreamMatch:
+    """
+    A match found in a stream. Positions are offsets from the beginning of the stream,
+    the matched text is kept since the stream itself is not.
+    """
+    __slots__ = ("text", "_start", "_end")
+
+    def __init__(self, text, start, end):
+        self.text = text
+        self._start = start
+        self._end = end
+
+    def __repr__(self):
+        return "<StreamMatch span=" + str(self.span()) + " match=" + repr(self.text) + ">"
+
+    def start(self):
+        return self._start
+
+    def end(self):
+        return self._end
+
+    def span(self):
+        return self._start, self._end
+
+    def group(self):
+        return self.text
+
+
+class StreamMatcher:
+    """
+    Push style matcher: feed it chunks as they arrive, it returns the matches as soon as
+    they are decided, the same matches finditer would find in the whole stream.
+    Runs the NFA of the pattern Pike VM style, one character at a time, and only keeps the
+    part of the stream a pending match may still need.
+    """
+    def __init__(self, pattern):
+        # The NFA of the engine when it has one, the state machines are parsed again otherwise
+        nfa = getattr(pattern.backend, "nfa", None)
+        self.nfa = nfa if nfa is not None else compile_nfa(pattern.program.optimized)
+        self.prefix = pattern.prefilter.prefix
+        self.buffer = None
+        # Stream offset of buffer[0]
+        self.offset = 0
+        # Stream offset of the next character to process
+        self.position = 0
+        # New matches cannot start before this offset
+        self.search_pos = 0
+        # Threads waiting for the character at position, in priority order
+        self.pending = []
+        # Best match found so far, not reported until higher priority threads die
+        self.matched = None
+        self.closed = False
+
+    def feed(self, chunk):
+        """
+        :param chunk: the next part of the stream
+        :return: the list of matches decided so far
+        """
+        if self.closed:
+            raise ValueError("feed() called on a closed StreamMatcher")
+        if isinstance(chunk, memoryview):
+            chunk = chunk.tobytes()
+        if self.buffer is None:
+            self.buffer = chunk[:0]
+        self.buffer += chunk
+        matches = []
+        self.advance(False, matches)
+        self.trim()
+        return matches
+
+    def close(self):
+        """
+        Signals the end of the stream.
+        :return: the list of the remaining matches
+        """
+        if self.closed:
+            return []
+        matches = []
+        if self.buffer is None:
+            self.buffer = self.prefix[:0]
+        self.advance(True, matches)
+        self.closed = True
+        self.buffer = self.buffer[:0]
+        self.pending = []
+        return matches
+
+    def advance(self, end_of_stream, matches):
+        buffer_end = self.offset + len(self.buffer)
+        while True:
+            while self.position < buffer_end:
+                if not self.pending and self.matched is None and self.prefix and self.position >= self.search_pos:
+                    # Nothing in progress, skip to where the prefix appears. A prefix cut by the end
+                    # of the buffer has to be kept for the next chunk.
+                    i = self.buffer.find(self.prefix, self.position - self.offset)
+                    if i == -1:
+                        self.position = max(self.position, buffer_end - len(self.prefix) + 1)
+                        return
+                    self.position = self.offset + i
+                self.step(self.buffer[self.position - self.offset])
+                if self.matched is not None and not self.pending:
+                    self.report(matches)
+
+            if not end_of_stream:
+                return
+            self.step(None)
+            if self.matched is None:
+                return
+            self.report(matches)
+
+    def step(self, char):
+        """
+        Runs the threads on the character at position, None standing for the end of the stream.
+        """
+        nfa = self.nfa
+        at_start = self.position == 0
+        at_end = char is None
+        threads = []
+        seen = set()
+        for pc, start in self.pending:
+            add_thread(nfa, threads, seen, pc, start, at_start, at_end)
+        if self.matched is None and self.position >= self.search_pos:
+            add_thread(nfa, threads, seen, 0, self.position, at_start, at_end)
+
+        pending = []
+        for pc, start in threads:
+            op = nfa.ops[nfa.instruction(pc)]
+            if op < op_split:
+                if char is not None and nfa.accepts(pc, char):
+                    pending.append((nfa.successor(pc), start))
+            elif op == op_match:
+                self.matched = (start, self.position)
+                break
+        self.pending = pending
+        if char is not None:
+            self.position += 1
+
+    def report(self, matches):
+        start, end = self.matched
+        matches.append(StreamMatch(self.buffer[start - self.offset:end - self.offset], start, end))
+        self.matched = None
+        self.pending = []
+        # Go on from the end of the match, which may mean scanning again characters
+        # already seen by the threads that were still alive
+        self.position = end
+        self.search_pos = end if end > start else end + 1
+
+    def trim(self):
+        needed = self.position
+        for pc, start in self.pending:
+            needed = min(needed, start)
+        if self.matched is not None:
+            needed = min(needed, self.matched[0])
+        if needed > self.offset:
+            self.buffer = self.buffer[needed - self.offset:]
+            self.offset = needed
+
+
+def stream_finditer(pattern, chunks):
+    """
+    Generates the matches of pattern over an iterable of chunks.
+    """
+    matcher = StreamMatcher(pattern)
+    for chunk in chunks:
+        for match in matcher.feed(chunk):
+            yield match
+    for match in matcher.close():
+        yield match
+
+
+async def async_chunks(source, read_size):
+    """
+    Generates the chunks of an asyncio.StreamReader, or of an async iterable of chunks.
+    """
+    if hasattr(source, "read"):
+        while True:
+            chunk = await source.read(read_size)
+            if not chunk:
+                return
+            yield chunk
+    else:
+        async for chunk in source:
+            yield chunk
+
+
+async def stream_afinditer(pattern, source, slice_size=ASYNC_SLICE_SIZE):
+    """
+    Generates the matches of pattern over a source of chunks, as they arrive.
+    A chunk is only read once the previous one is matched, a StreamReader then stops
+    reading from its transport when its buffer is full. Long chunks are matched in slices
+    of slice_size, returning to the event loop after each one.
+    :param source: an asyncio.StreamReader, or an async iterable of chunks
+    """
+    matcher = StreamMatcher(pattern)
+    chunks = async_chunks(source, slice_size)
+    try:
+        async for chunk in chunks:
+            for i in range(0, len(chunk), slice_size):
+                for match in matcher.feed(chunk[i:i + slice_size] if len(chunk) > slice_size else chunk):
+                    yield match
+                await asyncio.sleep(0)
+    finally:
+        await chunks.aclose()
+    for match in matcher.close():
+        yield match
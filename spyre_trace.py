@@ -0,0 +1,179 @@
+#!/usr/bin/python3
+
+"""
+SPYRE - Simple PYthon 3 Regular Expression Engine
+Copyright (C) 2018 Francesco Rigoni - francesco.rigoni@gmail.com
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License v3 as published by
+the Free Software Foundation.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+from spyre_internals import *
+import threading
+
+
+class Tracer:
+    """
+    Receives the events of the patterns it is installed on, see Pattern.with_tracer().
+    The methods do nothing, subclasses override the ones they need.
+    """
+    def begin(self, pattern, operation, string, pos, endpos):
+        """
+        A match or a search starts.
+        :param operation: "match" or "search"
+        """
+        pass
+
+    def examine(self, pattern, index, char, matched):
+        """
+        The state machine at index examined a character.
+        :param matched: True if the state machine consumed it, moving on to another state
+        """
+        pass
+
+    def scan(self, pattern, chars, transitions):
+        """
+        The DFAs of a pattern ran, before the end of a match or a search. A DFA steps over
+        characters with its cache of transitions, the state machines only examine the ones
+        it computes a transition for: examine() then reports cache misses, not characters.
+        :param chars: the characters the DFAs stepped over, forward and backwards
+        :param transitions: the transitions they computed
+        """
+        pass
+
+    def end(self, pattern, operation, span, seconds, skipped, resets):
+        """
+        A match or a search ended.
+        :param span: the span of the match, or None
+        :param seconds: the time spent
+        :param skipped: the start positions given up on before the match, or all of them
+        :param resets: the times the DFA threw its cache of states away
+        """
+        pass
+
+
+class TracedMatcher:
+    """
+    Wraps the matcher of a state machine, reporting every character it examines.
+    """
+    __slots__ = ("matcher", "tracer", "pattern", "index")
+
+    def __init__(self, matcher, tracer, pattern, index):
+        self.matcher = matcher
+        self.tracer = tracer
+        self.pattern = pattern
+        self.index = index
+
+    def match(self, char):
+        matched = self.matcher.match(char)
+        self.tracer.examine(self.pattern, self.index, char, matched)
+        return matched
+
+
+def traced_state_machines(state_machines, tracer, pattern):
+    """
+    :return: copies of the state machines whose matchers report to tracer
+    """
+    traced = []
+    for index, sm in enumerate(state_machines):
+        if sm.matcher is None:
+            # Anchors examine no characters
+            traced.append(sm)
+        else:
+            traced.append(sm.with_matcher(TracedMatcher(sm.matcher, tracer, pattern, index)))
+    return traced
+
+
+class PatternStats:
+    """
+    What a CountingTracer saw of one pattern. examined and consumed have one entry
+    for each state machine of the pattern. With a DFA they count the characters of the
+    transitions computed, dfa_chars the characters scanned.
+    """
+    __slots__ = ("calls", "matches", "examined", "consumed", "skipped", "resets", "seconds",
+                 "dfa_chars", "dfa_transitions")
+
+    def __init__(self, size):
+        self.calls = 0
+        self.matches = 0
+        self.examined = [0] * size
+        self.consumed = [0] * size
+        self.skipped = 0
+        self.resets = 0
+        self.seconds = 0.0
+        self.dfa_chars = 0
+        self.dfa_transitions = 0
+
+    def chars(self):
+        """
+        :return: the number of characters examined by all the state machines
+        """
+        return sum(self.examined)
+
+
+class CountingTracer(Tracer):
+    """
+    Counts, for each pattern, the calls, the characters examined and consumed by each state
+    machine, the skipped start positions, the characters scanned, transitions computed and
+    cache resets of the DFAs and the time spent.
+    """
+    def __init__(self):
+        self.stats = {}
+        self.lock = threading.Lock()
+
+    def stats_of(self, pattern):
+        stats = self.stats.get(pattern)
+        if stats is None:
+            with self.lock:
+                stats = self.stats.setdefault(pattern, PatternStats(len(pattern.program)))
+        return stats
+
+    def examine(self, pattern, index, char, matched):
+        stats = self.stats_of(pattern)
+        with self.lock:
+            stats.examined[index] += 1
+            if matched:
+                stats.consumed[index] += 1
+
+    def scan(self, pattern, chars, transitions):
+        stats = self.stats_of(pattern)
+        with self.lock:
+            stats.dfa_chars += chars
+            stats.dfa_transitions += transitions
+
+    def end(self, pattern, operation, span, seconds, skipped, resets):
+        stats = self.stats_of(pattern)
+        with self.lock:
+            stats.calls += 1
+            if span is not None:
+                stats.matches += 1
+            stats.skipped += skipped
+            stats.resets += resets
+            stats.seconds += seconds
+
+    def report(self):
+        """
+        :return: a table of the patterns, the ones taking the most time first
+        """
+        lines = ["%10s %8s %8s %10s %10s %6s  %s" % ("seconds", "calls", "matches", "examined", "skipped", "resets", "pattern")]
+        by_time = sorted(self.stats.items(), key=lambda item: item[1].seconds, reverse=True)
+        for pattern, stats in by_time:
+            lines.append("%10.6f %8d %8d %10d %10d %6d  %s" % (stats.seconds, stats.calls, stats.matches, stats.chars(),
+                                                               stats.skipped, stats.resets, repr(pattern.pattern)))
+            if stats.dfa_chars > 0:
+                lines.append("%10s DFA: %d characters scanned, %d transitions computed" % (
+                    "", stats.dfa_chars, stats.dfa_transitions))
+            for index, sm in enumerate(pattern.program.state_machines):
+                if stats.examined[index] > 0:
+                    lines.append("%10s state machine %d, %s: %d examined, %d consumed" % (
+                        "", index, type(sm).__name__, stats.examined[index], stats.consumed[index]))
+        return "\n".join(lines)
@@ -0,0 +1,284 @@
+#!/usr/bin/python3
+
+"""
+SPYRE - Simple PYthon 3 Regular Expression Engine
+Copyright (C) 2018 Francesco Rigoni - francesco.rigoni@gmail.com
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License v3 as published by
+the Free Software Foundation.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+from spyre_engine import *
+
+try:
+    import numpy
+except ImportError:
+    # NumPy is optional, only this module needs it
+    numpy = None
+
+
+def code_matrix(column, bytes_mode):
+    """
+    Converts a column of strings to a 2-D array of code points, one row for each string,
+    padded with zeros. NumPy strips trailing NUL characters from its strings.
+    :param column: NumPy array or sequence of str, or of bytes for bytes patterns
+    :return: the code points and the length of each string
+    """
+    if numpy is None:
+        raise ImportError("matching columns needs NumPy")
+    array = numpy.asarray(column)
+    if array.size == 0:
+        return numpy.zeros((0, 0), dtype=numpy.uint32), numpy.zeros(0, dtype=numpy.int64)
+    if array.dtype.kind == "O":
+        array = array.astype("S" if bytes_mode else "U")
+    if array.dtype.kind not in ("U", "S") or (array.dtype.kind == "S") != bytes_mode:
+        if bytes_mode:
+            raise TypeError("cannot use a bytes pattern on a column of " + str(array.dtype))
+        raise TypeError("cannot use a string pattern on a column of " + str(array.dtype))
+    array = numpy.ascontiguousarray(array.reshape(-1))
+    if array.dtype.kind == "U":
+        codes = array.view(numpy.uint32).reshape(len(array), array.dtype.itemsize // 4)
+    else:
+        codes = array.view(numpy.uint8).reshape(len(array), array.dtype.itemsize)
+    return codes, numpy.char.str_len(array).astype(numpy.int64)
+
+
+def matcher_mask(matcher, codes, bytes_mode):
+    """
+    :param codes: 1-D array of code points
+    :return: boolean array, True where matcher matches the code point
+    """
+    if type(matcher) == AnyMatcher:
+        return numpy.ones(len(codes), dtype=bool)
+    if type(matcher) == CharMatcher:
+        return codes == (matcher.char if bytes_mode else ord(matcher.char))
+    char_class = getattr(matcher, "char_class", None)
+    if char_class is not None:
+        if all(start == end for start, end in char_class.ranges):
+            mask = numpy.isin(codes, [start for start, end in char_class.ranges])
+        else:
+            mask = numpy.zeros(len(codes), dtype=bool)
+            for start, end in char_class.ranges:
+                mask |= (codes >= start) & (codes <= end)
+        return ~mask if char_class.negate else mask
+    return numpy.array([matcher.match(int(code) if bytes_mode else chr(code)) for code in codes], dtype=bool)
+
+
+class VectorDFA:
+    """
+    The DFA of a LazyDFA with its transitions in a NumPy table, indexed by state and by
+    character class, so that a step moves every row of a column at once.
+    Characters the matchers of the NFA cannot tell apart share a class.
+    """
+    def __init__(self, nfa, anchored, longest=False):
+        self.dfa = LazyDFA(nfa, anchored, longest=longest)
+        self.ids = {}
+        self.pcs = []
+        self.is_match = numpy.zeros(0, dtype=bool)
+        # Matches at the end of the string, for strings that are not empty and for empty ones
+        self.end_matches = [[], []]
+        self.table = numpy.full((0, 0), -1, dtype=numpy.int64)
+
+    def state_id(self, pcs):
+        state = self.ids.get(pcs)
+        if state is None:
+            state = len(self.pcs)
+            self.ids[pcs] = state
+            self.pcs.append(pcs)
+            self.is_match = numpy.append(self.is_match, self.dfa.is_match_pcs(pcs))
+            grown = numpy.full((len(self.pcs), self.table.shape[1]), -1, dtype=numpy.int64)
+            grown[:self.table.shape[0]] = self.table
+            self.table = grown
+        return state
+
+    def start_state(self, at_start):
+        return self.state_id(self.dfa.start_pcs(at_start))
+
+    def fill(self, states, classes, representatives):
+        """
+        Computes the missing transitions among the (state, class) pairs of the rows.
+        """
+        if self.table.shape[1] < len(representatives):
+            grown = numpy.full((self.table.shape[0], len(representatives)), -1, dtype=numpy.int64)
+            grown[:, :self.table.shape[1]] = self.table
+            self.table = grown
+        missing = self.table[states, classes] == -1
+        if not missing.any():
+            return
+        width = self.table.shape[1]
+        for pair in numpy.unique(states[missing] * width + classes[missing]):
+            state, char_class = divmod(int(pair), width)
+            self.table[state, char_class] = self.state_id(self.dfa.step_pcs(self.pcs[state], representatives[char_class]))
+
+    def end_match_table(self, at_start):
+        """
+        :return: boolean array, True for the states leading to a match at the end of the string
+        """
+        end_matches = self.end_matches[at_start]
+        for state in range(len(end_matches), len(self.pcs)):
+            pcs = self.pcs[state]
+            end_matches.append(len(pcs) > 0 and self.dfa.matches_at_end(pcs, at_start))
+        return numpy.array(end_matches, dtype=bool)
+
+    def run(self, classes, representatives, lengths, rows, start):
+        """
+        Runs the DFA over the rows, from column start.
+        :return: the end of the leftmost-first match of each row, -1 where there is none
+        """
+        state = numpy.full(len(rows), self.start_state(start == 0), dtype=numpy.int64)
+        ends = numpy.where(self.is_match[state], start, -1)
+        dead = self.state_id(())
+        row_lengths = lengths[rows]
+        for i in range(start, classes.shape[1]):
+            alive = numpy.nonzero((i < row_lengths) & (state != dead))[0]
+            if len(alive) == 0:
+                break
+            char_classes = classes[rows[alive], i]
+            self.fill(state[alive], char_classes, representatives)
+            state[alive] = self.table[state[alive], char_classes]
+            ends[alive[self.is_match[state[alive]]]] = i + 1
+
+        # The dead state never matches at the end
+        at_end = numpy.where(row_lengths == 0, self.end_match_table(True)[state], self.end_match_table(False)[state])
+        return numpy.where(at_end, row_lengths, ends)
+
+    def run_reverse(self, classes, representatives, lengths, rows, ends):
+        """
+        Runs the DFA of a reversed NFA backwards over the rows, each from its own end.
+        :return: the start of the longest match ending at the end of each row, -1 where there is none
+        """
+        # "$" is at the start of the reversed NFA, it only matches where the string ends
+        at_end = ends == lengths[rows]
+        state = numpy.where(at_end, self.start_state(True), self.start_state(False))
+        starts = numpy.where(self.is_match[state], ends, -1)
+        dead = self.state_id(())
+        for i in range(int(ends.max(initial=0)) - 1, -1, -1):
+            living = state != dead
+            alive = numpy.nonzero((i < ends) & living)[0]
+            if len(alive) == 0:
+                # Unless rows ending further left have yet to start
+                if not (living & (ends <= i)).any():
+                    break
+                continue
+            char_classes = classes[rows[alive], i]
+            self.fill(state[alive], char_classes, representatives)
+            state[alive] = self.table[state[alive], char_classes]
+            starts[alive[self.is_match[state[alive]]]] = i
+
+        # "^" is at the end of the reversed NFA, the rows still alive have reached the start
+        at_start = numpy.where(at_end & (ends == 0), self.end_match_table(True)[state],
+                               self.end_match_table(False)[state])
+        return numpy.where(at_start, 0, starts)
+
+
+class VectorPattern:
+    """
+    Matches a pattern against a whole column of strings: each step of its DFA is a NumPy
+    operation over every row, character classes are evaluated as range and membership masks
+    once for each distinct character of the column.
+    Needs NumPy, see numpy_available().
+    """
+    def __init__(self, regexp, engine=DEFAULT_ENGINE):
+        """
+        :param regexp: the regexp, or a Pattern
+        """
+        if numpy is None:
+            raise ImportError("VectorPattern needs NumPy")
+        self.pattern = regexp if isinstance(regexp, Pattern) else compile(regexp, engine)
+        self.bytes_mode = self.pattern.bytes_mode
+        state_machines = self.pattern.program.state_machines
+        nfa = compile_nfa(state_machines)
+        self.matchers = []
+        for sm in state_machines:
+            if sm.matcher is not None and not any(sm.matcher is seen for seen in self.matchers):
+                self.matchers.append(sm.matcher)
+        self.forward = VectorDFA(nfa, False)
+        self.anchored = VectorDFA(nfa, True)
+        self.reverse = VectorDFA(compile_reverse_nfa(state_machines), True, longest=True)
+
+    def classify(self, codes):
+        """
+        :return: the character class of each code point, and a character of each class
+        """
+        if codes.size == 0:
+            return numpy.zeros(codes.shape, dtype=numpy.int64), []
+        unique, inverse = numpy.unique(codes.ravel(), return_inverse=True)
+        if len(self.matchers) > 0:
+            signatures = numpy.stack([matcher_mask(matcher, unique, self.bytes_mode) for matcher in self.matchers],
+                                     axis=1)
+        else:
+            signatures = numpy.zeros((len(unique), 1), dtype=bool)
+        _, first, class_of_unique = numpy.unique(signatures, axis=0, return_index=True, return_inverse=True)
+        classes = class_of_unique.reshape(-1)[inverse.reshape(-1)].reshape(codes.shape)
+        representatives = [int(unique[i]) if self.bytes_mode else chr(unique[i]) for i in first]
+        return classes.astype(numpy.int64), representatives
+
+    def prepare(self, column):
+        codes, lengths = code_matrix(column, self.bytes_mode)
+        classes, representatives = self.classify(codes)
+        return classes, representatives, lengths
+
+    def match_spans(self, column):
+        """
+        Matches every string from its start, like Pattern.match().
+        :return: arrays of the starts and ends of the matches, -1 for the rows without one
+        """
+        classes, representatives, lengths = self.prepare(column)
+        rows = numpy.arange(len(lengths))
+        ends = self.anchored.run(classes, representatives, lengths, rows, 0)
+        starts = numpy.where(ends >= 0, 0, -1)
+        return starts, ends
+
+    def match_mask(self, column):
+        return self.match_spans(column)[1] >= 0
+
+    def search_mask(self, column):
+        """
+        :return: boolean array, True for the strings containing a match
+        """
+        classes, representatives, lengths = self.prepare(column)
+        rows = numpy.arange(len(lengths))
+        return self.forward.run(classes, representatives, lengths, rows, 0) >= 0
+
+    def search_spans(self, column):
+        """
+        Finds the leftmost match of every string, like Pattern.search().
+        :return: arrays of the starts and ends of the matches, -1 for the rows without one
+        """
+        classes, representatives, lengths = self.prepare(column)
+        rows = numpy.arange(len(lengths))
+        # The forward DFA finds where the leftmost match of each row ends, the reverse one
+        # reads the rows backwards from there to where it starts
+        ends = self.forward.run(classes, representatives, lengths, rows, 0)
+        starts = numpy.full(len(rows), -1, dtype=numpy.int64)
+        found = rows[ends >= 0]
+        if len(found) > 0:
+            starts[found] = self.reverse.run_reverse(classes, representatives, lengths, found, ends[found])
+        return starts, ends
+
+
+def numpy_available():
+    return numpy is not None
+
+
+def match_column(regexp, column, engine=DEFAULT_ENGINE):
+    """
+    :return: boolean array, True for the strings of column matching regexp from their start
+    """
+    return VectorPattern(regexp, engine).match_mask(column)
+
+
+def search_column(regexp, column, engine=DEFAULT_ENGINE):
+    """
+    :return: boolean array, True for the strings of column containing a match of regexp
+    """
+    return VectorPattern(regexp, engine).search_mask(column)
@@ -0,0 +1,49 @@
+#!/usr/bin/python3
+
+"""
+SPYRE - Simple PYthon 3 Regular Expression Engine
+Copyright (C) 2018 Francesco Rigoni - francesco.rigoni@gmail.com
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License v3 as published by
+the Free Software Foundation.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+from spyre_bench import *
+
+
+def test_bench_reads_the_regexps_of_the_tests():
+    regexps = regexps_of_tests()
+    assert "abcd[0-9]+[a-z]*" in regexps
+    assert "^abcd.*" in regexps
+    assert to_python_regexp("abcd0$") == r"abcd0\Z"
+    assert to_python_regexp("abcd0\\$[$]") == "abcd0\\$[$]"
+
+
+def test_bench_results_and_regressions():
+    report = run_benchmarks(("nfa", "dfa"), sizes=(100, 400), repeat=1, names=["late_match", "many_patterns"])
+    report = json.loads(json.dumps(report))
+    assert sorted(report["results"]) == ["late_match", "many_patterns"]
+    for by_engine in report["results"].values():
+        for result in by_engine.values():
+            assert [run["size"] for run in result["runs"]] == [100, 400]
+            for run in result["runs"]:
+                assert run["agrees_with_re"]
+                assert run["peak_bytes"] > 0
+                assert run["re"]["seconds"] > 0
+    assert "late_match" in format_results(report)
+
+    assert compare_results(report, report) == []
+    faster = json.loads(json.dumps(report))
+    for run in faster["results"]["late_match"]["dfa"]["runs"]:
+        run["seconds"] /= 2
+    assert [(name, engine) for name, engine, size, ratio in compare_results(report, faster)] == \
+        [("late_match", "dfa"), ("late_match", "dfa")]
@@ -0,0 +1,561 @@
+#!/usr/bin/python3
+
+"""
+SPYRE - Simple PYthon 3 Regular Expression Engine
+Copyright (C) 2018 Francesco Rigoni - francesco.rigoni@gmail.com
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License v3 as published by
+the Free Software Foundation.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+from spyre_engine import *
+import asyncio
+import random
+import re
+import threading
+
+
+def random_regexp(rnd):
+    atoms = ['a', 'b', '.', '[ab]', '[^a]', '[a-b]']
+    regexp = ""
+    for _ in range(rnd.randint(1, 4)):
+        regexp += rnd.choice(atoms) + rnd.choice(['', '', '*', '+', '?'])
+    if rnd.random() < 0.2:
+        regexp = '^' + regexp
+    if rnd.random() < 0.2:
+        regexp = regexp + '$'
+    return regexp
+
+
+def python_span(regexp, string, anchored):
+    # SPYRE's "$" matches only at the very end and "." matches newlines too
+    python_pattern = re.compile(regexp.replace('$', r'\Z'), re.DOTALL)
+    match = python_pattern.match(string) if anchored else python_pattern.search(string)
+    return match.span() if match is not None else None
+
+
+def spyre_span(regexp, string, anchored, engine):
+    pattern = Pattern(regexp, engine)
+    match = pattern.match(string) if anchored else pattern.search(string)
+    return match.span() if match is not None else None
+
+
+def check_engine_against_python(engine):
+    # Regexps whose start matches nothing before the end of the string
+    for regexp in ("$", "x{0}$", "[^a]{0,0}$", "b$"):
+        for string in ("", "xy", "ab\nb"):
+            for anchored in (False, True):
+                assert spyre_span(regexp, string, anchored, engine) == python_span(regexp, string, anchored), \
+                    (regexp, string, anchored)
+        assert [match.span() for match in Pattern(regexp, engine).finditer("xb")] == \
+            [match.span() for match in re.finditer(regexp.replace('$', r'\Z'), "xb")], regexp
+    rnd = random.Random(1)
+    for _ in range(500):
+        regexp = random_regexp(rnd)
+        string = "".join(rnd.choice("abc") for _ in range(rnd.randint(0, 8)))
+        for anchored in (False, True):
+            assert spyre_span(regexp, string, anchored, engine) == python_span(regexp, string, anchored), \
+                (regexp, string, anchored)
+
+
+def test_nfa_engine_against_python():
+    check_engine_against_python("nfa")
+
+
+def test_nfa_engine_backtracking_patterns():
+    assert match_regexp("a*ab", "aaab", engine="nfa") == "aaab"
+    assert match_regexp("[a-z]*z", "xyzzy", engine="nfa") == "xyzz"
+    assert match_regexp("ab", "aab", engine="nfa") == "ab"
+    assert match_regexp("a*ab", "aaab", engine="statemachine") is None
+
+
+def test_nfa_engine_is_linear():
+    # Would take ages with a backtracking engine
+    string = "a" * 5000
+    assert match_regexp("a?" * 20 + "a" * 20 + "b", string, engine="nfa") is None
+
+
+def test_nfa_program_is_flat():
+    nfa = compile_nfa(parse_regexp("^a[b-d]+.x*$"))
+    assert [op_names[op] for op in nfa.ops] == \
+        ["ASSERT_BOL", "CHAR", "CLASS", "SPLIT", "ANY", "SPLIT", "CHAR", "JMP", "ASSERT_EOL", "MATCH"]
+    assert list(nfa.args[1:3]) == [ord("a"), 0] and nfa.classes[0].ranges == ((ord("b"), ord("d")),)
+    assert list(nfa.xs[3:6]) == [2, 5, 6] and nfa.ys[5] == 8
+    assert nfa.closure(5, False, False) == (6,)
+    assert nfa.closure(5, False, True) == (6, 9)
+    bytes_nfa = compile_nfa(parse_regexp(b"\xff[\x80-\x90]"))
+    assert [op_names[op] for op in bytes_nfa.ops] == ["CHAR", "CLASS", "MATCH"] and bytes_nfa.args[0] == 0xff
+    assert bytes_nfa.accepts(1, 0x85) and not bytes_nfa.accepts(1, 0x91)
+
+
+def test_counted_repetition_against_python():
+    rnd = random.Random(11)
+    atoms = ['a', 'b', '.', '[ab]', '[^a]']
+    counts = ['{2}', '{1,3}', '{2,}', '{,2}', '{0,1}', '{0}', '{0,0}', '*', '']
+    for _ in range(300):
+        regexp = "".join(rnd.choice(atoms) + rnd.choice(counts) for _ in range(rnd.randint(1, 3)))
+        if rnd.random() < 0.2:
+            regexp = regexp + '$'
+        string = "".join(rnd.choice("abc") for _ in range(rnd.randint(0, 10)))
+        for engine in ("nfa", "dfa"):
+            for anchored in (False, True):
+                assert spyre_span(regexp, string, anchored, engine) == python_span(regexp, string, anchored), \
+                    (regexp, string, anchored, engine)
+
+
+def test_zero_repetition_next_to_anchors():
+    for regexp in ("a{0}$", "b{0,0}$", "^a{0}b", "x{0}", "a{0}b{1}$"):
+        python_pattern = re.compile(regexp.replace('$', r'\Z'))
+        for string in ("", "b", "bb", "ab", "cb"):
+            expected = [match.span() for match in python_pattern.finditer(string)]
+            for engine in engines:
+                assert [match.span() for match in Pattern(regexp, engine).finditer(string)] == expected, \
+                    (regexp, string, engine)
+
+
+def test_counted_repetition_is_not_unrolled():
+    for bound in (2, 10, 10000):
+        nfa = compile_nfa(parse_regexp("a{2,%d}" % bound))
+        assert [op_names[op] for op in nfa.ops] == ["REPEAT", "CHAR", "MATCH"]
+    string = "x" + "a" * 3000 + "b"
+    for engine in ("nfa", "dfa"):
+        assert Pattern("a{1000,5000}b", engine).search(string).span() == (1, 3002)
+        assert Pattern("a{3001}", engine).search(string) is None
+        assert Pattern("xa{,10}", engine).match(string).span() == (0, 11)
+        window = "ab " * 2000 + "x"
+        assert Pattern(".{0,4096}x", engine).search(window).span() == (len(window) - 4097, len(window))
+
+
+def test_optimizer_rewrites():
+    def kinds(regexp):
+        return [line.split()[1:] for line in dump_state_machines(optimize(parse_regexp(regexp))).splitlines()]
+    assert kinds("abc[d]x*") == [["LITERAL", "'abcd'"], ["STAR", "'x'"]]
+    assert kinds("a[0-9][0-9]*b?.*$") == [["ONE", "'a'"], ["PLUS", "[0-9]"], ["STAR", "ANY"]]
+    assert kinds("x+x*y*y*") == [["PLUS", "'x'"], ["STAR", "'y'"]]
+    assert kinds("^.*$") == [["ASSERT_BOL"], ["STAR", "ANY"]]
+    assert kinds("a.*$b") == [["ONE", "'a'"], ["STAR", "ANY"], ["ASSERT_EOL"], ["ONE", "'b'"]]
+    assert literal_of(optimize(parse_regexp(".*error.*"), keep_span=False)) == tuple("error")
+    # The statemachine engine keeps its loops
+    assert len(Pattern("aa*.*", "statemachine").backend.program) == 3
+
+
+def test_optimizer_keeps_matches():
+    rnd = random.Random(13)
+    atoms = ['a', 'b', 'ab', '.', '[a]', '[ab]', '[^a]']
+    modifiers = ['', '', '*', '+', '?', '{0,2}']
+    for _ in range(300):
+        regexp = "".join(rnd.choice(atoms) + rnd.choice(modifiers) for _ in range(rnd.randint(1, 5)))
+        if rnd.random() < 0.3:
+            regexp = regexp + '$'
+        string = "".join(rnd.choice("abc") for _ in range(rnd.randint(0, 10)))
+        for anchored in (False, True):
+            expected = python_span(regexp, string, anchored)
+            for engine in ("nfa", "dfa", "codegen"):
+                assert spyre_span(regexp, string, anchored, engine) == expected, (regexp, string, engine)
+            # The statemachine engine is only compared with itself, unoptimized
+            unoptimized = run_program(Program(parse_regexp(regexp)), string, anchored, 0, len(string))
+            assert spyre_span(regexp, string, anchored, "statemachine") == unoptimized, (regexp, string)
+
+
+def test_debug_dump():
+    assert Pattern("ab[c]c*", "nfa").debug().splitlines() == [
+        "Pattern('ab[c]c*', engine='nfa')", "state machines:", "   0  LITERAL    'ab'", "   1  PLUS       'c'",
+        "nfa:", "   0  CHAR       'a' -> 1", "   1  CHAR       'b' -> 2", "   2  CHAR       'c' -> 3",
+        "   3  SPLIT      -> 2, 4", "   4  MATCH"]
+    assert "startswith('ab', " in Pattern("ab[0-9]", "codegen").debug()
+    assert Pattern(b"ab[^\x00-\x7f]", "statemachine").debug().splitlines()[1:] == [
+        "statemachine:", "   0  LITERAL    b'ab'", "   1  ONE        [^\\x00-\\x7f]"]
+
+
+def test_dfa_engine_against_python():
+    check_engine_against_python("dfa")
+
+
+def test_dfa_engine_backtracking_patterns():
+    assert match_regexp("a*ab", "aaab", engine="dfa") == "aaab"
+    assert match_regexp("[a-z]*z", "xyzzy", engine="dfa") == "xyzz"
+    assert match_regexp("ab", "aab", engine="dfa") == "ab"
+
+
+def test_dfa_search_reads_back_to_the_start():
+    pattern = Pattern("a*b", "dfa")
+    assert pattern.search("a" * 20000 + " b").span() == (20001, 20002)
+    # The start is found by the reversed NFA, no anchored scan is tried from each position
+    assert len(pattern.backend.anchored.states) == 0
+    assert [op_names[op] for op in pattern.backend.reverse.nfa.ops] == ["CHAR", "SPLIT", "CHAR", "JMP", "MATCH"]
+    assert Pattern("^ab+", "dfa").search("abbc").span() == (0, 3)
+    assert Pattern("^ab+", "dfa").search("xabbc", 1) is None
+    assert Pattern("b+c$", "dfa").search("abbc", 0, 3) is None
+    assert Pattern("x*ab{2,}", "dfa").search("xxabbbabb", 4).span() == (6, 9)
+
+
+def test_dfa_cache_is_bounded():
+    backend = DFABackend(Program(parse_regexp("[a-z]*[0-9]+x")), max_cache_entries=8)
+    string = "abcdefghijklmnopqrstuvwxyz0123456789x" * 20
+    assert backend.search(string, 0, len(string)) == (0, 37)
+    assert backend.forward.cache_entries <= 8
+    assert backend.forward.cache_resets > 0
+
+
+def test_dfa_falls_back_when_thrashing():
+    regexp = "[a-c]*[0-9][0-9][0-9]"
+    backend = DFABackend(Program(parse_regexp(regexp)), max_cache_entries=4)
+    rnd = random.Random(2)
+    string = "".join(rnd.choice("abc0123456789") for _ in range(2000))
+    assert backend.search(string, 0, len(string)) == python_span(regexp, string, False)
+    assert backend.forward.fallbacks > 0
+
+
+def test_engines_agree_on_simple_regexps():
+    cases = [
+        ("abcd[0-9]+[a-z]*", "abcd0123456789abcdefghi"),
+        ("[a-z]*[1-9][1-9]8[1-9]", "abcda1984"),
+        ("[0-9]+[^a-z]*", "__0123!!"),
+        ("^abcd.?", "abcd&&"),
+        ("abcd0$", "_abcd0"),
+        ("a*", ""),
+    ]
+    for regexp, string in cases:
+        spans = [spyre_span(regexp, string, False, engine) for engine in engines]
+        assert spans.count(spans[0]) == len(spans), (regexp, string, spans)
+
+
+def test_prefilter_analysis():
+    prefilter = build_prefilter(parse_regexp("abcd[0-9]+"))
+    assert prefilter.prefix == "abcd"
+    assert prefilter.required == ("abcd",)
+    assert prefilter.min_length == 5
+
+    prefilter = build_prefilter(parse_regexp("^x+y[a-z]*zz?w$"))
+    assert prefilter.prefix == "x"
+    assert prefilter.required == ("xy", "w", "z")
+    assert prefilter.min_length == 4
+
+    prefilter = build_prefilter(parse_regexp("[0-9]*"))
+    assert prefilter.prefix == ""
+    assert prefilter.required == ()
+    assert prefilter.min_length == 0
+
+
+def test_prefilter_rejects_without_running_the_engine():
+    class FailingBackend:
+        def search(self, string, pos, endpos):
+            assert False
+
+    pattern = Pattern("abcd[0-9]+x")
+    pattern.backend = FailingBackend()
+    assert pattern.search("abcd") is None
+    assert pattern.search("_______________abcd0") is None
+    assert pattern.search("0123456789x___") is None
+
+
+def test_prefix_skips_to_candidates():
+    string = "abc_" * 1000 + "abcd0123"
+    for engine in ["nfa", "dfa"]:
+        pattern = Pattern("abcd[0-9]+", engine)
+        assert pattern.search(string).span() == (4000, 4008)
+        assert pattern.search(string, 4001) is None
+
+
+def test_stream_matches_like_finditer():
+    rnd = random.Random(5)
+    for _ in range(300):
+        regexp = random_regexp(rnd)
+        string = "".join(rnd.choice("abc") for _ in range(rnd.randint(0, 20)))
+        cuts = sorted(rnd.sample(range(len(string) + 1), rnd.randint(0, min(len(string) + 1, 4))))
+        chunks = [string[i:j] for i, j in zip([0] + cuts, cuts + [len(string)])]
+        pattern = Pattern(regexp)
+        expected = [(match.span(), match.group()) for match in pattern.finditer(string)]
+        found = [(match.span(), match.group()) for match in stream_finditer(pattern, chunks)]
+        assert found == expected, (regexp, chunks)
+
+
+def test_stream_reports_matches_early_and_keeps_little():
+    matcher = compile("abcd[0-9]+").stream()
+    assert matcher.feed("____ab") == []
+    assert matcher.feed("cd12") == []
+    matches = matcher.feed("3_ab")
+    assert [(match.span(), match.group()) for match in matches] == [((4, 11), "abcd123")]
+    assert len(matcher.buffer) < len("abcd")
+
+    for _ in range(1000):
+        assert matcher.feed("x" * 100) == []
+    assert len(matcher.buffer) < 4
+    assert matcher.close() == []
+
+
+def test_stream_end_of_string():
+    matcher = compile("[0-9]+$").stream()
+    assert matcher.feed("12 34") == []
+    assert matcher.feed("56") == []
+    assert [match.group() for match in matcher.close()] == ["3456"]
+
+
+def test_regex_set_against_single_regexps():
+    rnd = random.Random(7)
+    for _ in range(100):
+        regexps = [random_regexp(rnd) for _ in range(rnd.randint(1, 6))]
+        regexps += ["".join(rnd.choice("abc") for _ in range(rnd.randint(1, 3))) for _ in range(3)]
+        regexp_set = RegexSet(regexps)
+        for _ in range(5):
+            string = "".join(rnd.choice("abc") for _ in range(rnd.randint(0, 10)))
+            expected = [i for i, regexp in enumerate(regexps) if Pattern(regexp).search(string) is not None]
+            assert regexp_set.matches(string) == expected, (regexps, string)
+
+
+def test_regex_set_literals_and_gates():
+    regexp_set = RegexSet(["error", "warning", "user[0-9]+ logged in", "^GET /"])
+    assert regexp_set.matches("2018 error: user12 logged in") == [0, 2]
+    assert regexp_set.matches("GET / HTTP/1.1 warning") == [1, 3]
+    assert regexp_set.matches("nothing to see") == []
+    assert not regexp_set.is_match("user logged in")
+
+    regexp_set = RegexSet([b"\x00\x01", b"[\x80-\xff]+$"])
+    assert regexp_set.matches(b"ab\x00\x01\xff") == [0, 1]
+    assert regexp_set.matches(memoryview(b"\x00\x02")) == []
+
+
+def test_regex_set_of_many_regexps():
+    regexps = ["user" + str(i) + "[0-9]* GET" for i in range(300)] + ["x*", "[0-9]$"]
+    regexp_set = RegexSet(regexps)
+    dfa = regexp_set.dfa
+    assert dfa.max_cache_entries >= SET_CACHE_ENTRIES_PER_INSTRUCTION * len(dfa.nfa)
+    line = "2018 user42 GET /health 200"
+    assert regexp_set.matches(line) == [4, 42, 300, 301]
+    # States only hold the regexps being matched, not the start of every regexp
+    assert len(dfa.roots) >= 300 and dfa.start_state(False).pcs == ()
+    assert not any(dfa.root_set.intersection(state.pcs) for state in dfa.states.values())
+    # Without cache every character costs the same
+    uncached = RegexSet(regexps, max_cache_entries=2)
+    assert [uncached.matches(line) for _ in range(3)] == [[4, 42, 300, 301]] * 3
+    assert uncached.dfa.fallbacks > 0
+    # The transitions from the roots count against the cache too
+    many_chars = "".join(chr(code) for code in range(0x100, 0x600))
+    assert uncached.matches(many_chars + line) == [4, 42, 300, 301]
+    assert len(uncached.dfa.root_transitions) <= uncached.dfa.max_cache_entries
+
+
+def test_afinditer_over_stream_reader_and_async_iterable():
+    pattern = compile(b"abcd[0-9]+")
+    data = b"xx abcd1 abcd22" * 100 + b" abcd333"
+    expected = [(match.span(), match.group()) for match in pattern.finditer(data)]
+
+    async def from_reader():
+        reader = asyncio.StreamReader()
+        reader.feed_data(data)
+        reader.feed_eof()
+        return [(match.span(), match.group()) async for match in pattern.afinditer(reader, slice_size=7)]
+
+    async def from_iterable():
+        async def chunks():
+            for i in range(0, len(data), 100):
+                yield data[i:i + 100]
+        return [(match.span(), match.group()) async for match in pattern.afinditer(chunks(), slice_size=64)]
+
+    assert asyncio.run(from_reader()) == expected
+    assert asyncio.run(from_iterable()) == expected
+
+
+def test_afinditer_returns_to_the_event_loop():
+    ticks = []
+
+    async def ticker():
+        while True:
+            ticks.append(len(ticks))
+            await asyncio.sleep(0)
+
+    async def scan():
+        task = asyncio.ensure_future(ticker())
+        async def one_chunk():
+            yield "a" * 1000 + "b"
+        matches = [match.span() async for match in compile("a+b").afinditer(one_chunk(), slice_size=100)]
+        task.cancel()
+        return matches
+
+    assert asyncio.run(scan()) == [(0, 1001)]
+    # The long chunk was matched in 10 slices, the loop ran in between
+    assert len(ticks) >= 9
+
+
+def test_tracer_counts_per_pattern_and_state_machine():
+    tracer = CountingTracer()
+    for engine in ("nfa", "dfa", "statemachine"):
+        untraced = Pattern("abcd[0-9]+", engine)
+        pattern = untraced.with_tracer(tracer)
+        assert pattern.search("zz abcd123").span() == (3, 10)
+        assert pattern.search("abcd_") is None
+        stats = tracer.stats[pattern]
+        assert (stats.calls, stats.matches) == (2, 1)
+        # "zz " skipped by the first search, every start position by the second
+        assert stats.skipped == 3 + 6
+        assert stats.consumed[4] >= 3
+        assert stats.chars() >= 10
+        assert stats.seconds > 0
+        assert untraced.tracer is None
+        untraced.search("abcd1")
+        assert pattern.with_tracer(None).backend is untraced.backend
+        assert tracer.stats[pattern].calls == 2 and untraced not in tracer.stats
+    assert tracer.report().count("'abcd[0-9]+'") == 3
+
+
+def test_tracer_counts_dfa_characters():
+    tracer = CountingTracer()
+    pattern = Pattern("[a-z]+[0-9]", "dfa").with_tracer(tracer)
+    string = "12 abc1 zz"
+    assert pattern.search(string).span() == (3, 7)
+    stats = tracer.stats[pattern]
+    chars, transitions, examined = stats.dfa_chars, stats.dfa_transitions, stats.chars()
+    # Forward to the end of the match or further, then back to its start
+    assert chars >= 7 + 4 and transitions > 0 and examined > 0
+    # Once the transitions are cached the DFA steps over characters without examining them
+    assert pattern.search(string).span() == (3, 7)
+    assert (stats.dfa_chars, stats.dfa_transitions, stats.chars()) == (2 * chars, transitions, examined)
+    assert "characters scanned" in tracer.report()
+    # The other engines have no DFA
+    nfa = Pattern("[a-z]+[0-9]").with_tracer(tracer)
+    nfa.search(string)
+    assert tracer.stats[nfa].dfa_chars == 0
+
+
+def test_tracer_counts_searches_from_several_threads():
+    tracer = CountingTracer()
+    pattern = Pattern("[a-z]+[0-9]", "dfa").with_tracer(tracer)
+    pattern.search("12 abc1 zz")
+    stats = tracer.stats[pattern]
+    chars, examined = stats.dfa_chars, stats.chars()
+    threads = [threading.Thread(target=lambda: [pattern.search("12 abc1 zz") for _ in range(200)])
+               for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    # No count is lost, the DFAs the threads share count nothing themselves
+    assert (stats.calls, stats.dfa_chars, stats.chars()) == (801, 801 * chars, examined)
+    assert not hasattr(pattern.backend.untraced.forward, "chars_scanned")
+
+
+def test_tracer_installed_through_the_cache():
+    purge()
+    tracer = CountingTracer()
+    cached = compile("[0-9]+")
+    set_tracer(tracer)
+    try:
+        compile("[0-9]+").search("a1")
+        compile("x[0-9]").search("x1")
+        assert sorted(pattern.pattern for pattern in tracer.stats) == ["[0-9]+", "x[0-9]"]
+        assert tracer.stats[cached].skipped == 1
+    finally:
+        set_tracer(None)
+    assert cached.tracer is None
+
+
+def test_codegen_engine_against_python():
+    check_engine_against_python("codegen")
+
+
+def test_codegen_engine_generated_code():
+    pattern = Pattern("abcd[0-9]+[a-z]*", "codegen")
+    source = pattern.backend.source
+    # Literal runs use startswith(), loops followed by something else never give characters back
+    assert "startswith('abcd'" in source
+    assert "for " not in source
+    assert "for " in Pattern("[a-z]*z", "codegen").backend.source
+    assert match_regexp("[a-z]*z", "xyzzy", engine="codegen") == "xyzz"
+
+    cached = len(code_cache)
+    Pattern("abcd[0-9]+[a-z]*", "codegen")
+    assert len(code_cache) == cached
+    for i in range(CODE_CACHE_SIZE + 10):
+        Pattern("x" * i + "[0-9]+", "codegen")
+    assert len(code_cache) == CODE_CACHE_SIZE
+    purge()
+    assert len(code_cache) == 0
+
+    assert Pattern(b"abcd[0-9]+", "codegen").search(memoryview(b"zzabcd1")).span() == (2, 7)
+    assert Pattern(b"[^a-z]+", "codegen").search(bytearray(b"ab\xe912")).span() == (2, 5)
+
+    # Too many loops giving characters back for nested Python blocks, runs on the Pike VM
+    fallback = Pattern("a*[ab]*" * 10 + "b", "codegen")
+    assert fallback.backend.source is None
+    assert fallback.search("xaaab").span() == (1, 5)
+
+
+def test_step_limit_and_deadline():
+    string = "b" + "a" * 20000
+    for engine in engines:
+        pattern = Pattern("ba+", engine, max_steps=5000)
+        try:
+            pattern.search(string)
+            assert False, engine
+        except MatchLimitExceeded as exceeded:
+            assert exceeded.reason == "steps"
+            assert exceeded.steps > 5000
+            assert 0 <= exceeded.position < len(string)
+        # Every call has its own budget
+        assert pattern.search("xxbaa").span() == (2, 5)
+        assert pattern.match("baa").span() == (0, 3)
+
+        try:
+            pattern.with_limits(timeout=0).search("b" + "a" * 5000)
+            assert False, engine
+        except MatchLimitExceeded as exceeded:
+            assert exceeded.reason == "timeout"
+        assert pattern.with_limits().limits is None
+        assert pattern.with_limits().search(string).span() == (0, len(string))
+        assert pattern.limits.max_steps == 5000
+
+    # Enough steps for linear time on the Pike VM and the DFA, whatever the regexp
+    for engine in ("nfa", "dfa"):
+        pattern = Pattern("[a-z]*[0-9]", engine)
+        pattern = pattern.with_limits(max_steps=pattern.cost().steps(len(string)))
+        assert pattern.search(string + "1").span() == (0, len(string) + 1)
+
+
+def test_cost_estimate():
+    assert Pattern("abc").cost() == Cost(4, 1)
+    # The Pike VM keeps one group of threads per counted loop whatever its bounds
+    assert Pattern("a{2,5000}b").cost() == Pattern("a{2}b").cost()
+    assert Pattern("a{2,50}b", "dfa").cost().per_char > Pattern("a{2}b", "dfa").cost().per_char
+    assert Pattern("a*b", "dfa").cost().degree == 1
+    assert Pattern("a*b", "codegen").cost().degree == 2
+    assert Pattern("abc", "statemachine").cost() == Cost(3, 1)
+    # Counted loops run on the Pike VM
+    assert Pattern("a{2,5}b", "codegen").cost() == Pattern("a{2,5}b").cost()
+    assert str(Cost(2, 2)) == "2 steps per character, growing as n^2"
+
+
+def test_compile_with_limits():
+    purge()
+    assert compile("a*b", max_cost=10) is compile("a*b")
+    try:
+        compile("a*b", "codegen", max_cost=10)
+        assert False
+    except PatternTooExpensive as too_expensive:
+        assert too_expensive.cost.degree == 2
+    try:
+        compile("a?" * 20 + "a" * 20, max_cost=10)
+        assert False
+    except PatternTooExpensive:
+        pass
+
+    limited = compile("a*b", max_steps=100)
+    assert limited is not compile("a*b")
+    assert limited is compile("a*b", max_steps=100)
+    assert compile("a*b").limits is None
+    # Copies with other limits leave the cached pattern alone
+    assert limited.with_limits().search("a" * 1000 + " b") is not None
+    assert compile("a*b", max_steps=100).limits.max_steps == 100
+    try:
+        limited.search("a" * 1000 + " b")
+        assert False
+    except MatchLimitExceeded:
+        pass
@@ -0,0 +1,87 @@
+#!/usr/bin/python3
+
+"""
+SPYRE - Simple PYthon 3 Regular Expression Engine
+Copyright (C) 2018 Francesco Rigoni - francesco.rigoni@gmail.com
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License v3 as published by
+the Free Software Foundation.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+from spyre_grep import *
+import io
+import os
+import tempfile
+
+
+def grep_output(argv, content):
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "log.txt")
+        with open(path, "wb") as f:
+            f.write(content)
+        out = io.BytesIO()
+        status = main(argv + [path], out)
+        return status, out.getvalue().replace(path.encode(), b"FILE")
+
+
+log = b"abcd1 first\nnothing here\nxx abcd22\n\nabcd\nlast abcd333"
+
+
+def test_grep_lines():
+    assert grep_output(["abcd[0-9]+"], log) == (0, b"abcd1 first\nxx abcd22\nlast abcd333\n")
+    assert grep_output(["zzz"], log) == (1, b"")
+
+
+def test_grep_line_numbers():
+    assert grep_output(["-n", "abcd[0-9]+"], log) == (0, b"1:abcd1 first\n3:xx abcd22\n6:last abcd333\n")
+    assert grep_output(["-n", "^$"], log) == (0, b"4:\n")
+
+
+def test_grep_count_and_files():
+    assert grep_output(["-c", "abcd[0-9]+"], log) == (0, b"3\n")
+    assert grep_output(["-l", "abcd[0-9]+"], log) == (0, b"FILE\n")
+    assert grep_output(["-c", "zzz"], log) == (1, b"0\n")
+
+
+def test_grep_invert():
+    assert grep_output(["-v", "-n", "[0-9]"], log) == (0, b"2:nothing here\n4:\n5:abcd\n")
+
+
+def test_grep_empty_file():
+    assert grep_output(["a*"], b"") == (1, b"")
+    assert grep_output(["-c", "a"], b"") == (1, b"0\n")
+
+
+def test_grep_engines_agree():
+    for engine in engines:
+        assert grep_output(["--engine", engine, "-n", "[a-z]+ [a-z]+"], log) == \
+            (0, b"2:nothing here\n3:xx abcd22\n6:last abcd333\n")
+
+
+def test_grep_start_of_line():
+    assert grep_output(["-n", "^abcd"], log) == (0, b"1:abcd1 first\n5:abcd\n")
+    # Bytes of the command line that do not decode are matched as they are
+    assert grep_output(["-c", os.fsdecode(b"[\xe0-\xff]")], b"caf\xe9\nplain\n") == (0, b"1\n")
+
+
+def test_grep_non_ascii_pattern():
+    content = "café crème\nprix: 5€\nplain\n".encode("utf-8")
+    assert grep_output(["-n", "café"], content) == (0, "1:café crème\n".encode("utf-8"))
+    assert grep_output(["-n", "[0-9]€"], content) == (0, "2:prix: 5€\n".encode("utf-8"))
+    assert grep_output(["-c", "é"], content) == (0, b"1\n")
+    assert grep_output(["-c", "\\é\\."], "é.\n".encode("utf-8")) == (0, b"1\n")
+
+
+def test_grep_rejects_multibyte_characters_matched_bytewise():
+    content = "café crème\nprix: 5€\nplain\n".encode("utf-8")
+    for pattern in ("[é]", "[^é]x", "[à-ÿ]+", "é+", "cafe?é*", "€{1,2}", "é.", ".€", "[a-z]\\é?"):
+        assert grep_output([pattern], content) == (2, b"")
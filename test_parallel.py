@@ -0,0 +1,112 @@
+#!/usr/bin/python3
+
+"""
+SPYRE - Simple PYthon 3 Regular Expression Engine
+Copyright (C) 2018 Francesco Rigoni - francesco.rigoni@gmail.com
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License v3 as published by
+the Free Software Foundation.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+from spyre_parallel import *
+import io
+import tempfile
+
+
+def test_match_many_keeps_order():
+    strings = ["record " + str(i) + (" abcd" + str(i) if i % 3 == 0 else "") for i in range(500)]
+    expected = [Pattern("abcd[0-9]+").search(string) for string in strings]
+    expected = [match.span() if match is not None else None for match in expected]
+
+    for workers in (1, 2):
+        results = list(match_many("abcd[0-9]+", strings, workers=workers, chunksize=16))
+        assert [match.span() if match is not None else None for match in results] == expected
+        assert results[3].group() == "abcd3"
+
+
+def test_match_many_anchored_and_lazy():
+    records = ("abcd" if i % 2 == 0 else "_abcd" for i in range(10 ** 9))
+    results = match_many(compile("abcd", "dfa"), records, workers=2, chunksize=4, anchored=True)
+    assert [match is not None for match in islice(results, 6)] == [True, False] * 3
+    results.close()
+
+
+def file_matches(regexp, content, workers, range_size):
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "data.bin")
+        with open(path, "wb") as f:
+            f.write(content)
+        return [(match.span(), match.group()) for match in parallel_finditer(regexp, path, workers, range_size)]
+
+
+def test_parallel_finditer_across_ranges():
+    content = b"ab" * 50 + b" xaaaaaaaaaaaay " + b"abc" * 7 + b"\nend"
+    for regexp in (b"ab", b"aa", b"a[ab]+c?", b"x[a]+y", b"b*", b"^ab", b"end$", b"c\nend", b"[^x]+"):
+        expected = [(match.span(), match.group()) for match in Pattern(regexp).finditer(content)]
+        for range_size in (1, 3, 7, 64):
+            assert file_matches(regexp, content, 2, range_size) == expected
+    assert file_matches(b"a*", b"", 2, 1) == [((0, 0), b"")]
+
+
+class ReadPositions:
+    """
+    Bytes without find(), remembering the furthest position read.
+    """
+    def __init__(self, data):
+        self.data = data
+        self.furthest = -1
+
+    def __len__(self):
+        return len(self.data)
+
+    def __getitem__(self, index):
+        last = index.stop - 1 if isinstance(index, slice) else index
+        self.furthest = max(self.furthest, min(last, len(self.data) - 1))
+        return self.data[index]
+
+
+def test_search_stops_where_matches_may_no_longer_start():
+    for engine in engines:
+        pattern = Pattern(b"x+y", engine)
+        data = ReadPositions(b"x" * 10 + b"a" * 10000 + b"xy")
+        assert list(pattern.finditer(data, 0, None, 5)) == []
+        # The attempts starting before 5 read the run of "x" and the "a" ending it
+        assert data.furthest <= 11
+        assert [match.span() for match in pattern.finditer(data.data, 3, None, 10011)] == [(10010, 10012)]
+        assert pattern.search(data.data, 0, None, 10010) is None
+
+    content = b"xxxxxxxxxy" + b"a" * 100
+    init_worker(b"x+y", "dfa")
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "data.bin")
+        with open(path, "wb") as f:
+            f.write(content)
+        assert find_range(path, 3, 6) == [(3, 10)]
+        assert find_range(path, 10, 20) == []
+
+
+def test_parallel_grep_lines():
+    content = b"".join(b"line " + str(i).encode() + (b" abcd" if i % 7 == 0 else b"") + b"\n" for i in range(200))
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "log.txt")
+        with open(path, "wb") as f:
+            f.write(content)
+        for argv in (["-n", "abcd"], ["-v", "-n", "[0-9]5"], ["-c", "^line 1"]):
+            expected = io.BytesIO()
+            main(argv + [path], expected)
+            out = io.BytesIO()
+            main(["-j", "3"] + argv + [path], out)
+            assert out.getvalue() == expected.getvalue()
+
+        pattern = compile(b"abcd", "dfa")
+        lines = list(parallel_grep_lines(pattern, path, len(content), False, 3, range_size=100))
+        assert lines == list(numbered_lines(content, selected_lines(pattern, content, False)))
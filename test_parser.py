@@ -108,3 +108,62 @@ def test_parse_regexp_unclosed_square_brackets_escaped():
         assert False
     except RegExpParseException:
         pass
+
+
+def test_parse_square_brackets_block_mixed():
+    matcher = parse_square_brackets_block("a-cx-z0")
+    assert type(matcher) == CharClassMatcher
+    assert all(matcher.match(c) for c in "abcxyz0")
+    assert not any(matcher.match(c) for c in "dwA1-")
+
+    matcher = parse_square_brackets_block("^a-cx-z0")
+    assert not any(matcher.match(c) for c in "abcxyz0")
+    assert all(matcher.match(c) for c in "dwA1-€")
+
+
+def test_parse_square_brackets_block_literal_dash():
+    matcher = parse_square_brackets_block("-ab")
+    assert type(matcher) == PoolMatcher
+    assert all(matcher.match(c) for c in "-ab")
+
+    matcher = parse_square_brackets_block("a-c-")
+    assert all(matcher.match(c) for c in "abc-")
+    assert not matcher.match("d")
+
+
+def test_parse_square_brackets_block_unicode():
+    matcher = parse_square_brackets_block("Ā-ſz")
+    assert matcher.match("ā")
+    assert matcher.match("z")
+    assert not matcher.match("ƀ")
+    assert not matcher.match("a")
+
+    matcher = parse_square_brackets_block("^α-ω")
+    assert not matcher.match("β")
+    assert matcher.match("Α")
+    assert matcher.match("b")
+
+
+def test_parse_square_brackets_block_inverted_range():
+    try:
+        parse_square_brackets_block("z-a")
+        assert False
+    except RegExpParseException:
+        pass
+
+
+def test_parse_regexp_counted_repetition():
+    state_machines = parse_regexp("a{2,5}[0-9]{3}b{,4}c{1,}")
+    assert [type(sm) for sm in state_machines] == [CountedMatchStateMachine] * 4
+    assert [(sm.min_count, sm.max_count) for sm in state_machines] == [(2, 5), (3, 3), (0, 4), (1, None)]
+
+    # Braces not forming a repetition are literals, like in Python
+    state_machines = parse_regexp("a{x}{,")
+    assert "".join(sm.matcher.char for sm in state_machines) == "a{x}{,"
+
+    for regexp in ("a{3,2}", "a{70000}", "a{2}*"):
+        try:
+            parse_regexp(regexp)
+            assert False, regexp
+        except RegExpParseException:
+            pass
@@ -179,3 +179,152 @@ def test_regexps_any_match():
 
     test_string = "abcd."
     assert match_regexp("^abcd\.", test_string) == test_string
+
+
+def test_compiled_pattern_reuse():
+    pattern = compile("abcd[0-9]+")
+    assert pattern.search("__abcd123__").group() == "abcd123"
+    assert pattern.search("abcd9").group() == "abcd9"
+    assert pattern.search("abcd") is None
+    assert pattern.match("abcd12").group() == "abcd12"
+    assert pattern.match("_abcd12") is None
+
+
+def test_pattern_cache():
+    purge()
+    set_cache_size(2)
+    try:
+        match_regexp("a", "a")
+        match_regexp("a", "a")
+        assert cache_info().hits == 1
+        assert cache_info().misses == 1
+
+        match_regexp("b", "b")
+        match_regexp("c", "c")
+        info = cache_info()
+        assert info.currsize == 2
+        assert info.maxsize == 2
+
+        # "a" was the least recently used pattern and got evicted
+        match_regexp("a", "a")
+        assert cache_info().misses == 4
+    finally:
+        set_cache_size(DEFAULT_CACHE_SIZE)
+        purge()
+
+
+def test_compiled_pattern_shared_between_threads():
+    from concurrent.futures import ThreadPoolExecutor
+
+    pattern = compile("[a-z]*[1-9][1-9]8[1-9]")
+    strings = ["abcda1984", "_-_1181", "abc", "zz9989"] * 50
+    def search_span(string):
+        match = pattern.search(string)
+        return match.span() if match is not None else None
+
+    expected = [search_span(s) for s in strings]
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        assert list(executor.map(search_span, strings)) == expected
+
+
+def test_program_is_immutable():
+    pattern = compile("abc")
+    try:
+        pattern.program.state_machines = ()
+        assert False
+    except AttributeError:
+        pass
+
+
+def test_pattern_does_not_keep_state_machines():
+    for engine in engines:
+        pattern = Pattern("ab[0-9]+", engine)
+        # Parsed only when asked for, once
+        assert pattern.program.parsed is None
+        assert pattern.program.state_machines is pattern.program.state_machines
+        assert pattern.program.optimized is pattern.program.optimized
+        assert [type(sm) for sm in pattern.program.state_machines] == \
+            [type(sm) for sm in parse_regexp("ab[0-9]+")]
+        assert pattern.search("xab12").span() == (1, 5)
+
+
+def test_match_spans():
+    string = "_-_-_abcd0123_-_"
+    match = compile("abcd[0-9]+").search(string)
+    assert match.span() == (5, 13)
+    assert match.start() == 5
+    assert match.end() == 13
+    assert match.group() == "abcd0123"
+
+    assert compile("abcd").search(string, 6) is None
+    assert compile("abcd").search(string, 0, 8) is None
+    assert compile("abcd").match(string, 5).span() == (5, 9)
+    assert compile("^abcd").search(string, 5) is None
+    assert compile("[0-9]+$").search(string, 0, 13).span() == (9, 13)
+
+
+def test_search_long_string_is_linear():
+    string = "_" * 200000 + "abcd0"
+    assert compile("abcd[0-9]").search(string).span() == (200000, 200005)
+
+
+def test_regexps_mixed_square_brackets():
+    assert match_regexp("[a-cx-z0]+", "__abzx0c__") == "abzx0c"
+    assert match_regexp("[^a-c0-9_]+", "ab_c0_defg") == "defg"
+    assert match_regexp("[-0-9]+", "tel: 555-0199") == "555-0199"
+
+
+def test_finditer():
+    string = "abcd1 abcd22 x abcd333"
+    spans = [match.span() for match in compile("abcd[0-9]+").finditer(string)]
+    assert spans == [(0, 5), (6, 12), (15, 22)]
+    assert findall("abcd[0-9]+", string) == ["abcd1", "abcd22", "abcd333"]
+    assert findall("abcd[0-9]+", "abcd") == []
+
+
+def test_finditer_empty_matches():
+    assert findall("a*", "baab") == ["", "aa", "", ""]
+    assert findall("x*", "") == [""]
+    assert findall("^a", "aaa") == ["a"]
+
+
+def test_finditer_is_lazy():
+    matches = finditer("[0-9]", "1" * 100000)
+    assert next(matches).span() == (0, 1)
+    assert next(matches).span() == (1, 2)
+
+
+def test_bytes_patterns():
+    import mmap
+
+    data = b"__abcd0123__\xe9\xff"
+    for engine in engines:
+        pattern = compile(b"abcd[0-9]+", engine)
+        assert pattern.search(data).span() == (2, 10)
+        assert pattern.search(bytearray(data)).group() == bytearray(b"abcd0123")
+        assert pattern.search(memoryview(data)).span() == (2, 10)
+        assert compile(b"[\xe0-\xff]+$", engine).search(data).span() == (12, 14)
+        assert compile(b"[^_a-z0-9]", engine).search(data).group() == b"\xe9"
+
+    mapping = mmap.mmap(-1, len(data))
+    mapping.write(data)
+    assert compile(b"abcd[0-9]+").search(mapping).span() == (2, 10)
+    assert [match.span() for match in compile(b"[0-9]").finditer(mapping, 5, 8)] == [(6, 7), (7, 8)]
+    mapping.close()
+
+    chunks = [b"__ab", memoryview(b"cd01"), bytearray(b"23_")]
+    assert [match.group() for match in stream_finditer(compile(b"abcd[0-9]+"), chunks)] == [b"abcd0123"]
+
+
+def test_bytes_patterns_do_not_match_strings():
+    try:
+        compile(b"abc").search("abc")
+        assert False
+    except TypeError:
+        pass
+
+    try:
+        compile("abc").search(b"abc")
+        assert False
+    except TypeError:
+        pass
@@ -0,0 +1,142 @@
+#!/usr/bin/python3
+
+"""
+SPYRE - Simple PYthon 3 Regular Expression Engine
+Copyright (C) 2018 Francesco Rigoni - francesco.rigoni@gmail.com
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License v3 as published by
+the Free Software Foundation.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+from spyre_store import *
+import tempfile
+import time
+
+
+def store_path():
+    return os.path.join(tempfile.mkdtemp(), "patterns.spyre")
+
+
+def test_store_round_trip():
+    path = store_path()
+    subject = "zz abcd123 bob@example.com éè end"
+    regexps = ["abcd[0-9]+", "^zz.*end$", "[^a-c]?x*", "[à-ÿ]+", "[aeiou]b", "[^aeiou]+@", "e.?d$",
+               "[0-9]{2,3}", "[a-z]{3,}@"]
+    patterns = [Pattern(regexp, engine) for regexp in regexps for engine in engines]
+    patterns.append(Pattern(b"\x00[\x80-\xff]+[^a]", "dfa"))
+    for pattern in patterns:
+        pattern.findall(subject if pattern.engine != "dfa" or not pattern.bytes_mode else b"\x00\x90\x91b")
+    save_patterns(path, patterns)
+
+    with load_patterns(path) as store:
+        assert not store.stale
+        assert len(store) == len(patterns)
+        assert ("abcd[0-9]+", "dfa") in store
+        assert ("abcd[0-9]+", "unknown") not in store
+        for pattern in patterns:
+            loaded = store.get(pattern.pattern, pattern.engine)
+            assert loaded is store.get(pattern.pattern, pattern.engine)
+            assert [type(sm) for sm in loaded.program.state_machines] == \
+                [type(sm) for sm in pattern.program.state_machines]
+            assert repr(loaded.prefilter) == repr(pattern.prefilter)
+            string = b"a\x00\x90\x91b\x00\x80" if pattern.bytes_mode else subject
+            assert [m.span() for m in loaded.finditer(string)] == [m.span() for m in pattern.finditer(string)]
+        # The DFA states built before saving are loaded with the pattern
+        loaded = store.get("abcd[0-9]+", "dfa")
+        saved = [pattern for pattern in patterns if pattern.pattern == "abcd[0-9]+" and pattern.engine == "dfa"][0]
+        assert sorted(loaded.backend.forward.states) == sorted(saved.backend.forward.states)
+        assert loaded.backend.forward.cache_entries == saved.backend.forward.cache_entries
+        # Patterns missing from the file are compiled
+        assert store.get("new+").search("a new").span() == (2, 5)
+
+
+def test_store_loads_engines_without_compiling():
+    path = store_path()
+    patterns = [Pattern("[a-c]x{2,5}[0-9]*$", engine) for engine in ("nfa", "dfa")]
+    patterns += [Pattern("ab{100}c", "dfa", max_steps=10 ** 6), Pattern(b"[^\x00]+", "nfa", timeout=0.5)]
+    save_patterns(path, patterns)
+    with load_patterns(path) as store:
+        for pattern in patterns:
+            loaded = store.get(pattern.pattern, pattern.engine)
+            # Built from the NFAs in the file, the regexp is not even parsed
+            assert loaded.program.parsed is None
+            assert loaded.backend.dump() == pattern.backend.dump()
+            limits = [(limits.max_steps, limits.timeout) if limits is not None else None
+                      for limits in (loaded.limits, pattern.limits)]
+            assert limits[0] == limits[1]
+        assert store.get("ab{100}c", "dfa").search("xab" + "b" * 99 + "c").span() == (1, 103)
+        assert store.get(b"[^\x00]+", "nfa").limits.timeout == 0.5
+
+
+def test_store_loads_faster_than_compiling():
+    path = store_path()
+    regexps = ["user" + str(i) + "[a-z]+ [GP]x{2,5}[0-9]*$" for i in range(300)]
+    save_patterns(path, [Pattern(regexp, "dfa") for regexp in regexps])
+    compile_seconds = load_seconds = float("inf")
+    for _ in range(3):
+        started = time.perf_counter()
+        for regexp in regexps:
+            Pattern(regexp, "dfa")
+        compile_seconds = min(compile_seconds, time.perf_counter() - started)
+        started = time.perf_counter()
+        with load_patterns(path) as store:
+            for regexp in regexps:
+                store.get(regexp, "dfa")
+        load_seconds = min(load_seconds, time.perf_counter() - started)
+    assert load_seconds < compile_seconds
+
+
+def test_store_format_version():
+    path = store_path()
+    save_patterns(path, [Pattern("ab+c", "dfa")])
+    with open(path, "rb") as f:
+        data = bytearray(f.read())
+    struct.pack_into("<H", data, len(MAGIC), FORMAT_VERSION + 1)
+    with open(path, "wb") as f:
+        f.write(data)
+    with load_patterns(path) as store:
+        assert store.stale
+        assert len(store) == 0
+        assert store.get("ab+c", "dfa").search("xabbc").span() == (1, 5)
+
+    with load_patterns(store_path()) as store:
+        assert store.stale
+        assert store.get("ab+c").match("abc") is not None
+
+
+def test_store_damaged_records():
+    path = store_path()
+    saved = Pattern("ab+c", "dfa")
+    saved.search("xabbc")
+    saved.match("abbc")
+    save_patterns(path, [saved])
+    with open(path, "rb") as f:
+        data = bytearray(f.read())
+    _, _, offset, length, crc = index_format.unpack_from(data, header_format.size)
+
+    # A flipped bit is caught by the CRC32 of the record
+    damaged = bytearray(data)
+    damaged[offset + length - 1] ^= 1
+    # The record ends with the start states of the anchored DFA, one past the end of its
+    # table, with a CRC32 matching it
+    out_of_bounds = bytearray(data)
+    struct.pack_into("<I", out_of_bounds, offset + length - 4, 1000000)
+    struct.pack_into("<I", out_of_bounds, header_format.size + index_format.size - 4,
+                     zlib.crc32(out_of_bounds[offset:offset + length]))
+    for contents in (damaged, out_of_bounds):
+        with open(path, "wb") as f:
+            f.write(contents)
+        with load_patterns(path) as store:
+            assert not store.stale
+            key = store_key("ab+c", "dfa")
+            assert store.decode("ab+c", "dfa", *store.index[key]) is None
+            assert store.get("ab+c", "dfa").search("xabbc").span() == (1, 5)
@@ -0,0 +1,70 @@
+#!/usr/bin/python3
+
+"""
+SPYRE - Simple PYthon 3 Regular Expression Engine
+Copyright (C) 2018 Francesco Rigoni - francesco.rigoni@gmail.com
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License v3 as published by
+the Free Software Foundation.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+from spyre_vector import *
+from test_engines import random_regexp
+import random
+import unittest
+
+
+def require_numpy():
+    """
+    Skips the calling test when NumPy is not installed, the runners report it skipped.
+    """
+    if not numpy_available():
+        raise unittest.SkipTest("NumPy is not installed")
+
+
+def spans_of(pattern, column, anchored):
+    spans = []
+    for string in column:
+        match = pattern.match(string) if anchored else pattern.search(string)
+        spans.append(match.span() if match is not None else (-1, -1))
+    return spans
+
+
+def test_vector_agrees_with_pattern():
+    require_numpy()
+    rnd = random.Random(3)
+    for _ in range(200):
+        regexp = random_regexp(rnd)
+        column = ["".join(rnd.choice("abc") for _ in range(rnd.randint(0, 8))) for _ in range(30)]
+        vector_pattern = VectorPattern(regexp, "dfa")
+        for anchored in (True, False):
+            starts, ends = vector_pattern.match_spans(column) if anchored else vector_pattern.search_spans(column)
+            assert list(zip(starts.tolist(), ends.tolist())) == spans_of(vector_pattern.pattern, column, anchored)
+        assert vector_pattern.search_mask(column).tolist() == (starts >= 0).tolist()
+
+
+def test_vector_columns():
+    require_numpy()
+    ids = numpy.array(["ID-12", "ID-1x", "id-00", "ID-99zz", "", "ID-é9"])
+    assert match_column("ID-[0-9][0-9]", ids).tolist() == [True, False, False, True, False, False]
+    assert search_column("[0-9]$", ids).tolist() == [True, False, True, False, False, True]
+    starts, ends = VectorPattern("[é-ü][0-9]+").search_spans(ids)
+    assert (starts.tolist(), ends.tolist()) == ([-1, -1, -1, -1, -1, 3], [-1, -1, -1, -1, -1, 5])
+
+    starts, ends = VectorPattern(b"[0-9]+x$").search_spans([b"ab12x", b"x", b"9x9x"])
+    assert (starts.tolist(), ends.tolist()) == ([2, -1, 2], [5, -1, 4])
+    assert len(match_column("a", [])) == 0
+    try:
+        match_column(b"a", ["a"])
+        assert False
+    except TypeError:
+        pass